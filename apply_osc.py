@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file brings an existing database (see create_and_fill_db.py) up to date
+with an OsmChange file, such as the daily .osc.gz diffs OpenStreetMap
+publishes, instead of rebuilding every table from a fresh extract.
+
+An OsmChange file holds <create>, <modify> and <delete> blocks of node, way
+and relation elements, each being the complete new version of the element
+(or, for delete, only its id). apply_changes() streams the file and:
+- for create and modify, shapes the element with data.shape_record, so the
+  same audit.py cleaning rules are applied as on a full load, and replaces
+  the element's row and all of its nodes_tags, ways_tags or ways_nodes rows
+- for delete, removes the element's row and all of its child rows
+Relations are skipped, since the database has no tables for them.
+
+The changes are applied batch_size elements at a time, each batch in one
+transaction. Only the last change to an element within a batch matters, as
+every change replaces the element as a whole. Every statement looks rows up
+by element id, through the primary keys in populate_db.sql and the unique
+indexes of index_db.sql, so the time taken depends on the size of the diff and
+not on the size of the database. Diffs have to be applied in the order they were
+published.
+
+If the database has the R*Tree spatial index of spatial.py, or a filled
+ways_geometry table (see node_store.py), the entries of the changed nodes and
+ways, and of the ways using a changed node, are updated in the same
+transaction.
+"""
+
+import argparse
+import sqlite3
+import xml.etree.cElementTree as ET
+
+import compression
+import create_and_fill_db
+import data
+import node_store
+import spatial
+import validation
+
+DB_PATH = 'london_osm.db'
+
+ACTIONS = ('create', 'modify', 'delete')
+BATCH_SIZE = 10000
+
+# Tables holding the element rows and the child rows of each element type
+ELEMENT_TABLES = {
+    'node': ('nodes', ('nodes_tags',)),
+    'way': ('ways', ('ways_tags', 'ways_nodes')),
+}
+
+
+def open_change_file(filename):
+    # .osc.gz, and .osc.bz2 or .osc.xz, are decompressed as they are read
+    return compression.open_input(filename)
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for each element of an OsmChange file,
+    freeing each element once the caller is done with it, as the action
+    blocks of a daily diff can be very large"""
+
+    with open_change_file(osc_file) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        action = None
+        action_elem = None
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                if depth == 2:
+                    action = elem.tag
+                    action_elem = elem
+                continue
+            depth -= 1
+            if depth == 2:
+                if action in ACTIONS:
+                    yield action, elem
+                action_elem.clear()
+            elif depth == 1:
+                root.clear()
+
+
+class ChangeBatch(object):
+    """The latest change to each element seen since the last flush"""
+
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+        self.changes = {}
+        self.spatial = spatial.has_spatial_index(db_conn)
+        # ways_geometry is only filled by process_map(..., geometry=True),
+        # and older databases do not have the table at all
+        self.geometry = db_conn.execute(
+            "SELECT count(*) FROM sqlite_master "
+            "WHERE name = 'ways_geometry';").fetchone()[0] == 1 and \
+            db_conn.execute(
+                'SELECT 1 FROM ways_geometry LIMIT 1;').fetchone() is not None
+        self.inserts = dict(
+            (table, create_and_fill_db.insert_statement(table, columns))
+            for table, columns in create_and_fill_db.TABLE_COLUMNS)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def add(self, action, tag, element_id, shaped):
+        self.changes[tag, element_id] = (action, shaped)
+
+    def flush(self):
+        if not self.changes:
+            return
+        with self.db_conn:
+            for tag, (table, child_tables) in ELEMENT_TABLES.iteritems():
+                ids = [(element_id,) for element_tag, element_id
+                       in self.changes if element_tag == tag]
+                for child_table in child_tables:
+                    self.db_conn.executemany(
+                        'DELETE FROM {} WHERE id = ?;'.format(child_table),
+                        ids)
+                self.db_conn.executemany(
+                    'DELETE FROM {} WHERE id = ?;'.format(table), ids)
+
+            rows = dict((table, []) for table in self.inserts)
+            for _, shaped in self.changes.itervalues():
+                if shaped is None:
+                    continue
+                if shaped.tag == 'node':
+                    rows['nodes'].append(shaped.node)
+                    rows['nodes_tags'].extend(shaped.tags)
+                else:
+                    rows['ways'].append(shaped.way)
+                    rows['ways_nodes'].extend(shaped.way_node_rows())
+                    rows['ways_tags'].extend(shaped.tags)
+            for table, _ in create_and_fill_db.TABLE_COLUMNS:
+                self.db_conn.executemany(self.inserts[table], rows[table])
+
+            if self.spatial or self.geometry:
+                node_ids = [element_id for tag, element_id in self.changes
+                            if tag == 'node']
+                way_ids = self._ways_using(node_ids)
+                way_ids.update(element_id for tag, element_id
+                               in self.changes if tag == 'way')
+                if self.spatial:
+                    spatial.update_spatial_index(self.db_conn, node_ids,
+                                                 way_ids)
+                if self.geometry:
+                    node_store.update_way_geometry(self.db_conn, way_ids)
+        self.changes.clear()
+
+    def _ways_using(self, node_ids):
+        way_ids = set()
+        for node_id in node_ids:
+            way_ids.update(row[0] for row in self.db_conn.execute(
+                'SELECT id FROM ways_nodes WHERE node_id = ?;', (node_id,)))
+        return way_ids
+
+
+def apply_changes(osc_file, dbname=DB_PATH, validate=False,
+                  batch_size=BATCH_SIZE):
+    """Apply the changes in osc_file to the database dbname and return the
+    number of elements of each (action, type) applied"""
+
+    validator = validation.SchemaValidator() if validate else None
+    counts = {}
+    db_conn = sqlite3.connect(dbname)
+    batch = ChangeBatch(db_conn)
+    try:
+        for action, element in iter_changes(osc_file):
+            if element.tag not in ELEMENT_TABLES:
+                continue
+            element_id = int(element.attrib['id'])
+            shaped = None
+            if action != 'delete':
+                shaped = data.shape_record(element)
+                if validator is not None:
+                    data.validate_element(shaped.as_dict(), validator)
+            batch.add(action, element.tag, element_id, shaped)
+            counts[action, element.tag] = \
+                counts.get((action, element.tag), 0) + 1
+            if len(batch) >= batch_size:
+                batch.flush()
+        batch.flush()
+    finally:
+        db_conn.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Apply an OsmChange (.osc or .osc.gz) file to the "
+        "database")
+    parser.add_argument('osc_file')
+    parser.add_argument('dbname', nargs='?', default=DB_PATH)
+    parser.add_argument('--validate', action='store_true')
+    args = parser.parse_args(argv)
+
+    counts = apply_changes(args.osc_file, args.dbname, args.validate)
+    for action in ACTIONS:
+        for tag in sorted(ELEMENT_TABLES):
+            print action, tag, counts.get((action, tag), 0)
+
+
+if __name__ == '__main__':
+    main()
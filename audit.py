@@ -8,20 +8,35 @@ This file audits the London OSM data in the following ways:
     unexpected street types to the appropriate ones in the expected list.
 - actually fix the street name in the function update_name which takes a
     string with street name as an argument and should return the fixed name.
+    update_name hands the work to a StreetNameNormalizer, which matches the
+    street type (the last word of the name) with one anchored regular
+    expression and looks it up in the mapping. Trailing whitespace is
+    dropped along with the street type. It also keeps recently normalized
+    names in a bounded LRU cache since the same street names come up again
+    and again, and starts a new cache when the mapping is edited, so it never
+    returns names cached for the mapping's old content.
+- clean tag values with the functions registered in the cleaners table,
+    which maps a tag "k" value (e.g. "addr:street") to the function cleaning
+    its "v" value. clean() does one dictionary lookup per tag, so tags no rule
+    applies to cost the same however many rules there are. Deterministic
+    cleaners, such as fix, remember the value they returned for each input,
+    up to a bounded number of the most recently used ones.
 
 NOTE: The concept of this code was taken from Udacity's OpenStreetMap Case
 Study Lesson and Quizzes.
 """
 
 
-import xml.etree.cElementTree as ET
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import re
 import pprint
 from datetime import datetime
 
+import osm_stream
+
 OSMFILE = "london_sample.osm"
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+last_word_re = re.compile(r'(?<!\S)\S+(?=\s*$)')
 
 
 expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place",
@@ -53,42 +68,141 @@ def is_up_for_fixing(elem):
     return (elem.attrib['k'] == 'fixme:date')
 
 
-def audit(osmfile):
-    osm_file = open(osmfile, "r")
-    street_types = defaultdict(set)
-    fixes = set()
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
+class StreetAuditCollector(object):
+    """osm_stream collector gathering unexpected street types and the dates
+    up for fixing"""
+
+    def __init__(self):
+        self.street_types = defaultdict(set)
+        self.fixes = set()
+
+    def element(self, elem):
         if elem.tag == "node" or elem.tag == "way":
             for tag in elem.iter("tag"):
                 if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
+                    audit_street_type(self.street_types, tag.attrib['v'])
                 elif is_up_for_fixing(tag):
-                    fixes.add(tag.attrib['v'])
-    osm_file.close()
-    return street_types, fixes
+                    self.fixes.add(tag.attrib['v'])
+
+    def result(self):
+        return self.street_types, self.fixes
+
+
+def audit(osmfile):
+    return osm_stream.run(osmfile, [StreetAuditCollector()])[0]
+
+
+class StreetNameNormalizer(object):
+    """Replace the street type at the end of a name with its mapping value,
+    caching up to cache_size results; mapping is copied, so later changes to
+    it do not reach the cached results"""
+
+    def __init__(self, mapping, cache_size=100000):
+        self.mapping = dict(mapping)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, name):
+        cache = self.cache
+        if name in cache:
+            self.hits += 1
+            better_name = cache.pop(name)
+            cache[name] = better_name
+            return better_name
+
+        self.misses += 1
+        m = last_word_re.search(name)
+        if m and m.group() in self.mapping:
+            better_name = name[:m.start()] + self.mapping[m.group()]
+        else:
+            better_name = name
+        cache[name] = better_name
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return better_name
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache), 'max_size': self.cache_size}
+
+
+# One normalizer per mapping dictionary, built the first time the mapping is
+# used; the mapping is kept alongside so its id() is not reused. Each
+# normalizer holds a copy of its mapping, and a mapping changed since then
+# gets a new normalizer instead of the names cached for its old content.
+normalizers = {}
+
+
+def get_normalizer(mapping):
+    entry = normalizers.get(id(mapping))
+    if entry is None or entry[1].mapping != mapping:
+        entry = (mapping, StreetNameNormalizer(mapping))
+        normalizers[id(mapping)] = entry
+    return entry[1]
 
 
 def update_name(name, mapping):
-    for key in mapping:
-        if key in name:
-            if name.endswith('.'):
-                if key.endswith('.'):
-                    name = name.replace(key, mapping[key])
-                    break
-                else:
-                    continue
-            else:
-                name = name.replace(key, mapping[key])
-    return name
+    return get_normalizer(mapping).normalize(name)
 
 
 def fix(to_fix):
+    fixed = to_fix
     datetime_object = datetime.strptime(to_fix, '%Y-%m-%d')
     if datetime_object > datetime.today():
         fixed = datetime.today().strftime('%Y-%m-%d')
     return fixed
 
 
+# Tag "k" value => function cleaning the tag's "v" value
+cleaners = {}
+
+
+def memoize(func, max_size=100000):
+    """Wrap func so that each distinct value is only cleaned once, keeping
+    the results of the max_size most recently used values"""
+    results = OrderedDict()
+
+    def memoized(value):
+        if value in results:
+            result = results.pop(value)
+        else:
+            result = func(value)
+            if len(results) >= max_size:
+                results.popitem(last=False)
+        results[value] = result
+        return result
+    return memoized
+
+
+def cleaner(key, deterministic=False):
+    """Register the decorated function as the cleaner for tag key"""
+    def register(func):
+        cleaners[key] = memoize(func) if deterministic else func
+        return func
+    return register
+
+
+@cleaner('addr:street')
+def clean_street_name(value):
+    # update_name caches its results already
+    return update_name(value, mapping)
+
+
+@cleaner('fixme:date', deterministic=True)
+def clean_fixme_date(value):
+    return fix(value)
+
+
+def clean(key, value):
+    """Return value cleaned by the cleaner registered for key, if any"""
+    func = cleaners.get(key)
+    if func is None:
+        return value
+    return func(value)
+
+
 if __name__ == '__main__':
     st_types, fixes = audit(OSMFILE)
     pprint.pprint(dict(st_types))
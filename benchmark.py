@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file times the whole pipeline, from the OSM file to the answers of
+explore.sql, to tell whether a change made it faster or slower.
+
+run_pipeline() takes an OSM file through every stage once, timing each of
+them on its own:
+  - parse, stepping through the elements with the parser in osm_parsers.py
+  - shape, data.shape_record on every node and way
+  - validate, data.validate_element on every shaped element
+  - csv_write, writing the rows to the five csv files with data.CsvOutput
+  - db_load, create_and_fill_db.fillTables of every csv file
+  - index_build, the indexes of index_db.sql and the R*Tree of spatial.py
+  - queries, every statement of explore.sql, one after the other and
+    without the result cache of explore.py
+The first four run in a single pass over the file, with a clock read between
+each of them. For each stage it records the seconds taken, the elements (or
+rows, or queries) handled per second, and the peak resident set size of the
+process so far.
+
+By default the input is a file written by synth_osm.py, so the numbers are
+comparable from one machine or checkout to the next. The results are
+compared with a JSON baseline saved by an earlier run, and every stage that
+handles TOLERANCE fewer items per second, or whose peak memory grew by
+TOLERANCE, is flagged as a regression; the exit status is then 1. Stages
+taking less than MIN_SECONDS are too noisy to compare and are only
+reported.
+
+Run it from the command line, e.g.
+
+    python benchmark.py --save-baseline       # on the main branch
+    python benchmark.py                       # on the change, to compare
+    python benchmark.py london_sample.osm --baseline london_baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import create_and_fill_db
+import data
+import explore
+import index_db
+import metrics
+import osm_parsers
+import spatial
+import sql_files
+import synth_osm
+import validation
+
+BASELINE_PATH = 'benchmark_baseline.json'
+# Share a stage may get slower, or grow in memory, before it is flagged
+TOLERANCE = 0.2
+# Stages quicker than this vary too much from run to run to be compared
+MIN_SECONDS = 0.05
+
+STAGES = ['parse', 'shape', 'validate', 'csv_write', 'db_load',
+          'index_build', 'queries']
+
+# Size of the synthetic file benchmarked when no file is given
+SYNTH_NODES = 200000
+SYNTH_WAYS = 30000
+SYNTH_SEED = 0
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TABLES = [table for table, _ in create_and_fill_db.TABLE_COLUMNS]
+
+
+def stage_result(seconds, count, unit):
+    return {'seconds': seconds, 'count': count, 'unit': unit,
+            'per_second': count / seconds if seconds > 0 else None,
+            'peak_rss': metrics.peak_rss()}
+
+
+def shape_and_write(osm_file, paths, backend=None):
+    """Parse, shape, validate and write every node and way of osm_file to
+    the csv files in paths, and return the seconds spent in each step and
+    the number of elements"""
+
+    validator = validation.SchemaValidator(data.SCHEMA)
+    seconds = dict.fromkeys(['parse', 'shape', 'validate', 'csv_write'], 0.0)
+    elements = 0
+    clock = time.time
+    with data.CsvOutput(paths) as output:
+        start = clock()
+        for element in osm_parsers.get_element(osm_file, ('node', 'way'),
+                                               backend):
+            parsed = clock()
+            shaped = data.shape_record(element)
+            shaped_at = clock()
+            data.validate_element(shaped.as_dict(), validator)
+            validated = clock()
+            output.write(shaped)
+            written = clock()
+
+            seconds['parse'] += parsed - start
+            seconds['shape'] += shaped_at - parsed
+            seconds['validate'] += validated - shaped_at
+            seconds['csv_write'] += written - validated
+            elements += 1
+            start = written
+    return seconds, elements
+
+
+def run_pipeline(osm_file, work_dir, backend=None):
+    """Take osm_file through every stage, writing into work_dir, and return
+    the results of each stage and the seconds each query took"""
+
+    stages = {}
+    paths = [os.path.join(work_dir, os.path.basename(path))
+             for path in data.CSV_PATHS]
+    seconds, elements = shape_and_write(osm_file, paths, backend)
+    for stage in ('parse', 'shape', 'validate', 'csv_write'):
+        stages[stage] = stage_result(seconds[stage], elements, 'elements')
+
+    dbname = os.path.join(work_dir, 'benchmark.db')
+    sql_files.createTablesFromFile(
+        os.path.join(HERE, data.POPULATE_DB_PATH), dbname)
+    start = time.time()
+    # CSV_PATHS and TABLE_COLUMNS list the tables in different orders
+    for path, table in zip(paths, ('nodes', 'nodes_tags', 'ways',
+                                   'ways_nodes', 'ways_tags')):
+        create_and_fill_db.fillTables(path, dbname, table)
+    load_seconds = time.time() - start
+    db_conn = sqlite3.connect(dbname)
+    rows = sum(db_conn.execute('SELECT count(*) FROM {};'.format(table))
+               .fetchone()[0] for table in TABLES)
+    db_conn.close()
+    stages['db_load'] = stage_result(load_seconds, rows, 'rows')
+
+    start = time.time()
+    index_db.createIndexes(dbname, os.path.join(HERE, 'index_db.sql'))
+    spatial.createSpatialIndex(dbname,
+                               os.path.join(HERE, spatial.SPATIAL_DB_PATH))
+    stages['index_build'] = stage_result(time.time() - start, rows, 'rows')
+
+    statements = sql_files.read_statements(os.path.join(HERE, 'explore.sql'))
+    start = time.time()
+    results = explore.run_queries(statements, dbname, workers=1,
+                                  cache_path=None)
+    stages['queries'] = stage_result(time.time() - start, len(statements),
+                                     'queries')
+    queries = [[explore.normalize_sql(result.statement), result.seconds]
+               for result in results]
+    return stages, queries
+
+
+def best_of(runs):
+    """Combine the results of repeated runs, keeping the quickest time of
+    each stage; the peak memory only ever grows from one run to the next,
+    so the first run's is kept"""
+    stages = {}
+    for stage in STAGES:
+        results = [run_stages[stage] for run_stages, _ in runs]
+        best = dict(min(results, key=lambda result: result['seconds']))
+        best['peak_rss'] = results[0]['peak_rss']
+        stages[stage] = best
+    queries = [[statement, min(seconds)] for statement, seconds in zip(
+        [statement for statement, _ in runs[0][1]],
+        zip(*[[seconds for _, seconds in run_queries]
+              for _, run_queries in runs]))]
+    return stages, queries
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Return a message for every stage of results that regressed against
+    baseline"""
+    regressions = []
+    for stage in STAGES:
+        now = results['stages'].get(stage)
+        before = baseline['stages'].get(stage)
+        if now is None or before is None:
+            continue
+        if before['seconds'] >= MIN_SECONDS and before['per_second'] and \
+                now['per_second'] is not None and \
+                now['per_second'] < before['per_second'] * (1 - tolerance):
+            regressions.append(
+                '{}: {:,.0f} {}/s, baseline {:,.0f} {}/s ({:+.0%})'.format(
+                    stage, now['per_second'], now['unit'],
+                    before['per_second'], before['unit'],
+                    now['per_second'] / before['per_second'] - 1))
+        if now['peak_rss'] > before['peak_rss'] * (1 + tolerance):
+            regressions.append(
+                '{}: peak RSS {:,} bytes, baseline {:,} bytes ({:+.0%})'
+                .format(stage, now['peak_rss'], before['peak_rss'],
+                        float(now['peak_rss']) / before['peak_rss'] - 1))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print '{:<12} {:>9} {:>14} {:>12} {:>10}'.format(
+        'stage', 'seconds', 'per second', 'peak RSS MB', 'baseline')
+    for stage in STAGES:
+        result = results['stages'][stage]
+        change = ''
+        if baseline is not None and stage in baseline['stages'] and \
+                baseline['stages'][stage]['per_second'] and \
+                result['per_second']:
+            change = '{:+.0%}'.format(
+                result['per_second'] /
+                baseline['stages'][stage]['per_second'] - 1)
+        print '{:<12} {:>9.3f} {:>14} {:>12.1f} {:>10}'.format(
+            stage, result['seconds'],
+            '{:,.0f} {}'.format(result['per_second'] or 0,
+                                result['unit'][0]),
+            result['peak_rss'] / 1048576.0, change)
+
+
+def benchmark(osm_file=None, repeat=1, backend=None, work_dir=None,
+              nodes=SYNTH_NODES, ways=SYNTH_WAYS, seed=SYNTH_SEED):
+    """Run the pipeline repeat times over osm_file, or over a synthetic
+    file when it is None, and return the results"""
+
+    remove = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        synthetic = None
+        if osm_file is None:
+            osm_file = os.path.join(work_dir, synth_osm.SYNTH_FILE)
+            synthetic = {'nodes': nodes, 'ways': ways, 'seed': seed}
+            synth_osm.generate(osm_file, nodes, ways, seed=seed)
+        runs = [run_pipeline(osm_file, work_dir, backend)
+                for _ in range(repeat)]
+        stages, queries = best_of(runs)
+        return {
+            'input': {'path': os.path.basename(osm_file),
+                      'bytes': os.path.getsize(osm_file),
+                      'synthetic': synthetic},
+            'python': platform.python_version(),
+            'parser': backend or os.environ.get(
+                'OSM_PARSER', osm_parsers.DEFAULT_BACKEND),
+            'repeat': repeat,
+            'stages': stages,
+            'queries': queries,
+        }
+    finally:
+        if remove:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time each stage of the pipeline and compare the "
+        "results with a baseline")
+    parser.add_argument('osm_file', nargs='?',
+                        help="OSM file to benchmark (default: a synthetic "
+                        "file from synth_osm.py)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs to take the quickest time of each stage "
+                        "from")
+    parser.add_argument('--parser', choices=sorted(osm_parsers.BACKENDS))
+    parser.add_argument('--nodes', type=int, default=SYNTH_NODES)
+    parser.add_argument('--ways', type=int, default=SYNTH_WAYS)
+    parser.add_argument('--seed', type=int, default=SYNTH_SEED)
+    parser.add_argument('--output', help="also write the results to this "
+                        "JSON file")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.osm_file, args.repeat, args.parser,
+                        nodes=args.nodes, ways=args.ways, seed=args.seed)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'rb') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'wb') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'wb') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print 'Saved the baseline to', args.baseline
+        return 0
+    if baseline is None:
+        print 'No baseline at {}; run with --save-baseline to make one' \
+            .format(args.baseline)
+        return 0
+
+    for setting in ('input', 'parser', 'python'):
+        if results[setting] != baseline.get(setting):
+            print 'Warning: the baseline was measured with a different ' \
+                '{}: {}'.format(setting, baseline.get(setting))
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print 'REGRESSION', regression
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file holds the checkpoints data.process_map writes so that a long run
+over a full extract can be resumed instead of started over.
+
+The OSM file is shaped in segments of about CHECKPOINT_BYTES (byte ranges
+found with osm_shards.py). Once every row of a segment has been written and
+flushed to disk, a checkpoint records:
+  - the size and modification time of the input, to tell if it has changed
+  - offset, the byte offset in the input where the next segment starts
+  - last_element, the type and id of the last element shaped
+  - for each csv file, its path, its size (position) and the number of rows
+    written to it so far, not counting the header
+The checkpoint file is replaced atomically, so a run killed at any moment
+leaves either the previous checkpoint or the new one behind.
+
+Resuming truncates every csv file back to the position in the checkpoint,
+which drops whatever was written after it, and carries on from offset. Each
+element is shaped on its own, so the csv files come out the same as in an
+uninterrupted run.
+
+RowCounter is the output (see data.shape_map) that keeps the row counts and
+the last element.
+"""
+
+import json
+import os
+
+CHECKPOINT_PATH = "process_map.checkpoint"
+
+# Bytes of the OSM file shaped between two checkpoints
+CHECKPOINT_BYTES = 64 << 20
+
+
+class RowCounter(object):
+    """Count the rows each shaped element adds to the five csv files, in
+    the order of data.CSV_PATHS, and remember the last element"""
+
+    def __init__(self, rows=None, last_element=None):
+        self.rows = list(rows) if rows is not None else [0] * 5
+        self.last_element = last_element
+
+    def write(self, shaped):
+        rows = self.rows
+        if shaped.tag == 'node':
+            rows[0] += 1
+            rows[1] += len(shaped.tags)
+            self.last_element = ('node', shaped.node.id)
+        elif shaped.tag == 'way':
+            rows[2] += 1
+            rows[3] += len(shaped.node_refs)
+            rows[4] += len(shaped.tags)
+            self.last_element = ('way', shaped.way.id)
+
+    def add(self, other):
+        """Add the counts of the next part of the file"""
+        self.rows = [a + b for a, b in zip(self.rows, other.rows)]
+        if other.last_element is not None:
+            self.last_element = other.last_element
+
+
+def input_stamp(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def make_state(filename, offset, counter, paths, positions):
+    return {
+        'input': input_stamp(filename),
+        'offset': offset,
+        'last_element': counter.last_element,
+        'outputs': [{'path': path, 'position': position, 'rows': rows}
+                    for path, position, rows
+                    in zip(paths, positions, counter.rows)],
+    }
+
+
+def save_checkpoint(path, state):
+    """Write state to path, replacing the previous checkpoint atomically"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """Return the state saved in path, or None if there is no checkpoint"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+def restore(state, filename, paths):
+    """Check that state belongs to this input and these csv files, truncate
+    the csv files to their checkpointed size and return a RowCounter with
+    the checkpointed counts"""
+    if state['input'] != input_stamp(filename):
+        raise ValueError("{} has changed since the checkpoint was "
+                         "written".format(filename))
+    outputs = state['outputs']
+    if [output['path'] for output in outputs] != list(paths):
+        raise ValueError("The checkpoint is for the csv files {}".format(
+            [output['path'] for output in outputs]))
+
+    for output in outputs:
+        if os.path.getsize(output['path']) < output['position']:
+            raise ValueError("{} is shorter than at the checkpoint".format(
+                output['path']))
+    for output in outputs:
+        with open(output['path'], 'r+b') as f:
+            f.truncate(output['position'])
+
+    last_element = state['last_element']
+    return RowCounter([output['rows'] for output in outputs],
+                      tuple(last_element) if last_element else None)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file exports the tables data.py produces as column files, and loads
+them back for analysis without going through the csv files or SQLite.
+
+Each table becomes a directory holding one NumPy .npy file per column:
+  - ids, uids, versions, changesets, positions and node ids as int64
+  - lat and lon as float64
+  - timestamps as datetime64[s], i.e. int64 seconds since 1970
+  - user, key, value and type dictionary encoded: an int32 code per row in
+    the .npy file, and the distinct strings, in code order, in a JSON list
+    next to it (<column>.dict.json)
+The .npy files are written without NumPy: the rows are gathered in typed
+arrays from the array module and written out behind a hand built .npy
+header, so the export works wherever data.py does.
+
+ColumnarOutput is an output for data.shape_map, so process_map(...,
+columnar_dir=...) writes the columns while it shapes the file; export_csvs()
+builds them from existing csv files instead.
+
+load_table() maps the columns back into memory. With NumPy installed they
+are memory mapped read-only numpy arrays, and value_counts() and
+count_equal() do their counting with numpy.bincount; without NumPy the
+columns are read into arrays from the array module and counted in Python.
+For example the contribution counts in explore.sql are
+
+    value_counts(load_table('columns', 'nodes'), 'user', top=10)
+"""
+
+import ast
+import calendar
+import csv
+import json
+import os
+import struct
+import sys
+from array import array
+from collections import Counter
+
+import compression
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+# Room reserved for the .npy header, so it can be rewritten with the final
+# row count once every row has been written
+NPY_HEADER_BYTES = 128
+
+ENDIAN = '<' if sys.byteorder == 'little' else '>'
+INT64 = ('l' if array('l').itemsize == 8 else 'q', ENDIAN + 'i8')
+INT32 = ('i', ENDIAN + 'i4')
+FLOAT64 = ('d', ENDIAN + 'f8')
+DATETIME = (INT64[0], ENDIAN + 'M8[s]')
+
+# Column kinds: (convert a csv or record value, (array typecode, npy dtype))
+INTEGER = 'integer'
+FLOAT = 'float'
+TIMESTAMP = 'timestamp'
+STRING = 'string'
+KINDS = {INTEGER: INT64, FLOAT: FLOAT64, TIMESTAMP: DATETIME, STRING: INT32}
+
+TABLE_COLUMNS = [
+    ('nodes', [('id', INTEGER), ('lat', FLOAT), ('lon', FLOAT),
+               ('user', STRING), ('uid', INTEGER), ('version', INTEGER),
+               ('changeset', INTEGER), ('timestamp', TIMESTAMP)]),
+    ('nodes_tags', [('id', INTEGER), ('key', STRING), ('value', STRING),
+                    ('type', STRING)]),
+    ('ways', [('id', INTEGER), ('user', STRING), ('uid', INTEGER),
+              ('version', INTEGER), ('changeset', INTEGER),
+              ('timestamp', TIMESTAMP)]),
+    ('ways_tags', [('id', INTEGER), ('key', STRING), ('value', STRING),
+                   ('type', STRING)]),
+    ('ways_nodes', [('id', INTEGER), ('node_id', INTEGER),
+                    ('position', INTEGER)]),
+]
+
+# Values buffered per column before they are appended to its file
+BUFFER_SIZE = 65536
+
+
+def npy_header(dtype, rows):
+    """Return a .npy version 1.0 header for a one dimensional array, padded
+    to NPY_HEADER_BYTES"""
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}" \
+        .format(dtype, rows)
+    header = header.ljust(NPY_HEADER_BYTES - len(NPY_MAGIC) - 2 - 1) + '\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+def read_npy_header(f):
+    """Return (dtype, rows) from the header of an open .npy file, leaving
+    the file at the start of the data"""
+    if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+        raise ValueError("Not a version 1.0 .npy file: {}".format(f.name))
+    header_length, = struct.unpack('<H', f.read(2))
+    header = ast.literal_eval(f.read(header_length))
+    return header['descr'], header['shape'][0]
+
+
+_days = {}
+
+
+def to_epoch(timestamp):
+    """Return the seconds since 1970 of a "2015-05-26T20:42:02Z" timestamp"""
+    day = timestamp[:10]
+    seconds = _days.get(day)
+    if seconds is None:
+        seconds = calendar.timegm((int(day[:4]), int(day[5:7]),
+                                   int(day[8:10]), 0, 0, 0))
+        _days[day] = seconds
+    return seconds + int(timestamp[11:13]) * 3600 + \
+        int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+
+class ColumnWriter(object):
+    """Append values of one kind to a .npy file"""
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.typecode, self.dtype = KINDS[kind]
+        self.rows = 0
+        self.buffer = array(self.typecode)
+        self.strings = {}
+        self.file = open(path, 'wb')
+        self.file.write(npy_header(self.dtype, 0))
+
+    def append(self, value):
+        kind = self.kind
+        if kind == INTEGER:
+            value = int(value)
+        elif kind == FLOAT:
+            value = float(value)
+        elif kind == TIMESTAMP:
+            value = to_epoch(value)
+        else:
+            if isinstance(value, str):
+                value = value.decode('utf-8')
+            code = self.strings.get(value)
+            if code is None:
+                code = self.strings[value] = len(self.strings)
+            value = code
+        self.buffer.append(value)
+        if len(self.buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.buffer.tofile(self.file)
+        self.rows += len(self.buffer)
+        self.buffer = array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.rows))
+        self.file.close()
+        if self.kind == STRING:
+            strings = sorted(self.strings, key=self.strings.get)
+            with open(dictionary_path(self.path), 'wb') as f:
+                json.dump(strings, f)
+
+
+def dictionary_path(npy_path):
+    return npy_path[:-len('.npy')] + '.dict.json'
+
+
+class TableWriter(object):
+    """Append rows, in the column order of TABLE_COLUMNS, to the column
+    files of a table"""
+
+    def __init__(self, directory, table):
+        table_dir = os.path.join(directory, table)
+        if not os.path.isdir(table_dir):
+            os.makedirs(table_dir)
+        self.writers = [
+            ColumnWriter(os.path.join(table_dir, name + '.npy'), kind)
+            for name, kind in dict(TABLE_COLUMNS)[table]]
+
+    def append(self, row):
+        for writer, value in zip(self.writers, row):
+            writer.append(value)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+class ColumnarOutput(object):
+    """Write shaped elements from data.shape_record to the column files of
+    each table under directory"""
+
+    def __init__(self, directory):
+        self.tables = dict((table, TableWriter(directory, table))
+                           for table, _ in TABLE_COLUMNS)
+
+    def write(self, shaped):
+        tables = self.tables
+        if shaped.tag == 'node':
+            tables['nodes'].append(shaped.node)
+            tables['nodes_tags'].extend(shaped.tags)
+        elif shaped.tag == 'way':
+            tables['ways'].append(shaped.way)
+            tables['ways_nodes'].extend(shaped.way_node_rows())
+            tables['ways_tags'].extend(shaped.tags)
+
+    def close(self):
+        for table in self.tables.itervalues():
+            table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def export_csvs(paths, directory):
+    """Write the column files of each table from the csv files in paths,
+    given in the order of TABLE_COLUMNS' tables nodes, nodes_tags, ways,
+    ways_nodes, ways_tags as data.CSV_PATHS lists them"""
+    tables = ('nodes', 'nodes_tags', 'ways', 'ways_nodes', 'ways_tags')
+    for table, path in zip(tables, paths):
+        columns = [name for name, _ in dict(TABLE_COLUMNS)[table]]
+        writer = TableWriter(directory, table)
+        try:
+            with compression.open_input(path) as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                indexes = [header.index(name) for name in columns]
+                for row in reader:
+                    writer.append([row[i] for i in indexes])
+        finally:
+            writer.close()
+
+
+# ================================================== #
+#               Loading                              #
+# ================================================== #
+class Table(object):
+    """The columns of a table, by name, and the strings of its dictionary
+    encoded columns"""
+
+    def __init__(self, columns, dictionaries):
+        self.columns = columns
+        self.dictionaries = dictionaries
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return len(next(self.columns.itervalues()))
+
+    def code(self, name, value):
+        """Return the code of value in a dictionary encoded column, or None
+        if it does not occur"""
+        try:
+            return self.dictionaries[name].index(value)
+        except ValueError:
+            return None
+
+    def decode(self, name, codes):
+        strings = self.dictionaries[name]
+        return [strings[code] for code in codes]
+
+
+def load_column(path):
+    """Return the values in a .npy file, memory mapped if NumPy is
+    installed"""
+    if numpy is not None:
+        return numpy.load(path, mmap_mode='r')
+    with open(path, 'rb') as f:
+        dtype, rows = read_npy_header(f)
+        for typecode, npy_dtype in KINDS.itervalues():
+            if npy_dtype == dtype:
+                values = array(typecode)
+                values.fromfile(f, rows)
+                return values
+    raise ValueError("Unsupported column type {} in {}".format(dtype, path))
+
+
+def load_table(directory, table):
+    columns = {}
+    dictionaries = {}
+    table_dir = os.path.join(directory, table)
+    for name, kind in dict(TABLE_COLUMNS)[table]:
+        path = os.path.join(table_dir, name + '.npy')
+        columns[name] = load_column(path)
+        if kind == STRING:
+            with open(dictionary_path(path), 'rb') as f:
+                dictionaries[name] = json.load(f)
+    return Table(columns, dictionaries)
+
+
+def value_counts(table, name, top=None):
+    """Return [(value, count), ...] of a dictionary encoded column, most
+    frequent first, like GROUP BY name ORDER BY count(*) DESC LIMIT top"""
+    strings = table.dictionaries[name]
+    codes = table[name]
+    if numpy is not None:
+        counts = numpy.bincount(codes, minlength=len(strings))
+        order = numpy.argsort(-counts, kind='mergesort')[:top]
+        return [(strings[code], int(counts[code])) for code in order]
+    counts = Counter(codes).most_common()
+    counts.sort(key=lambda item: (-item[1], item[0]))
+    return [(strings[code], count) for code, count in counts[:top]]
+
+
+def count_equal(table, name, value):
+    """Return the number of rows whose dictionary encoded column name holds
+    value, like SELECT count(*) ... WHERE name = value"""
+    code = table.code(name, value)
+    if code is None:
+        return 0
+    if numpy is not None:
+        return int(numpy.count_nonzero(table[name] == code))
+    return table[name].count(code)
+
+
+if __name__ == '__main__':
+    # Build the columns from the csv files written by data.py, then count
+    # the contributions per user as explore.sql does
+    export_csvs(['nodes.csv', 'nodes_tags.csv', 'ways.csv', 'ways_nodes.csv',
+                 'ways_tags.csv'], 'columns')
+    nodes = load_table('columns', 'nodes')
+    for user, contributions in value_counts(nodes, 'user', top=10):
+        print user, contributions
+    print count_equal(load_table('columns', 'nodes_tags'), 'value', 'cafe')
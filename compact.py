@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file holds the compact version of the database, whose tables are
+created by populate_db_compact.sql instead of populate_db.sql.
+
+In the tables of populate_db.sql every node and way repeats its user name,
+every tag row repeats its key and type, timestamps are 20 character strings
+and the version of a way is TEXT. The compact tables instead keep:
+  - each distinct (uid, user) pair once in the users table, and each
+    distinct (key, type) pair once in the tag_keys table, referenced from
+    the rows by integer id (user_id and key_id)
+  - timestamps as integer seconds since 1970, and versions as integers
+  - lat and lon as fixed point integers of 10^-7 degrees, the precision of
+    the OSM data, which fit in 32 bits
+The database takes less space, and the queries grouping or filtering on
+users and tag keys compare small integers rather than strings (see
+explore_compact.sql). The views nodes, nodes_tags, ways and ways_tags show
+the compact tables with the columns and values of populate_db.sql, so that
+explore.sql, spatial.py and node_store.py work on either database, and their
+triggers turn inserts into and deletes from the views into changes to the
+compact tables, so that create_and_fill_db.fillTables and apply_osc.py do
+too.
+
+Encoder assigns the dictionary ids in Python and turns shaped elements (see
+records.py) into rows of the compact tables. CompactSQLiteOutput inserts
+them, which is how data.process_map(..., dbname=..., compact_db=True) fills
+the compact database; and data.shape_element(element, encoder) returns the
+dictionary format of the compact rows.
+"""
+
+import columnar
+import create_and_fill_db
+
+POPULATE_DB_COMPACT_PATH = 'populate_db_compact.sql'
+INDEX_DB_COMPACT_PATH = 'index_db_compact.sql'
+EXPLORE_COMPACT_PATH = 'explore_compact.sql'
+
+# Fixed point coordinates are in units of 10^-7 degrees
+SCALE = 10 ** 7
+
+# Column order of each table in populate_db_compact.sql; the dictionary
+# tables come first so their rows are inserted before the rows using them
+COMPACT_TABLE_COLUMNS = [
+    ('users', ('id', 'uid', 'user')),
+    ('tag_keys', ('id', 'key', 'type')),
+    ('nodes_compact', ('id', 'lat', 'lon', 'user_id', 'version', 'changeset',
+                       'timestamp')),
+    ('nodes_tags_compact', ('id', 'key_id', 'value')),
+    ('ways_compact', ('id', 'user_id', 'version', 'changeset', 'timestamp')),
+    ('ways_tags_compact', ('id', 'key_id', 'value')),
+    ('ways_nodes', ('id', 'node_id', 'position')),
+]
+
+
+def to_fixed(value):
+    """Return a coordinate in degrees as an integer of 10^-7 degrees"""
+    if value is None or value == '':
+        return None
+    return int(round(float(value) * SCALE))
+
+
+def to_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+class Dictionary(object):
+    """Integer ids of the distinct values of a dictionary table, each value
+    being a tuple of its columns other than id; values not seen before get
+    the next id and are kept until taken with take_added()"""
+
+    def __init__(self, table, db_conn=None):
+        self.table = table
+        self.ids = {}
+        self.added = []
+        if db_conn is not None:
+            columns = dict(COMPACT_TABLE_COLUMNS)[table]
+            for row in db_conn.execute('SELECT {} FROM {};'.format(
+                    ', '.join(columns), table)):
+                self.ids[tuple(row[1:])] = row[0]
+        self.next_id = max(self.ids.itervalues()) + 1 if self.ids else 1
+
+    def id(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = self.next_id
+            self.next_id += 1
+            self.added.append((value_id,) + value)
+        return value_id
+
+    def take_added(self):
+        """Return the rows of the values added since the last call"""
+        added = self.added
+        self.added = []
+        return added
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Encoder(object):
+    """Turn the records.py rows of shaped elements into rows of the compact
+    tables, continuing the dictionaries of the database db_conn if given"""
+
+    def __init__(self, db_conn=None):
+        self.users = Dictionary('users', db_conn)
+        self.tag_keys = Dictionary('tag_keys', db_conn)
+
+    def user_id(self, row):
+        return self.users.id((to_int(row.uid), row.user))
+
+    def node(self, node):
+        return (int(node.id), to_fixed(node.lat), to_fixed(node.lon),
+                self.user_id(node), to_int(node.version),
+                to_int(node.changeset), columnar.to_epoch(node.timestamp))
+
+    def way(self, way):
+        return (int(way.id), self.user_id(way), to_int(way.version),
+                to_int(way.changeset), columnar.to_epoch(way.timestamp))
+
+    def tag(self, tag):
+        return (int(tag.id), self.tag_keys.id((tag.key, tag.type)), tag.value)
+
+    def rows(self, shaped):
+        """Return (table, rows) pairs of the rows of a shaped element,
+        preceded by the rows of any dictionary values it added"""
+        if shaped.tag == 'node':
+            rows = [('nodes_compact', [self.node(shaped.node)]),
+                    ('nodes_tags_compact', [self.tag(tag)
+                                            for tag in shaped.tags])]
+        else:
+            rows = [('ways_compact', [self.way(shaped.way)]),
+                    ('ways_nodes', shaped.way_node_rows()),
+                    ('ways_tags_compact', [self.tag(tag)
+                                           for tag in shaped.tags])]
+        return [('users', self.users.take_added()),
+                ('tag_keys', self.tag_keys.take_added())] + rows
+
+    def as_dict(self, shaped):
+        """Return a shaped element in the dictionary format of data.py,
+        with the columns of the compact tables"""
+        columns = dict(COMPACT_TABLE_COLUMNS)
+        rows = dict(self.rows(shaped))
+        if shaped.tag == 'node':
+            return {'node': dict(zip(columns['nodes_compact'],
+                                     rows['nodes_compact'][0])),
+                    'node_tags': [dict(zip(columns['nodes_tags_compact'],
+                                           row))
+                                  for row in rows['nodes_tags_compact']]}
+        return {'way': dict(zip(columns['ways_compact'],
+                                rows['ways_compact'][0])),
+                'way_nodes': [dict(zip(columns['ways_nodes'], row))
+                              for row in rows['ways_nodes']],
+                'way_tags': [dict(zip(columns['ways_tags_compact'], row))
+                             for row in rows['ways_tags_compact']]}
+
+
+class CompactSQLiteOutput(create_and_fill_db.SQLiteOutput):
+    """Insert shaped elements from data.shape_record into the compact tables
+    of dbname, created from populate_db_compact.sql"""
+
+    def __init__(self, dbname, batch_size=create_and_fill_db.BATCH_SIZE,
+                 rows_per_transaction=create_and_fill_db.ROWS_PER_TRANSACTION):
+        super(CompactSQLiteOutput, self).__init__(
+            dbname, batch_size, rows_per_transaction, COMPACT_TABLE_COLUMNS)
+        self.encoder = Encoder(self.db_conn)
+
+    def write(self, shaped):
+        if shaped.tag in ('node', 'way'):
+            for table, rows in self.encoder.rows(shaped):
+                self._add(table, rows)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file lets the readers and writers of the pipeline work on gzip, bzip2
+and xz compressed files directly, so that an extract shipped as .osm.bz2
+never has to be decompressed to disk.
+
+The compression of a file is told by its extension: .gz, .bz2 or .xz.
+open_input() returns a file object reading the decompressed bytes of such a
+file, and the file itself for any other; open_output() likewise returns a
+file object compressing what is written to it. The parsers in
+osm_parsers.py, osm_stream.py, sampling_osm.py and apply_osc.py open their
+input with open_input, data.process_map can write the csv files compressed,
+and create_and_fill_db.fillTables reads them back.
+
+DecompressedFile streams the file through a decompressor object, a chunk at
+a time, and starts a new decompressor whenever a stream ends, so files made
+of several concatenated gzip members or bzip2 or xz streams are read whole
+(the bz2 module of Python 2 stops after the first bzip2 stream). Its raw
+attribute is the compressed file underneath, whose position tells how much
+of the input has been read (see metrics.py).
+
+bzip2 is slow to decompress, slower than parsing. Extracts compressed with
+pbzip2, such as the planet files, are a series of independent streams, so
+with workers > 1 DecompressedFile splits the compressed file at the stream
+boundaries and decompresses runs of streams in a pool of worker processes,
+in order, a few runs ahead of the reader. A file that turns out to be a
+single stream is decompressed in this process instead.
+
+Reading .xz files needs the lzma module (backports.lzma on Python 2).
+"""
+
+import bz2
+import multiprocessing
+import os
+import re
+import zlib
+from collections import deque
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+GZIP = '.gz'
+BZIP2 = '.bz2'
+XZ = '.xz'
+EXTENSIONS = (GZIP, BZIP2, XZ)
+
+GZIP_LEVEL = 6
+BZIP2_LEVEL = 9
+
+# Compressed bytes read at a time
+READ_SIZE = 1 << 18
+# Uncompressed bytes gathered before they are handed to the compressor
+WRITE_BUFFER = 1 << 16
+
+# The start of a bzip2 stream: its header, then the magic number of its
+# first block
+BZ2_STREAM_START = re.compile(r'BZh[1-9]1AY&SY')
+# Compressed bytes of whole streams decompressed by one worker task
+BZ2_TASK_BYTES = 1 << 20
+# Without a stream boundary in this many bytes the file is taken to be a
+# single stream
+BZ2_MAX_PENDING = 16 << 20
+
+
+def extension(filename):
+    """Return the compression extension of filename, or ''"""
+    for ext in EXTENSIONS:
+        if filename.endswith(ext):
+            return ext
+    return ''
+
+
+def is_compressed(filename):
+    return isinstance(filename, basestring) and extension(filename) != ''
+
+
+def find_file(path):
+    """Return path, or else the first compressed variant of it (path.gz,
+    path.bz2, path.xz) that exists, or else path"""
+    if os.path.exists(path):
+        return path
+    for ext in EXTENSIONS:
+        if os.path.exists(path + ext):
+            return path + ext
+    return path
+
+
+def _lzma():
+    if lzma is None:
+        raise ImportError("Reading and writing .xz files needs the lzma "
+                          "module; pip install backports.lzma")
+    return lzma
+
+
+def new_decompressor(ext):
+    if ext == GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if ext == BZIP2:
+        return bz2.BZ2Decompressor()
+    return _lzma().LZMADecompressor()
+
+
+def new_compressor(ext):
+    if ext == GZIP:
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                16 + zlib.MAX_WBITS)
+    if ext == BZIP2:
+        return bz2.BZ2Compressor(BZIP2_LEVEL)
+    return _lzma().LZMACompressor()
+
+
+def decompress(decompressor, data, ext):
+    """Feed data to decompressor, starting a new decompressor for each
+    stream that follows the end of a stream; return the decompressed bytes
+    and the decompressor for the data still to come"""
+    out = []
+    while data:
+        try:
+            out.append(decompressor.decompress(data))
+        except EOFError:
+            # the stream ended exactly at the end of the previous data
+            decompressor = new_decompressor(ext)
+            continue
+        data = decompressor.unused_data
+        if data:
+            decompressor = new_decompressor(ext)
+    return ''.join(out), decompressor
+
+
+def serial_chunks(raw, ext, data=''):
+    """Yield the decompressed bytes of the open file raw, a chunk at a
+    time, starting with the compressed bytes data already read from it"""
+    decompressor = new_decompressor(ext)
+    while True:
+        if data:
+            out, decompressor = decompress(decompressor, data, ext)
+            if out:
+                yield out
+        data = raw.read(READ_SIZE)
+        if not data:
+            return
+
+
+def decompress_bz2_streams(data):
+    """Decompress a run of whole bzip2 streams, in a worker process"""
+    return decompress(bz2.BZ2Decompressor(), data, BZIP2)[0]
+
+
+def bz2_stream_runs(raw):
+    """Yield (data, whole) for runs of about BZ2_TASK_BYTES of the open
+    bzip2 file raw; whole is False for a last run that ended up without a
+    stream boundary in BZ2_MAX_PENDING bytes, the rest of raw being unread"""
+    pending = ''
+    while True:
+        data = raw.read(READ_SIZE)
+        if not data:
+            if pending:
+                yield pending, True
+            return
+        pending += data
+        while len(pending) > BZ2_TASK_BYTES:
+            match = BZ2_STREAM_START.search(pending, BZ2_TASK_BYTES)
+            if match is None:
+                break
+            yield pending[:match.start()], True
+            pending = pending[match.start():]
+        if len(pending) > BZ2_MAX_PENDING:
+            yield pending, False
+            return
+
+
+def parallel_bz2_chunks(raw, workers):
+    """Yield the decompressed bytes of the open bzip2 file raw in order,
+    decompressing its streams in a pool of worker processes"""
+    pool = multiprocessing.Pool(workers)
+    in_flight = deque()
+    try:
+        for data, whole in bz2_stream_runs(raw):
+            if not whole:
+                while in_flight:
+                    yield in_flight.popleft().get()
+                for chunk in serial_chunks(raw, BZIP2, data):
+                    yield chunk
+                break
+            in_flight.append(pool.apply_async(decompress_bz2_streams,
+                                              (data,)))
+            if len(in_flight) > 2 * workers:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+        pool.close()
+    finally:
+        # when the file is closed before its end, let the tasks in flight
+        # finish: terminating the pool while a worker is sending back its
+        # result can leave it waiting forever
+        for result in in_flight:
+            result.wait()
+        pool.terminate()
+        pool.join()
+
+
+class DecompressedFile(object):
+    """Read-only file object of the decompressed bytes of the gzip, bzip2
+    or xz file filename, decompressing bzip2 streams in workers processes
+    if workers > 1"""
+
+    def __init__(self, filename, workers=1):
+        self.name = filename
+        self.workers = workers
+        self._ext = extension(filename)
+        if self._ext == XZ:
+            _lzma()
+        self._open()
+
+    def _open(self):
+        self.raw = open(self.name, 'rb')
+        if self._ext == BZIP2 and self.workers > 1:
+            self._chunks = parallel_bz2_chunks(self.raw, self.workers)
+        else:
+            self._chunks = serial_chunks(self.raw, self._ext)
+        self._buffer = ''
+        self._start = 0
+        self._position = 0
+
+    def _fill(self):
+        """Add the next decompressed chunk to the buffer, returning False at
+        the end of the file"""
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buffer = self._buffer[self._start:] + chunk
+        self._start = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            size = len(self._buffer) - self._start
+        while len(self._buffer) - self._start < size and self._fill():
+            pass
+        data = self._buffer[self._start:self._start + size]
+        self._start += len(data)
+        self._position += len(data)
+        return data
+
+    def readline(self):
+        while True:
+            index = self._buffer.find('\n', self._start)
+            if index != -1:
+                return self.read(index + 1 - self._start)
+            if not self._fill():
+                return self.read()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def tell(self):
+        """Return the position in the decompressed bytes"""
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to offset in the decompressed bytes; going back means
+        decompressing the file again from the start"""
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence != os.SEEK_SET:
+            raise IOError("Compressed files can only seek from the start "
+                          "or the current position")
+        if offset < self._position:
+            self.close()
+            self._open()
+        while self._position < offset:
+            if not self.read(min(offset - self._position, READ_SIZE)):
+                break
+
+    def close(self):
+        self._chunks.close()
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CompressedFile(object):
+    """Write-only file object compressing what is written to it into the
+    gzip, bzip2 or xz file filename; with append=True the compressed
+    stream is added after the streams already in the file"""
+
+    def __init__(self, filename, append=False):
+        self.name = filename
+        self.raw = open(filename, 'ab' if append else 'wb')
+        self._compressor = new_compressor(extension(filename))
+        self._pending = []
+        self._pending_bytes = 0
+        self._position = 0
+
+    def _compress(self):
+        data = self._compressor.compress(''.join(self._pending))
+        if data:
+            self.raw.write(data)
+        self._pending = []
+        self._pending_bytes = 0
+
+    def write(self, data):
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        self._position += len(data)
+        if self._pending_bytes >= WRITE_BUFFER:
+            self._compress()
+
+    def tell(self):
+        """Return the uncompressed bytes written"""
+        return self._position
+
+    def close(self):
+        if self.raw.closed:
+            return
+        self._compress()
+        self.raw.write(self._compressor.flush())
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_input(filename, workers=1):
+    """Open filename for reading its decompressed bytes; workers > 1
+    decompresses a multi-stream .bz2 file in parallel"""
+    if is_compressed(filename):
+        return DecompressedFile(filename, workers)
+    return open(filename, 'rb')
+
+
+def open_output(filename, append=False):
+    """Open filename for writing, compressed if its extension says so"""
+    if is_compressed(filename):
+        return CompressedFile(filename, append)
+    return open(filename, 'ab' if append else 'wb')
@@ -11,20 +11,32 @@ NOTE: The concept of this code was taken from Udacity's OpenStreetMap Case
 Study Lesson and Quizzes.
 """
 
-import xml.etree.cElementTree as ET
 import pprint
 
+import osm_stream
 
-def count_tags(filename):
-        parse_tree = ET.iterparse(filename)
-        tag_dict = {}
-        for event, item in parse_tree:
+
+class TagCounter(object):
+    """osm_stream collector counting how often each tag name appears"""
+
+    def __init__(self):
+        self.tag_dict = {}
+
+    def element(self, elem):
+        tag_dict = self.tag_dict
+        for item in elem.iter():
             current_tag = item.tag
             if current_tag not in tag_dict:
                 tag_dict[current_tag] = 1
             else:
                 tag_dict[current_tag] += 1
-        return tag_dict
+
+    def result(self):
+        return self.tag_dict
+
+
+def count_tags(filename):
+        return osm_stream.run(filename, [TagCounter()])[0]
 
 
 if __name__ == "__main__":
@@ -4,89 +4,214 @@
 """
 This file creates and fills the necessary database tables.
 
-The function createTablesFromFile() takes in the following variables:
-  - filename, this pertains to the sql file you wish to read in and execute its
-    queries
-  - dbname, which is the name of the database being altered or created, if no
-    such database exists then the function will create a new one
-With these variables, createTablesFromFile reads and executes the queries from
-the sql file, in our case populate_db.sql which drops and creates tables, into
-the database we specied, in our case london_osm.db.
-
-The next function fillTables takes in the variables:
+The tables are created with sql_files.createTablesFromFile, which reads and
+executes the queries from the sql file, in our case populate_db.sql which
+drops and creates tables, into the database we specied, in our case
+london_osm.db.
+
+The function fillTables takes in the variables:
   - csv_file, which is the csv file you wish to read and transfer into the
-    database
+    database; a .csv.gz, .csv.bz2 or .csv.xz file, as written by
+    data.process_map(..., csv_compression=...), is decompressed as it is read
   - dbname, the name of the database you are filling
   - table, the name of the table you wish to fill with the information from
     the csv file
-  - columns, is a string containing the name of the columns in the order they
-    appear in the tuple
-  - tup_shape, a string describing the number of columns in each row that will
-    be inserted; it has the form (?, ?, ?) if say the table to be filled is
-    made of three columns
-fillTables reads in the csv file using DictReader from the csv module,
-populates a list of tuples with the information to be inserted into the table,
-and finally executes the insert query.
+  - columns, optionally a string such as '(id, key, value)' naming the
+    columns to fill; by default every column in the csv header is used
+  - tup_shape, kept for older callers; the placeholders are now built from
+    the columns
+  - batch_size, the number of rows inserted and committed at a time
+  - metrics, optionally a metrics.Metrics to report the progress through the
+    csv file, the rows inserted and the time spent reading and inserting to
+fillTables streams the csv file with the csv module, picks each column by its
+name in the header row, and inserts the rows batch_size at a time, so memory
+use stays flat however large the file is. Rows are inserted with INSERT OR
+IGNORE, so nodes and ways repeating an id already in the table (the PRIMARY
+KEY in populate_db.sql) are dropped by the database. The child tables have no
+UNIQUE constraints to check row by row while loading; index_db.createIndexes
+deletes their repeated rows once the load is done and builds unique indexes
+on their keys.
+
+SQLiteOutput skips the csv files altogether: data.process_map(..., dbname=...)
+hands it every shaped element and it inserts the rows in batches with
+executemany, inside large transactions, with the bulk load PRAGMAs in
+BULK_LOAD_PRAGMAS switched on while it loads.
+
+The compact schema of populate_db_compact.sql (see compact.py) can be filled
+the same way: fillTables inserts into its views, whose triggers store the
+rows in the compact tables.
 """
 
+import os
 import sqlite3
 import csv
+import time
+from itertools import islice
 from pprint import pprint
 
+import compression
+import index_db
+import metrics
+import spatial
+import sql_files
 
-def createTablesFromFile(filename, dbname):
-    open_file = open(filename, 'r')
-    sql_file = open_file.read()
+# Column order of each table in populate_db.sql (and of the csv files)
+TABLE_COLUMNS = [
+    ('nodes', ('id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset',
+               'timestamp')),
+    ('nodes_tags', ('id', 'key', 'value', 'type')),
+    ('ways', ('id', 'user', 'uid', 'version', 'changeset', 'timestamp')),
+    ('ways_tags', ('id', 'key', 'value', 'type')),
+    ('ways_nodes', ('id', 'node_id', 'position')),
+]
 
-    sql_commands = sql_file.split(';')
-    db_conn = sqlite3.connect(dbname)
-    cursor = db_conn.cursor()
+# Trade durability for speed while the database is being (re)built; a load
+# that dies half way is simply run again
+BULK_LOAD_PRAGMAS = [
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    ('cache_size', '-262144'),
+    ('temp_store', 'MEMORY'),
+]
+AFTER_LOAD_PRAGMAS = [
+    ('journal_mode', 'DELETE'),
+    ('synchronous', 'FULL'),
+]
 
-    for command in sql_commands:
-        try:
-            cursor.execute(command)
-            db_conn.commit()
-        except Exception, msg:
-            print "Command skipped: ", msg
-    db_conn.close()
-    open_file.close()
-
-
-def fillTables(csv_file, dbname, table, columns, tup_shape):
-    with open(csv_file, 'rb') as f:
-        csv_dict = csv.DictReader(f)
-        to_insert = set()
-        for item in csv_dict:
-            item_values = [(value.decode("utf-8"), ) for (key, value) in
-                           item.items()]
-            item_tuple = (None, )
-            for i in range(len(item_values)):
-                curr_item = item_values[i]
-                item_tuple += curr_item
-            to_insert.add(item_tuple[1:])
+BATCH_SIZE = 10000
+ROWS_PER_TRANSACTION = 500000
+
+
+def apply_pragmas(db_conn, pragmas):
+    for name, value in pragmas:
+        db_conn.execute('PRAGMA {} = {};'.format(name, value))
+
+
+def insert_statement(table, columns):
+    return "INSERT OR IGNORE INTO {} ({}) VALUES ({});".format(
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+
+def fillTables(csv_file, dbname, table, columns=None, tup_shape=None,
+               batch_size=BATCH_SIZE, metrics=None):
+    with compression.open_input(csv_file) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if columns is None:
+            columns = header
+        else:
+            columns = [c.strip() for c in columns.strip('() ').split(',')]
+        indexes = [header.index(column) for column in columns]
+
+        rows = ([row[i].decode("utf-8") for i in indexes] for row in reader)
 
         db_conn = sqlite3.connect(dbname)
-        cursor = db_conn.cursor()
-        insert_string = "INSERT INTO {} {} VALUES {};".format(table, columns,
-                                                              tup_shape)
-        cursor.executemany(insert_string, to_insert)
-        db_conn.commit()
+        apply_pragmas(db_conn, BULK_LOAD_PRAGMAS)
+        insert_string = insert_statement(table, columns)
+        if metrics is not None:
+            metrics.watch(f)
+        while True:
+            start = time.time()
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            read = time.time()
+            db_conn.executemany(insert_string, batch)
+            db_conn.commit()
+            if metrics is not None:
+                metrics.add('csv read', read - start)
+                metrics.add('db insert', time.time() - read)
+                metrics.add_rows(table, len(batch))
+                metrics.poll()
+        if metrics is not None:
+            metrics.unwatch()
+        apply_pragmas(db_conn, AFTER_LOAD_PRAGMAS)
         db_conn.close()
 
 
+class SQLiteOutput(object):
+    """Insert shaped elements from data.shape_record straight into the
+    tables of dbname; their rows are already in the column order of
+    TABLE_COLUMNS (compact.CompactSQLiteOutput passes its own
+    table_columns)"""
+
+    def __init__(self, dbname, batch_size=BATCH_SIZE,
+                 rows_per_transaction=ROWS_PER_TRANSACTION,
+                 table_columns=TABLE_COLUMNS):
+        self.db_conn = sqlite3.connect(dbname)
+        apply_pragmas(self.db_conn, BULK_LOAD_PRAGMAS)
+        self.batch_size = batch_size
+        self.rows_per_transaction = rows_per_transaction
+        self.uncommitted = 0
+        self.table_columns = table_columns
+
+        self.inserts = {}
+        self.pending = {}
+        for table, columns in table_columns:
+            self.inserts[table] = insert_statement(table, columns)
+            self.pending[table] = []
+
+    def _add(self, table, rows):
+        pending = self.pending[table]
+        pending.extend(rows)
+        if len(pending) >= self.batch_size:
+            self._flush(table)
+
+    def _flush(self, table):
+        pending = self.pending[table]
+        if not pending:
+            return
+        self.db_conn.executemany(self.inserts[table], pending)
+        self.uncommitted += len(pending)
+        del pending[:]
+        if self.uncommitted >= self.rows_per_transaction:
+            self.db_conn.commit()
+            self.uncommitted = 0
+
+    def write(self, shaped):
+        if shaped.tag == 'node':
+            self._add('nodes', [shaped.node])
+            self._add('nodes_tags', shaped.tags)
+        elif shaped.tag == 'way':
+            self._add('ways', [shaped.way])
+            self._add('ways_nodes', shaped.way_node_rows())
+            self._add('ways_tags', shaped.tags)
+
+    def close(self):
+        for table, _ in self.table_columns:
+            self._flush(table)
+        self.db_conn.commit()
+        apply_pragmas(self.db_conn, AFTER_LOAD_PRAGMAS)
+        self.db_conn.close()
+
+
 if __name__ == '__main__':
     sqlite_db_file = 'london_osm.db'
+    csv_files = [('nodes.csv', 'nodes'), ('nodes_tags.csv', 'nodes_tags'),
+                 ('ways.csv', 'ways'), ('ways_tags.csv', 'ways_tags'),
+                 ('ways_nodes.csv', 'ways_nodes')]
+    # written by data.process_map(..., geometry=True)
+    if os.path.exists(compression.find_file('ways_geometry.csv')):
+        csv_files.append(('ways_geometry.csv', 'ways_geometry'))
+    # or nodes.csv.gz and so on, if the csv files were written compressed
+    csv_files = [(compression.find_file(csv_file), table)
+                 for csv_file, table in csv_files]
+
+    # Print a progress line every few seconds and keep the numbers in
+    # create_and_fill_db_metrics.json
+    load_metrics = metrics.Metrics('create_and_fill_db_metrics.json')
+    load_metrics.total_bytes = sum(os.path.getsize(csv_file)
+                                   for csv_file, _ in csv_files)
+
+    # For the compact schema of compact.py, create the tables from
+    # populate_db_compact.sql instead (the rows go in through its views) and
+    # build the indexes of index_db_compact.sql
+    sql_files.createTablesFromFile('populate_db.sql', sqlite_db_file)
+    for csv_file, table in csv_files:
+        fillTables(csv_file, sqlite_db_file, table, metrics=load_metrics)
 
-    createTablesFromFile('populate_db.sql', sqlite_db_file)
-    fillTables('nodes.csv', sqlite_db_file, 'nodes',
-               '(changeset, uid, timestamp, lon, version, user, lat, id)',
-               '(?, ?, ?, ?, ?, ?, ?, ?)')
-    fillTables('nodes_tags.csv', sqlite_db_file, 'nodes_tags',
-               '(value, type, id, key)', '(?, ?, ?, ?)')
-    fillTables('ways.csv', sqlite_db_file, 'ways',
-               '(changeset, uid, timestamp, version, user, id)',
-               '(?, ?, ?, ?, ?, ?)')
-    fillTables('ways_tags.csv', sqlite_db_file, 'ways_tags',
-               '(value, type, id, key)', '(?, ?, ?, ?)')
-    fillTables('ways_nodes.csv', sqlite_db_file, 'ways_nodes',
-               '(position, node_id, id)', '(?, ?, ?)')
+    # Build the secondary and spatial indexes only now that every row is in
+    with load_metrics.stage('index build'):
+        index_db.createIndexes(sqlite_db_file)
+        spatial.createSpatialIndex(sqlite_db_file)
+    load_metrics.close()
@@ -11,14 +11,22 @@ ways_nodes.csv, and ways_tags.csv.
 
 The process for this transformation is as follows:
 - Use iterparse to iteratively step through each top level element in the XML
+  (or one of the faster parsing backends in osm_parsers.py, or the .osm.pbf
+  reader in osm_pbf.py)
 - Shape each element into several data structures using a custom function
 - Utilize a schema and validation library to ensure the transformed data is in
-  the correct format
-- Write each data structure to the appropriate .csv files
+  the correct format (validation.py compiles the schema once into plain
+  checks, and can validate only every n-th or a random fraction of elements)
+- Write each data structure to the appropriate .csv files, and/or insert it
+  straight into the SQLite database (see create_and_fill_db.SQLiteOutput)
 
 The shape_element function transforms each iterparse Element object into a
 dictionary with the correct format, described below. We validate the output
 against a schema, described in the schema.py file, to ensure correctness.
+Internally the pipeline uses shape_record, which shapes the same information
+into the compact namedtuple rows and nd ref arrays defined in records.py that
+the csv and database writers consume directly; shape_element is that record
+turned into the dictionary format.
 
 ### If the element top level tag is "node":
 The dictionary returned has the format {"node": .., "node_tags": ...}
@@ -156,15 +164,34 @@ Study Lesson and Quizzes.
 """
 
 import csv
-import codecs
+import itertools
+import multiprocessing
+import os
 import pprint
 import re
-import xml.etree.cElementTree as ET
-
-import cerberus
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
 
 import schema
 import audit
+import checkpoint
+import columnar
+import compact
+import compression
+import records
+import create_and_fill_db
+import index_db
+import metrics
+import node_store
+import osm_parsers
+import osm_pbf
+import osm_shards
+import spatial
+import sql_files
+import validation
 
 OSM_PATH = "london_sample.osm"
 
@@ -173,6 +200,9 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+WAYS_GEOMETRY_PATH = "ways_geometry.csv"
+
+POPULATE_DB_PATH = "populate_db.sql"
 
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
@@ -187,117 +217,96 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+WAYS_GEOMETRY_FIELDS = list(records.WayGeometry._fields)
 
+CSV_PATHS = (NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH,
+             WAY_TAGS_PATH)
+CSV_FIELDS = (NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS,
+              WAY_TAGS_FIELDS)
 
-def shape_element(element, node_attr_fields=NODE_FIELDS,
-                  way_attr_fields=WAY_FIELDS, problem_chars=PROBLEMCHARS,
-                  default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
+# Compressions the csv files can be written with
+CSV_COMPRESSIONS = ('gz', 'bz2', 'xz')
 
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []
+# Shards per worker process when converting in parallel; more shards than
+# workers keeps the pool busy when some parts of the file are denser
+SHARDS_PER_WORKER = 4
 
-    if element.tag == 'node':
-        node_atts = element.attrib
-        node_children = element.getchildren()
-        for field in node_attr_fields:
-            if field not in node_atts and field == 'user':
-                node_attribs[field] = 'NO_USER'
-            elif field not in node_atts and field == 'uid':
-                node_attribs[field] = 0
-            else:
-                node_attribs[field] = node_atts[field]
+# Rows gathered by UnicodeWriter, and elements by CsvOutput, before they are
+# written out in one block
+WRITE_BATCH_SIZE = 4096
+
+
+def shape_tag(element_id, child, default_tag_type='regular',
+              clean=audit.clean):
+    """Clean and shape a tag child of an element into a records.Tag"""
+
+    child_atts = child.attrib
+    k = child_atts['k']
+    if ':' in k:
+        tag_type, key = k.split(':', 1)
+    else:
+        tag_type, key = default_tag_type, k
+    return records.Tag(element_id, key, clean(k, child_atts['v']), tag_type)
 
-            if len(node_children) == 0:
-                tags = []
-            else:
-                for child in node_children:
-                    child_dict = {}
-                    child_atts = child.attrib
-                    for field in NODE_TAGS_FIELDS:
-                        if field == 'id':
-                            child_dict[field] = node_atts[field]
-                        elif field == 'key':
-                            if ':' in child_atts['k']:
-                                child_dict['type'], child_dict[field] = \
-                                    child_atts['k'].split(':', 1)
-                            else:
-                                child_dict[field] = child_atts['k']
-                                child_dict['type'] = 'regular'
-                        elif field == 'value':
-                            if audit.is_street_name(child):
-                                child_dict[field] = audit.update_name(
-                                    child_atts['v'], audit.mapping)
-                            elif audit.is_up_for_fixing(child):
-                                child_dict[field] = audit.fix(child_atts['v'])
-                            else:
-                                child_dict[field] = child_atts['v']
-                    tags.append(child_dict)
-        return {'node': node_attribs, 'node_tags': tags}
+
+def shape_record(element, clean=audit.clean):
+    """Clean and shape node or way XML element to a records.ShapedNode or
+    records.ShapedWay, cleaning the tag values with clean"""
+
+    atts = element.attrib
+    if element.tag == 'node':
+        node_id = atts['id']
+        node = records.Node(node_id, atts['lat'], atts['lon'],
+                            atts.get('user', 'NO_USER'), atts.get('uid', 0),
+                            atts['version'], atts['changeset'],
+                            atts['timestamp'])
+        tags = [shape_tag(node_id, child, clean=clean) for child in element]
+        return records.ShapedNode(node, tags)
 
     elif element.tag == 'way':
-        way_atts = element.attrib
-        way_children = element.getchildren()
-        for field in way_attr_fields:
-            way_attribs[field] = way_atts[field]
-            if len(way_children) == 0:
-                tags = []
-                way_nodes = []
-            else:
-                counter = 0
-                for child in way_children:
-                    if child.tag == 'tag':
-                        child_dict = {}
-                        child_atts = child.attrib
-                        for field in WAY_TAGS_FIELDS:
-                            if field == 'id':
-                                child_dict[field] = way_atts[field]
-                            elif field == 'key':
-                                if ':' in child_atts['k']:
-                                    child_dict['type'], child_dict[field] = \
-                                        child_atts['k'].split(':', 1)
-                                else:
-                                    child_dict[field] = child_atts['k']
-                                    child_dict['type'] = 'regular'
-                            elif field == 'value':
-                                if audit.is_street_name(child):
-                                    child_dict[field] = audit.update_name(
-                                        child_atts['v'], audit.mapping)
-                                elif audit.is_up_for_fixing(child):
-                                    child_dict[field] = audit.fix(
-                                        child_atts['v'])
-                                else:
-                                    child_dict[field] = child_atts['v']
-                        tags.append(child_dict)
-                    elif child.tag == 'nd':
-                        child_dict = {}
-                        child_atts = child.attrib
-                        for field in WAY_NODES_FIELDS:
-                            if field == 'id':
-                                child_dict[field] = way_atts[field]
-                            elif field == 'node_id':
-                                child_dict[field] = child_atts['ref']
-                            else:
-                                child_dict[field] = counter
-                                counter += 1
-                        way_nodes.append(child_dict)
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        way_id = atts['id']
+        way = records.Way(way_id, atts['user'], atts['uid'], atts['version'],
+                          atts['changeset'], atts['timestamp'])
+        tags = []
+        node_refs = records.new_refs()
+        for child in element:
+            if child.tag == 'tag':
+                tags.append(shape_tag(way_id, child, clean=clean))
+            elif child.tag == 'nd':
+                node_refs.append(int(child.attrib['ref']))
+        return records.ShapedWay(way, tags, node_refs)
+
+
+def shape_element(element, encoder=None):
+    """Clean and shape node or way XML element to Python dict; with encoder,
+    a compact.Encoder, the dict holds the columns of the compact tables"""
+
+    shaped = shape_record(element)
+    if shaped is not None:
+        if encoder is not None:
+            return encoder.as_dict(shaped)
+        return shaped.as_dict()
 
 
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend=None,
+                workers=None):
+    """Yield element if it is the right type of tag, parsed with one of the
+    backends in osm_parsers.py"""
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    return osm_parsers.get_element(osm_file, tags, backend, workers)
+
+
+def csv_paths(csv_compression=None, paths=CSV_PATHS):
+    """Return paths, with the extension of csv_compression ('gz', 'bz2' or
+    'xz') added if it is set"""
+    if csv_compression is None:
+        return tuple(paths)
+    if csv_compression not in CSV_COMPRESSIONS:
+        raise ValueError("Unknown csv compression: {}".format(csv_compression))
+    return tuple('{}.{}'.format(path, csv_compression) for path in paths)
 
 
 def validate_element(element, validator, schema=SCHEMA):
@@ -311,63 +320,614 @@ def validate_element(element, validator, schema=SCHEMA):
         raise Exception(message_string.format(field, error_string))
 
 
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
+class Lines(list):
+    """A list csv.writer can write its lines to"""
+    write = list.append
+
+
+def encode_row(row):
+    return [v.encode('utf-8') if isinstance(v, unicode) else v for v in row]
+
+
+class UnicodeWriter(object):
+    """csv.writer for rows given as tuples in field order, such as the
+    records.py namedtuples, handling Unicode input.
+
+    Rows are gathered into batches of batch_size, each formatted by a single
+    csv.writer.writerows call and written to f in one block; only the rows
+    csv cannot write as they are, those with non-ASCII unicode values, are
+    encoded first. flush() writes out a partial batch, and must be called
+    before f is closed."""
+
+    def __init__(self, f, fieldnames, batch_size=WRITE_BATCH_SIZE):
+        self.f = f
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.rows = []
+        self.lines = Lines()
+        self.writer = csv.writer(self.lines)
+
+    def writeheader(self):
+        self.writerow(self.fieldnames)
 
     def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v
-            in row.iteritems()
-        })
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
 
     def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        rows = self.rows
+        if not rows:
+            return
+        lines = self.lines
+        remaining = iter(rows)
+        while True:
+            try:
+                self.writer.writerows(remaining)
+                break
+            except UnicodeEncodeError:
+                # every row before the one that failed added a line, and
+                # writerows carries on after it
+                self.writer.writerow(encode_row(rows[len(lines)]))
+        del rows[:]
+        self.f.write(''.join(lines))
+        del lines[:]
 
 
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file, \
-        codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-        codecs.open(WAYS_PATH, 'w') as ways_file, \
-        codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-        codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file,
-                                             NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+class CsvOutput(object):
+    """Write shaped elements to the five csv files named in paths, or with
+    append=True add them to the end of the existing files; paths ending in
+    .gz, .bz2 or .xz are written compressed (see compression.py). The rows
+    of every WRITE_BATCH_SIZE elements are written out together"""
+
+    def __init__(self, paths, write_header=True, append=False):
+        self.files = [compression.open_output(path, append)
+                      for path in paths]
+        if append:
+            for f in self.files:
+                if not compression.is_compressed(f.name):
+                    f.seek(0, os.SEEK_END)
+        (self.nodes_writer, self.node_tags_writer, self.ways_writer,
+         self.way_nodes_writer, self.way_tags_writer) = [
+            UnicodeWriter(f, fields)
+            for f, fields in zip(self.files, CSV_FIELDS)]
+
+        if write_header:
+            self.nodes_writer.writeheader()
+            self.node_tags_writer.writeheader()
+            self.ways_writer.writeheader()
+            self.way_nodes_writer.writeheader()
+            self.way_tags_writer.writeheader()
+
+        # the writers' batches, added to directly
+        (self.node_rows, self.node_tag_rows, self.way_rows,
+         self.way_node_rows, self.way_tag_rows) = [
+            writer.rows for writer in self.writers()]
+        self.elements = 0
+
+    def write(self, shaped):
+        if shaped.tag == 'node':
+            self.node_rows.append(shaped.node)
+            self.node_tag_rows.extend(shaped.tags)
+        elif shaped.tag == 'way':
+            self.way_rows.append(shaped.way)
+            self.way_node_rows.extend(shaped.way_node_rows())
+            self.way_tag_rows.extend(shaped.tags)
+        self.elements += 1
+        if self.elements >= WRITE_BATCH_SIZE:
+            self.flush()
+
+    def writers(self):
+        return (self.nodes_writer, self.node_tags_writer, self.ways_writer,
+                self.way_nodes_writer, self.way_tags_writer)
+
+    def flush(self):
+        """Write out the rows gathered so far"""
+        for writer in self.writers():
+            writer.flush()
+        self.elements = 0
+
+    def sync(self):
+        """Flush the files to disk and return their sizes"""
+        self.flush()
+        for f in self.files:
+            f.flush()
+            os.fsync(f.fileno())
+        return [f.tell() for f in self.files]
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def shape_map(source, outputs, validate, sampler=None, metrics=None,
+              workers=None):
+    """Shape each node and way in source and hand it to every output,
+    timing each step in metrics (a metrics.Metrics) if given; a .osm.pbf
+    source is decoded in workers processes"""
+
+    validator = validation.SchemaValidator(SCHEMA)
+    if sampler is None:
+        sampler = validation.ValidationSampler()
+    if metrics is not None:
+        return measure_shape_map(source, outputs, validate, sampler,
+                                 validator, metrics, workers)
+
+    for element in get_element(source, tags=('node', 'way'),
+                               workers=workers):
+        shaped = shape_record(element)
+        if shaped is not None:
+            if validate is True and sampler():
+                validate_element(shaped.as_dict(), validator)
+
+            for output in outputs:
+                output.write(shaped)
+
+
+def measure_shape_map(source, outputs, validate, sampler, validator,
+                      metrics, workers=None):
+    """shape_map, with a clock read between the steps of every element"""
+
+    opened = None
+    if isinstance(source, basestring) and not osm_pbf.is_pbf(source):
+        source = opened = compression.open_input(source)
+    if hasattr(source, 'tell'):
+        # osm_shards.ShardFile.tell is the position in the whole file, and
+        # for a compressed file the position in the compressed file is
+        # counted
+        metrics.watch(source, offset=0)
+
+    seconds = metrics.seconds
+    calls = metrics.calls
+    clean = metrics.timed('clean', audit.clean)
+    writes = [(output, 'write ' + type(output).__name__)
+              for output in outputs]
+    clock = time.time
+    try:
+        start = clock()
+        for element in get_element(source, tags=('node', 'way'),
+                                   workers=workers):
+            parsed = clock()
+            cleaning = seconds['clean']
+            shaped = shape_record(element, clean)
+            shaped_at = clock()
+            seconds['parse'] += parsed - start
+            calls['parse'] += 1
+            # the cleaning is a stage of its own
+            seconds['shape'] += shaped_at - parsed - \
+                (seconds['clean'] - cleaning)
+            calls['shape'] += 1
+            if shaped is None:
+                start = clock()
+                continue
+
+            if validate is True and sampler():
+                validate_element(shaped.as_dict(), validator)
+                validated = clock()
+                seconds['validate'] += validated - shaped_at
+                calls['validate'] += 1
+                shaped_at = validated
+
+            for output, stage in writes:
+                output.write(shaped)
+                written = clock()
+                seconds[stage] += written - shaped_at
+                calls[stage] += 1
+                shaped_at = written
+            metrics.counter.write(shaped)
+            metrics.tick()
+            start = clock()
+    finally:
+        metrics.unwatch()
+        if opened is not None:
+            opened.close()
+
+
+def write_csvs(source, paths, validate, write_header=True, sampler=None,
+               extra_outputs=(), metrics=None, workers=None):
+    """Shape each node and way in source and write the rows to the five csv
+    files named in paths, and hand them to any extra_outputs"""
+
+    with CsvOutput(paths, write_header) as output:
+        shape_map(source, [output] + list(extra_outputs), validate, sampler,
+                  metrics, workers)
+
+
+def process_shard(task):
+    """Write the rows of one shard of the OSM file to headerless partial csv
+    files in a scratch directory and return their paths along with the
+    checkpoint.RowCounter of the shard"""
+
+    (file_in, index, start, end, prolog, validate, sampler, scratch_dir,
+     csv_files) = task
+    # nodes.csv.gz becomes nodes.csv.00003.gz, compressed the same way
+    paths = []
+    for path in csv_files:
+        ext = compression.extension(path)
+        paths.append(os.path.join(scratch_dir, '{0}.{1:05d}{2}'.format(
+            path[:len(path) - len(ext)], index, ext)))
+    paths = tuple(paths)
+    if sampler is not None:
+        sampler = sampler.for_shard(index)
+    counter = checkpoint.RowCounter()
+    with osm_shards.ShardFile(file_in, start, end, prolog) as shard:
+        with CsvOutput(paths, write_header=False) as output:
+            shape_map(shard, [output, counter], validate, sampler)
+    return paths, counter
+
+
+def shape_shards(file_in, prolog, ranges, validate, workers, sampler=None,
+                 paths=CSV_PATHS):
+    """Shape the byte ranges of the OSM file in a pool of worker processes,
+    yielding the partial csv file paths and RowCounter of each range in
+    file order, compressed like paths; the partial files are removed once
+    the caller moves on"""
+
+    scratch_dir = tempfile.mkdtemp(prefix='osm_shards_', dir='.')
+    tasks = [(file_in, i, start, end, prolog, validate, sampler, scratch_dir,
+              paths)
+             for i, (start, end) in enumerate(ranges)]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        # imap hands back the shards in order, so each one can be used and
+        # removed as soon as it and its predecessors are done
+        for partials, counter in pool.imap(process_shard, tasks):
+            yield partials, counter
+            for partial in partials:
+                os.remove(partial)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def append_partials(outputs, partials):
+    for output, partial in zip(outputs, partials):
+        with open(partial, 'rb') as f:
+            shutil.copyfileobj(f, output)
+
+
+def count_shard(metrics, end, counter):
+    """Add a shard shaped by a worker process, ending at byte end, to
+    metrics"""
+    metrics.set_bytes_read(end)
+    metrics.counter.add(counter)
+    metrics.tick(counter.rows[0] + counter.rows[2])
+
+
+def process_map_parallel(file_in, validate, workers, sampler=None,
+                         metrics=None, paths=CSV_PATHS):
+    """Shape shards of the OSM file in a pool of worker processes and merge
+    their partial csv files, in file order, into the five csv files"""
+
+    prolog, ranges = osm_shards.find_shard_offsets(
+        file_in, workers * SHARDS_PER_WORKER)
+    if metrics is not None:
+        metrics.set_bytes_read(ranges[0][0])
+    # The partial files are compressed by the workers, so they are copied
+    # byte for byte after the header: a series of gzip members or of bzip2
+    # or xz streams makes a valid file
+    with CsvOutput(paths):
+        pass
+    outputs = [open(path, 'ab') for path in paths]
+    try:
+        shards = shape_shards(file_in, prolog, ranges, validate, workers,
+                              sampler, paths)
+        for (_, end), (partials, counter) in itertools.izip(ranges, shards):
+            if metrics is None:
+                append_partials(outputs, partials)
+                continue
+            with metrics.stage('merge csv'):
+                append_partials(outputs, partials)
+            count_shard(metrics, end, counter)
+    finally:
+        for f in outputs:
+            f.close()
+
+
+def process_map_resumable(file_in, validate, workers=1, sampler=None,
+                          checkpoint_path=checkpoint.CHECKPOINT_PATH,
+                          resume=False,
+                          checkpoint_bytes=checkpoint.CHECKPOINT_BYTES,
+                          metrics=None):
+    """Shape the OSM file into the csv files segment by segment, writing a
+    checkpoint (see checkpoint.py) after each one; with resume=True, carry
+    on from the checkpoint in checkpoint_path, if there is one"""
+
+    state = checkpoint.load_checkpoint(checkpoint_path) if resume else None
+    if state is not None:
+        counter = checkpoint.restore(state, file_in, CSV_PATHS)
+        start = state['offset']
+    else:
+        counter = checkpoint.RowCounter()
+        start = None
+
+    remaining = os.path.getsize(file_in) - (start or 0)
+    segments = max(-(-remaining // checkpoint_bytes),
+                   workers * SHARDS_PER_WORKER if workers > 1 else 1)
+    prolog, ranges = osm_shards.find_shard_offsets(file_in, segments, start)
+    if metrics is not None:
+        metrics.set_bytes_read(ranges[0][0])
+
+    with CsvOutput(CSV_PATHS, write_header=state is None,
+                   append=state is not None) as output:
+
+        def save(offset):
+            checkpoint.save_checkpoint(checkpoint_path, checkpoint.make_state(
+                file_in, offset, counter, CSV_PATHS, output.sync()))
+
+        if state is None:
+            save(ranges[0][0])
+
+        if workers > 1:
+            shards = shape_shards(file_in, prolog, ranges, validate, workers,
+                                  sampler)
+            for (_, end), (partials, shard_counter) in itertools.izip(
+                    ranges, shards):
+                append_partials(output.files, partials)
+                counter.add(shard_counter)
+                save(end)
+                if metrics is not None:
+                    count_shard(metrics, end, shard_counter)
+        else:
+            for segment_start, end in ranges:
+                with osm_shards.ShardFile(file_in, segment_start, end,
+                                          prolog) as shard:
+                    shape_map(shard, [output, counter], validate, sampler,
+                              metrics)
+                save(end)
+
+
+def write_way_geometry(nodes, dbname=None, write_csv=True,
+                       way_nodes_path=WAY_NODES_PATH,
+                       geometry_path=WAYS_GEOMETRY_PATH):
+    """Second pass of process_map(..., geometry=True): stream the ways_nodes
+    rows, from ways_nodes.csv or else the database, and write the geometry
+    of every way worked out from the node locations in nodes to
+    ways_geometry.csv and/or the ways_geometry table"""
+
+    db_conn = sqlite3.connect(dbname) if dbname is not None else None
+    csv_file = compression.open_output(geometry_path) if write_csv else None
+    try:
+        if write_csv:
+            way_node_rows = node_store.way_nodes_from_csv(way_nodes_path)
+            writer = UnicodeWriter(csv_file, WAYS_GEOMETRY_FIELDS)
+            writer.writeheader()
+        else:
+            way_node_rows = node_store.way_nodes_from_db(db_conn)
+        geometries = node_store.iter_way_geometry(nodes, way_node_rows)
+        insert = create_and_fill_db.insert_statement('ways_geometry',
+                                                     WAYS_GEOMETRY_FIELDS)
+        while True:
+            batch = list(itertools.islice(geometries,
+                                          create_and_fill_db.BATCH_SIZE))
+            if not batch:
+                break
+            if csv_file is not None:
+                writer.writerows(batch)
+            if db_conn is not None:
+                db_conn.executemany(insert, batch)
+        if csv_file is not None:
+            writer.flush()
+        if db_conn is not None:
+            db_conn.commit()
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+        if db_conn is not None:
+            db_conn.close()
+
+
+@contextmanager
+def measured(metrics, stage):
+    """Time the body of a with statement as stage in metrics, if given"""
+    if metrics is None:
+        yield
+    else:
+        with metrics.stage(stage):
+            yield
+
+
+def process_map(file_in, validate, workers=1, sampler=None, dbname=None,
+                write_csv=True, build_indexes=True, checkpoint_path=None,
+                resume=False, geometry=False, sparse_nodes=True,
+                columnar_dir=None, metrics=None, csv_compression=None,
+                compact_db=False):
+    """Iteratively process each XML element and write to csv(s)
+
+    With workers > 1 the file is split at top level element boundaries and
+    the shards are shaped in parallel; the csv files written are the same.
+    A validation.ValidationSampler passed as sampler limits validation to
+    every n-th or a random fraction of the elements.
+
+    With dbname set, the tables from populate_db.sql are (re)created in that
+    database and the shaped rows are inserted straight into them, skipping
+    the csv round trip through create_and_fill_db.fillTables; pass
+    write_csv=False to only fill the database. The secondary indexes from
+    index_db.sql and the R*Tree spatial index from spatial_db.sql are built
+    once all rows are in, unless build_indexes=False. With compact_db=True
+    the database gets the compact tables of populate_db_compact.sql and the
+    indexes of index_db_compact.sql instead (see compact.py).
+
+    With checkpoint_path set, the csv files are written segment by segment
+    with a checkpoint after each one, and resume=True carries on from the
+    last checkpoint of a run that was interrupted (see checkpoint.py).
+
+    With geometry=True the node locations are kept in a node_store.NodeStore
+    (sparse_nodes=False for its dense mode, for the planet file) and a
+    second pass writes the bounding box, centroid and length of every way to
+    ways_geometry.csv and/or the ways_geometry table.
+
+    With columnar_dir set, every table is also written as .npy column files
+    under that directory (see columnar.py).
+
+    With metrics set to a metrics.Metrics, the time spent in each stage, the
+    rows written and the progress through the file are reported while it
+    runs; worker processes are reported on as each of their shards is
+    merged.
+
+    A file_in ending in .gz, .bz2 or .xz is decompressed as it is parsed
+    (see compression.py); it cannot be split into shards, so workers > 1
+    instead decompresses the streams of a multi-stream .bz2 file in
+    parallel. With csv_compression set to 'gz', 'bz2' or 'xz' the csv files
+    are written compressed, as nodes.csv.gz and so on, which
+    create_and_fill_db.fillTables reads back as they are. Checkpoints need
+    an uncompressed file_in and csv files.
+    """
+
+    if resume and checkpoint_path is None:
+        checkpoint_path = checkpoint.CHECKPOINT_PATH
+    compressed = compression.is_compressed(file_in)
+    if checkpoint_path is not None and (dbname is not None or
+                                        osm_pbf.is_pbf(file_in)):
+        raise ValueError("Checkpoints are only written when shaping an "
+                         "XML file into csv files")
+    if checkpoint_path is not None and (compressed or
+                                        csv_compression is not None):
+        raise ValueError("Checkpoints need uncompressed input and csv files")
+    paths = csv_paths(csv_compression)
+    # .osm.pbf blobs are decoded in workers processes by osm_pbf.py, and a
+    # compressed file is decompressed in parallel instead
+    parallel = workers > 1 and not osm_pbf.is_pbf(file_in) and \
+        not compressed
+    if dbname is not None and parallel:
+        raise ValueError("Loading into a database runs in a single process")
+    if compact_db and dbname is None:
+        raise ValueError("The compact schema needs a dbname")
+    # Otherwise the elements are shaped in worker processes or over several
+    # runs, and the extra outputs are built from the csv files afterwards
+    in_process = checkpoint_path is None and not parallel
+    if metrics is not None:
+        metrics.total_bytes = os.path.getsize(file_in)
+
+    nodes = node_store.NodeStore(sparse=sparse_nodes) if geometry else None
+    columns = None
+    extra_outputs = []
+    source = compression.open_input(file_in, workers) if compressed \
+        else file_in
+    try:
+        if in_process:
+            if nodes is not None:
+                extra_outputs.append(nodes)
+            if columnar_dir is not None:
+                columns = columnar.ColumnarOutput(columnar_dir)
+                extra_outputs.append(columns)
+
+        if checkpoint_path is not None:
+            process_map_resumable(file_in, validate, workers, sampler,
+                                  checkpoint_path, resume, metrics=metrics)
+        elif dbname is None:
+            if parallel:
+                process_map_parallel(file_in, validate, workers, sampler,
+                                     metrics, paths)
+            else:
+                write_csvs(source, paths, validate, sampler=sampler,
+                           extra_outputs=extra_outputs, metrics=metrics,
+                           workers=workers)
+        else:
+            if compact_db:
+                sql_files.createTablesFromFile(
+                    compact.POPULATE_DB_COMPACT_PATH, dbname)
+                db_output = compact.CompactSQLiteOutput(dbname)
+            else:
+                sql_files.createTablesFromFile(POPULATE_DB_PATH, dbname)
+                db_output = create_and_fill_db.SQLiteOutput(dbname)
+            try:
+                if write_csv:
+                    with CsvOutput(paths) as csv_output:
+                        shape_map(source, [db_output, csv_output] +
+                                  extra_outputs, validate, sampler, metrics,
+                                  workers)
+                else:
+                    shape_map(source, [db_output] + extra_outputs,
+                              validate, sampler, metrics, workers)
+            finally:
+                db_output.close()
+
+        if columns is not None:
+            columns.close()
+            columns = None
+        elif columnar_dir is not None:
+            with measured(metrics, 'columnar export'):
+                columnar.export_csvs(paths, columnar_dir)
+
+        if nodes is not None:
+            with measured(metrics, 'way geometry'):
+                if not in_process:
+                    # the nodes were shaped elsewhere; read them back
+                    nodes.fill_from_csv(paths[0])
+                write_way_geometry(nodes, dbname, write_csv, paths[3],
+                                   csv_paths(csv_compression,
+                                             [WAYS_GEOMETRY_PATH])[0])
+    finally:
+        if compressed:
+            source.close()
+        if columns is not None:
+            columns.close()
+        if nodes is not None:
+            nodes.close()
+
+    if dbname is not None and build_indexes:
+        with measured(metrics, 'index build'):
+            if compact_db:
+                index_db.createIndexes(dbname, compact.INDEX_DB_COMPACT_PATH)
+            else:
+                index_db.createIndexes(dbname)
+            spatial.createSpatialIndex(dbname)
+    if metrics is not None:
+        metrics.close()
 
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
+    # Note: The schema is compiled once (see validation.py), so validating
+    # every element is cheap enough for the whole map. On very large files,
+    # pass sampler=validation.ValidationSampler(every=100) to only check
+    # every 100th element.
     process_map(OSM_PATH, validate=True)
+
+    # To fill london_osm.db directly, without create_and_fill_db.py:
+    # process_map(OSM_PATH, validate=False, dbname='london_osm.db')
+
+    # The same, with the smaller compact tables of compact.py:
+    # process_map(OSM_PATH, validate=False, dbname='london_osm.db',
+    #             compact_db=True)
+
+    # For a full extract, shape the file on every core instead:
+    # process_map(OSM_PATH, validate=False,
+    #             workers=multiprocessing.cpu_count())
+
+    # To also work out the bounding box, centroid and length of every way:
+    # process_map(OSM_PATH, validate=False, geometry=True)
+
+    # For runs long enough to be worth resuming if they are interrupted:
+    # process_map(OSM_PATH, validate=False,
+    #             checkpoint_path='process_map.checkpoint', resume=True)
+
+    # To also write every table as .npy column files for analysis:
+    # process_map(OSM_PATH, validate=False, columnar_dir='columns')
+
+    # To print a progress line every 10 seconds, with the share of the time
+    # spent in each stage, and keep the numbers in metrics.json:
+    # process_map(OSM_PATH, validate=True, metrics=metrics.Metrics())
+
+    # To read a compressed extract, decompressing a pbzip2 file on every
+    # core, and write gzipped csv files:
+    # process_map('london_data.osm.bz2', validate=False,
+    #             workers=multiprocessing.cpu_count(), csv_compression='gz')
@@ -5,29 +5,260 @@
 This file reads in and executes the queries from a sql file created solely for
 exploring a database. In our case this file will read in and execute the
 queries from a file called explore.sql on the database london_osm.db.
+
+The function executeQueriesFromFile() takes in the following variables:
+  - filename, the sql file holding the queries, in our case explore.sql
+  - dbname, the database they run against, in our case london_osm.db
+  - workers, the number of queries run at the same time
+  - cache_path, the file results are cached in, or None to not cache them
+  - cache_bytes, the most bytes of results the cache keeps
+It prints the results of every query in file order, each followed by how
+long the query took.
+
+The queries only read the database, so they do not depend on each other:
+run_queries() hands them to a pool of threads, each borrowing one of
+ConnectionPool's read-only connections (PRAGMA query_only) while it runs a
+query. sqlite releases the GIL while it works, so the queries really do run
+side by side.
+
+ResultCache keeps the rows of each query in a small SQLite database,
+cache_path. A result is keyed on the query text, with whitespace outside
+quoted literals collapsed, and on a fingerprint of the database file: its
+size, its modification time and the change counter sqlite keeps in the file
+header, which goes up with every committed write. Rerunning explore.sql
+against a database that has not changed therefore reads every result from
+the cache without opening the database at all, while any change to it
+misses every entry. Once the cached rows take more than cache_bytes, the
+least recently used results are evicted.
 """
 
-import sqlite3
+import cPickle as pickle
+import hashlib
+import multiprocessing
+import os
 import pprint
+import re
+import sqlite3
+import struct
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+
+import sql_files
+
+CACHE_PATH = 'explore_cache.db'
+# Bytes of pickled rows kept in the cache before results are evicted
+CACHE_BYTES = 64 << 20
+# sqlite releases the GIL while it runs a query, so one thread per core
+QUERY_WORKERS = multiprocessing.cpu_count()
+
+# Offset of the file change counter in the header of a sqlite database
+CHANGE_COUNTER = struct.Struct('>I')
+CHANGE_COUNTER_OFFSET = 24
+
+# Quoted literals and identifiers, kept as they are when normalizing
+QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+WHITESPACE = re.compile(r'\s+')
+# Queries whose result can change without the database changing
+NONDETERMINISTIC = re.compile(r"\brandom(?:blob)?\s*\(|'now'", re.IGNORECASE)
+
+QueryResult = namedtuple('QueryResult',
+                         ['statement', 'rows', 'seconds', 'cached', 'error'])
+
+
+def normalize_sql(statement):
+    """Return statement with runs of whitespace outside quoted literals
+    collapsed into a single space, and without a trailing ;"""
+    parts = QUOTED.split(statement.strip().rstrip(';').strip())
+    return ''.join(part if i % 2 else WHITESPACE.sub(' ', part)
+                   for i, part in enumerate(parts))
+
+
+def database_fingerprint(dbname):
+    """Return a string that changes whenever the database file is written
+    to"""
+    stat = os.stat(dbname)
+    with open(dbname, 'rb') as f:
+        f.seek(CHANGE_COUNTER_OFFSET)
+        header = f.read(CHANGE_COUNTER.size)
+    counter = CHANGE_COUNTER.unpack(header)[0] \
+        if len(header) == CHANGE_COUNTER.size else 0
+    fingerprint = [os.path.abspath(dbname), stat.st_size, stat.st_mtime,
+                   counter]
+    # in WAL mode commits go to the -wal file and leave the header alone
+    wal = dbname + '-wal'
+    if os.path.exists(wal):
+        wal_stat = os.stat(wal)
+        fingerprint += [wal_stat.st_size, wal_stat.st_mtime]
+    return repr(fingerprint)
+
+
+class ResultCache(object):
+    """Rows of earlier queries, keyed on the normalized query text and a
+    database fingerprint, kept in the SQLite database path and bounded to
+    max_bytes of pickled rows"""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.db_conn = sqlite3.connect(path)
+        self.db_conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY NOT NULL, rows BLOB NOT NULL, '
+            'size INTEGER NOT NULL, seconds REAL, last_used REAL);')
+        self.db_conn.commit()
+
+    @staticmethod
+    def key(statement, fingerprint):
+        statement = normalize_sql(statement)
+        if isinstance(statement, unicode):
+            statement = statement.encode('utf-8')
+        return hashlib.sha1(fingerprint + '\0' + statement).hexdigest()
 
+    def get(self, key):
+        """Return (rows, seconds the query took) of a cached result, or
+        None"""
+        row = self.db_conn.execute(
+            'SELECT rows, seconds FROM results WHERE key = ?;',
+            (key,)).fetchone()
+        if row is None:
+            return None
+        self.db_conn.execute('UPDATE results SET last_used = ? WHERE key = ?;',
+                             (time.time(), key))
+        return pickle.loads(str(row[0])), row[1]
 
-def executeQueriesFromFile(filename, dbname):
-    open_file = open(filename, 'r')
-    sql_file = open_file.read()
+    def put(self, key, rows, seconds):
+        data = pickle.dumps(rows, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        self.db_conn.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?);',
+            (key, sqlite3.Binary(data), len(data), seconds, time.time()))
+        self.evict()
 
-    sql_commands = sql_file.split(';')
-    db_conn = sqlite3.connect(dbname)
-    cursor = db_conn.cursor()
+    def evict(self):
+        """Drop the least recently used results until the rest fit in
+        max_bytes"""
+        total = self.db_conn.execute(
+            'SELECT coalesce(sum(size), 0) FROM results;').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.db_conn.execute(
+                'SELECT key, size FROM results ORDER BY last_used;'):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db_conn.executemany('DELETE FROM results WHERE key = ?;',
+                                 evicted)
 
-    for command in sql_commands:
+    def close(self):
+        self.db_conn.commit()
+        self.db_conn.close()
+
+
+class ConnectionPool(object):
+    """size read-only connections to dbname, each used by one thread at a
+    time"""
+
+    def __init__(self, dbname, size):
+        self.connections = Queue()
+        for _ in range(size):
+            db_conn = sqlite3.connect(dbname, check_same_thread=False)
+            db_conn.execute('PRAGMA query_only = ON;')
+            self.connections.put(db_conn)
+        self.size = size
+
+    @contextmanager
+    def connection(self):
+        db_conn = self.connections.get()
         try:
-            cursor.execute(command)
-            db_conn.commit()
-            pprint.pprint(cursor.fetchall())
+            yield db_conn
+        finally:
+            self.connections.put(db_conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self.connections.get().close()
+
+
+def run_query(pool, statement):
+    """Return a QueryResult for statement, run on a connection from pool"""
+    with pool.connection() as db_conn:
+        start = time.time()
+        try:
+            rows = db_conn.execute(statement).fetchall()
         except Exception, msg:
-            print "Command skipped: ", msg
-    db_conn.close()
-    open_file.close()
+            return QueryResult(statement, None, time.time() - start, False,
+                               msg)
+        return QueryResult(statement, rows, time.time() - start, False, None)
+
+
+def run_queries(statements, dbname, workers=QUERY_WORKERS,
+                cache_path=CACHE_PATH, cache_bytes=CACHE_BYTES):
+    """Return a QueryResult for each of statements, in the same order,
+    taking what it can from the cache and running the rest concurrently"""
+
+    if not os.path.exists(dbname):
+        raise IOError("No such database: {}".format(dbname))
+    cache = ResultCache(cache_path, cache_bytes) \
+        if cache_path is not None else None
+    fingerprint = database_fingerprint(dbname)
+
+    results = [None] * len(statements)
+    pending = []
+    for i, statement in enumerate(statements):
+        if cache is not None and not NONDETERMINISTIC.search(statement):
+            cached = cache.get(ResultCache.key(statement, fingerprint))
+            if cached is not None:
+                rows, seconds = cached
+                results[i] = QueryResult(statement, rows, seconds, True, None)
+                continue
+        pending.append(i)
+
+    if pending:
+        workers = max(1, min(workers, len(pending)))
+        pool = ConnectionPool(dbname, workers)
+        threads = ThreadPool(workers)
+        try:
+            ran = threads.map(lambda i: run_query(pool, statements[i]),
+                              pending, chunksize=1)
+        finally:
+            threads.close()
+            threads.join()
+            pool.close()
+        for i, result in zip(pending, ran):
+            results[i] = result
+            if cache is not None and result.error is None and \
+                    not NONDETERMINISTIC.search(result.statement):
+                cache.put(ResultCache.key(result.statement, fingerprint),
+                          result.rows, result.seconds)
+
+    if cache is not None:
+        cache.close()
+    return results
+
+
+def executeQueriesFromFile(filename, dbname, workers=QUERY_WORKERS,
+                           cache_path=CACHE_PATH, cache_bytes=CACHE_BYTES):
+    start = time.time()
+    results = run_queries(sql_files.read_statements(filename), dbname,
+                          workers, cache_path, cache_bytes)
+    for result in results:
+        if result.error is not None:
+            print "Command skipped: ", result.error
+            continue
+        pprint.pprint(result.rows)
+        if result.cached:
+            print '    cached ({:.4f}s when run)'.format(result.seconds)
+        else:
+            print '    {:.4f}s'.format(result.seconds)
+    print '{} queries ({} cached) in {:.4f}s'.format(
+        len(results), sum(1 for result in results if result.cached),
+        time.time() - start)
+    return results
 
 
 if __name__ == '__main__':
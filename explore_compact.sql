@@ -0,0 +1,80 @@
+-- The queries of explore.sql written against the tables of the compact
+-- database (see populate_db_compact.sql). explore.sql runs on the compact
+-- database as it is, through its views, while these read the tables
+-- underneath, grouping and filtering on the integer ids and only looking up
+-- the names of the rows they return.
+
+SELECT count(*)
+FROM nodes_compact;
+
+SELECT count(*)
+FROM nodes_tags_compact;
+
+SELECT count(*)
+FROM ways_compact;
+
+SELECT count(*)
+FROM ways_nodes;
+
+SELECT count(*)
+FROM ways_tags_compact;
+
+SELECT value, count(*) as search_amount
+FROM nodes_tags_compact
+WHERE value = 'cafe';
+
+SELECT value, count(*) as search_amount
+FROM ways_tags_compact
+WHERE value = 'cafe';
+
+SELECT t.id, k.key, t.value, k.type
+FROM ways_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE t.value = 'abandoned';
+
+SELECT *
+FROM nodes
+WHERE id IN (SELECT n.id
+             FROM nodes_compact n JOIN users u ON u.id = n.user_id
+             WHERE u.user = 'NO_USER');
+
+SELECT u.user, c.contributions
+FROM (SELECT user_id, count(*) AS contributions
+      FROM nodes_compact
+      GROUP BY user_id
+      ORDER BY contributions DESC
+      LIMIT 10) c
+JOIN users u ON u.id = c.user_id
+ORDER BY c.contributions DESC;
+
+SELECT u.user, c.contributions
+FROM (SELECT user_id, count(*) AS contributions
+      FROM ways_compact
+      GROUP BY user_id
+      ORDER BY contributions DESC
+      LIMIT 10) c
+JOIN users u ON u.id = c.user_id
+ORDER BY c.contributions DESC;
+
+SELECT k.key, t.value
+FROM nodes_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE k.type = 'name';
+
+SELECT k.key, t.value
+FROM ways_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE k.type = 'name';
+
+SELECT k.key, t.value
+FROM nodes_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE k.type = 'fixme';
+
+SELECT k.key, t.value
+FROM ways_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE k.type = 'fixme';
+
+SELECT k.key, t.value
+FROM nodes_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE k.key = 'FIXME';
+
+SELECT k.key, t.value
+FROM ways_tags_compact t JOIN tag_keys k ON k.id = t.key_id
+WHERE k.key = 'FIXME';
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file builds the secondary indexes of the database once it has been
+filled, and can work out which indexes a workload of queries needs.
+
+The function createIndexes() executes the statements in index_db.sql: it
+deletes the rows of the tag and way node tables repeating an earlier row's
+key, builds unique indexes on those keys and the secondary indexes, and runs
+ANALYZE. It is meant to run after create_and_fill_db.py (or data.process_map
+with a dbname) has finished inserting rows, since building an index once over
+a full table is much cheaper than updating it for every inserted row.
+
+The function adviseIndexes() takes in the variables:
+  - filename, a sql file holding the workload, in our case explore.sql
+  - dbname, the database the workload runs against, in our case
+    london_osm.db
+  - create, whether to actually create the suggested indexes
+For each statement it asks sqlite for the EXPLAIN QUERY PLAN, finds the
+tables read with a full scan, and suggests an index on the columns the
+statement filters, joins or groups that table on. The candidate indexes are
+tried out on an empty in-memory copy of the schema, given the ANALYZE
+statistics of the database so that it plans the queries the same way, so
+trying them costs nothing and the database itself is only written to when
+create is True. Every statement is timed, and when create is True it is
+timed again once the indexes exist, so the before and after timings are
+printed side by side.
+"""
+
+import re
+import sqlite3
+import time
+
+import sql_files
+
+TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?',
+                       re.IGNORECASE)
+CLAUSE_END = r'(?=\bGROUP\b|\bORDER\b|\bLIMIT\b|\bHAVING\b|\bJOIN\b|$)'
+WHERE_CLAUSE = re.compile(r'\b(?:WHERE|ON)\b(.*?)' + CLAUSE_END,
+                          re.IGNORECASE | re.DOTALL)
+GROUP_CLAUSE = re.compile(r'\bGROUP\s+BY\b(.*?)(?=\bORDER\b|\bLIMIT\b|'
+                          r'\bHAVING\b|$)', re.IGNORECASE | re.DOTALL)
+PREDICATE = re.compile(r'(?:(\w+)\.)?(\w+)\s*(?:=|\bIN\b|\bLIKE\b|\bIS\b)',
+                       re.IGNORECASE)
+COLUMN = re.compile(r'(?:(\w+)\.)?(\w+)')
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+SQL_KEYWORDS = set(['and', 'or', 'not', 'null', 'select'])
+
+
+def createIndexes(dbname, filename='index_db.sql'):
+    sql_files.createTablesFromFile(filename, dbname)
+
+
+def full_scans(cursor, statement):
+    """Return the names (or aliases) of the tables statement reads with a
+    full table scan"""
+    scans = []
+    for row in cursor.execute('EXPLAIN QUERY PLAN ' + statement):
+        match = FULL_SCAN.match(row[-1])
+        if match:
+            scans.append(match.group(2) or match.group(1))
+    return scans
+
+
+def table_columns(cursor, table):
+    return [row[1] for row in cursor.execute(
+        'PRAGMA table_info({});'.format(table))]
+
+
+def candidate_columns(statement, table, alias, columns, single_table):
+    """Return the columns of table that statement filters, joins or groups
+    on, filters first"""
+    names = set([table.lower(), alias.lower()])
+
+    def owned(qualifier, column):
+        if column not in columns:
+            return False
+        if not qualifier:
+            return single_table
+        return qualifier.lower() in names
+
+    found = []
+    for clause in WHERE_CLAUSE.findall(statement):
+        for qualifier, column in PREDICATE.findall(clause):
+            if column.lower() in SQL_KEYWORDS:
+                continue
+            if owned(qualifier, column) and column not in found:
+                found.append(column)
+    for clause in GROUP_CLAUSE.findall(statement):
+        for qualifier, column in COLUMN.findall(clause):
+            if owned(qualifier, column) and column not in found:
+                found.append(column)
+    return found
+
+
+def time_statement(cursor, statement):
+    start = time.time()
+    cursor.execute(statement).fetchall()
+    return time.time() - start
+
+
+def index_name(table, columns):
+    return 'advised_{}_{}'.format(table, '_'.join(columns))
+
+
+def schema_copy(db_conn):
+    """Return an in-memory database with the tables, indexes, views and
+    triggers of db_conn and its ANALYZE statistics, but none of its rows"""
+    copy = sqlite3.connect(':memory:')
+    for name, sql in db_conn.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 "
+            "WHEN 'view' THEN 2 ELSE 3 END, rowid;"):
+        # the shadow tables of a virtual table, such as the R*Tree of
+        # spatial.py, are created along with it
+        if copy.execute("SELECT 1 FROM sqlite_master WHERE name = ?;",
+                        (name,)).fetchone() is None:
+            copy.execute(sql)
+    if db_conn.execute("SELECT 1 FROM sqlite_master "
+                       "WHERE name = 'sqlite_stat1';").fetchone():
+        copy.execute('ANALYZE;')
+        copy.execute('DELETE FROM sqlite_stat1;')
+        copy.executemany('INSERT INTO sqlite_stat1 VALUES (?, ?, ?);',
+                         db_conn.execute('SELECT * FROM sqlite_stat1;'))
+        # load the statistics into the query planner
+        copy.execute('ANALYZE sqlite_master;')
+    copy.commit()
+    return copy
+
+
+def suggest_index(cursor, statement, scanned):
+    """Return (table, columns) of an index that removes the full scan of
+    scanned (a table name or alias) from statement's plan, or None; cursor
+    is on the schema_copy the indexes are tried out on"""
+    refs = TABLE_REF.findall(statement)
+    single_table = len(set(table for table, _ in refs)) == 1
+    for table, alias in refs:
+        if scanned not in (table, alias):
+            continue
+        columns = table_columns(cursor, table)
+        for column in candidate_columns(statement, table, alias or table,
+                                        columns, single_table):
+            name = index_name(table, [column])
+            cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({});'.format(
+                name, table, column))
+            removed = scanned not in full_scans(cursor, statement)
+            cursor.execute('DROP INDEX IF EXISTS {};'.format(name))
+            if removed:
+                return table, [column]
+    return None
+
+
+def adviseIndexes(filename, dbname, create=False):
+    db_conn = sqlite3.connect(dbname)
+    cursor = db_conn.cursor()
+    trial_conn = schema_copy(db_conn)
+    trial = trial_conn.cursor()
+
+    statements = sql_files.read_statements(filename)
+    before = []
+    suggestions = []
+    for statement in statements:
+        before.append(time_statement(cursor, statement))
+        for scanned in full_scans(trial, statement):
+            suggestion = suggest_index(trial, statement, scanned)
+            if suggestion is not None and suggestion not in suggestions:
+                suggestions.append(suggestion)
+    trial_conn.close()
+
+    for table, columns in suggestions:
+        create_string = 'CREATE INDEX IF NOT EXISTS {} ON {} ({});'.format(
+            index_name(table, columns), table, ', '.join(columns))
+        print create_string
+        if create:
+            cursor.execute(create_string)
+    if create:
+        cursor.execute('ANALYZE;')
+        db_conn.commit()
+
+    for statement, seconds in zip(statements, before):
+        print ' '.join(statement.split())
+        if create:
+            after = time_statement(cursor, statement)
+            print '    {:.4f}s -> {:.4f}s'.format(seconds, after)
+        else:
+            print '    {:.4f}s'.format(seconds)
+        scans = full_scans(cursor, statement)
+        if scans:
+            print '    full scan of: ' + ', '.join(scans)
+
+    db_conn.close()
+    return suggestions
+
+
+if __name__ == '__main__':
+    sqlite_db_file = 'london_osm.db'
+
+    createIndexes(sqlite_db_file)
+    adviseIndexes('explore.sql', sqlite_db_file)
@@ -0,0 +1,48 @@
+-- This file contains the secondary indexes for our database. They are created
+-- only after the tables have been filled, since keeping them up to date row by
+-- row during a bulk load is much slower than building them once at the end.
+
+-- The child tables are loaded without UNIQUE constraints for the same reason.
+-- Rows repeating the key of an earlier row are deleted here, keeping the
+-- first one as an INSERT OR IGNORE against a constraint would have, and the
+-- unique indexes then keep the keys unique for apply_osc.py.
+
+DELETE FROM nodes_tags WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM nodes_tags GROUP BY id, key, type);
+
+CREATE UNIQUE INDEX IF NOT EXISTS nodes_tags_id_key_type
+ON nodes_tags (id, key, type);
+
+DELETE FROM ways_tags WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM ways_tags GROUP BY id, key, type);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ways_tags_id_key_type
+ON ways_tags (id, key, type);
+
+DELETE FROM ways_nodes WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM ways_nodes GROUP BY id, position);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ways_nodes_id_position
+ON ways_nodes (id, position);
+
+-- The secondary indexes
+
+CREATE INDEX IF NOT EXISTS nodes_user ON nodes (user);
+
+CREATE INDEX IF NOT EXISTS ways_user ON ways (user);
+
+CREATE INDEX IF NOT EXISTS nodes_tags_value ON nodes_tags (value);
+
+CREATE INDEX IF NOT EXISTS nodes_tags_type ON nodes_tags (type);
+
+CREATE INDEX IF NOT EXISTS nodes_tags_key ON nodes_tags (key);
+
+CREATE INDEX IF NOT EXISTS ways_tags_value ON ways_tags (value);
+
+CREATE INDEX IF NOT EXISTS ways_tags_type ON ways_tags (type);
+
+CREATE INDEX IF NOT EXISTS ways_tags_key ON ways_tags (key);
+
+CREATE INDEX IF NOT EXISTS ways_nodes_node_id ON ways_nodes (node_id);
+
+ANALYZE;
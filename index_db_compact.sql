@@ -0,0 +1,50 @@
+-- This file contains the secondary indexes for the compact version of our
+-- database (see populate_db_compact.sql), the counterpart of index_db.sql.
+-- Views cannot be indexed, so the indexes are on the tables underneath; the
+-- keys and types of the tags are looked up in tag_keys, which the UNIQUE
+-- constraint already indexes.
+
+-- As in index_db.sql, the child tables are loaded without UNIQUE constraints;
+-- rows repeating the key of an earlier row are deleted and the keys are then
+-- kept unique by the unique indexes.
+
+DELETE FROM nodes_tags_compact WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM nodes_tags_compact GROUP BY id, key_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS nodes_tags_compact_id_key_id
+ON nodes_tags_compact (id, key_id);
+
+DELETE FROM ways_tags_compact WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM ways_tags_compact GROUP BY id, key_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ways_tags_compact_id_key_id
+ON ways_tags_compact (id, key_id);
+
+DELETE FROM ways_nodes WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM ways_nodes GROUP BY id, position);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ways_nodes_id_position
+ON ways_nodes (id, position);
+
+-- The secondary indexes
+
+CREATE INDEX IF NOT EXISTS nodes_compact_user_id ON nodes_compact (user_id);
+
+CREATE INDEX IF NOT EXISTS ways_compact_user_id ON ways_compact (user_id);
+
+CREATE INDEX IF NOT EXISTS tag_keys_type ON tag_keys (type);
+
+CREATE INDEX IF NOT EXISTS nodes_tags_compact_value
+ON nodes_tags_compact (value);
+
+CREATE INDEX IF NOT EXISTS nodes_tags_compact_key_id
+ON nodes_tags_compact (key_id);
+
+CREATE INDEX IF NOT EXISTS ways_tags_compact_value ON ways_tags_compact (value);
+
+CREATE INDEX IF NOT EXISTS ways_tags_compact_key_id
+ON ways_tags_compact (key_id);
+
+CREATE INDEX IF NOT EXISTS ways_nodes_node_id ON ways_nodes (node_id);
+
+ANALYZE;
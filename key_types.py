@@ -12,54 +12,136 @@ are:
   "problemchars", for tags with problematic characters, and
   "other", for other tags that do not fall into the other three categories.
 
-The function key_type returns a dictionary of dictionaries in which the keys
-for the outer dictionary are the potential problems described above and the
-keys for the dictionaries describing each problem are count, an integer
-value of the number of times we see the particular problem in all of the tags,
-and text_values which is a set of the actual text value the "k" attribute has
-for all tags.
+A KeyTypes object counts the tags of each category. The set of distinct keys
+is tiny next to the number of tags, so it remembers the category of every key
+it has classified (up to cache_size keys) and runs the regular expressions
+once per distinct key rather than once per tag. Instead of a set of every key
+seen, it keeps the top most common keys of each category as examples; the
+keys are counted in at most EXAMPLE_SLOTS * top slots per category (the
+"space saving" algorithm: a new key takes over the slot of the least counted
+one), so memory stays bounded however many distinct keys there are, and the
+counts are exact while a category has no more distinct keys than slots.
+
+KeyTypes.result() (and so process_map) returns a dictionary of dictionaries
+in which the keys for the outer dictionary are the potential problems
+described above and the keys for the dictionaries describing each problem are
+count, an integer value of the number of times we see the particular problem
+in all of the tags, and examples, a list of the (k value, count) pairs of its
+most common keys, most common first.
 
 NOTE: The concept of this code was taken from Udacity's OpenStreetMap Case
 Study Lesson and Quizzes.
 """
 
 
-import xml.etree.cElementTree as ET
 import pprint
 import re
 
+import osm_stream
+
 lower = re.compile(r'^([a-z]|_)*$')
 lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 
+CATEGORIES = ('lower', 'lower_colon', 'problemchars', 'other')
+
+# Most common keys kept as examples of each category
+TOP_KEYS = 10
+# Keys counted per category for each example kept
+EXAMPLE_SLOTS = 10
+# Distinct keys whose category is remembered
+CACHE_SIZE = 100000
+
+
+def classify(k_value):
+    """Return the category of a tag "k" value"""
+    if lower.search(k_value) is not None:
+        return 'lower'
+    elif lower_colon.search(k_value) is not None:
+        return 'lower_colon'
+    elif problemchars.search(k_value) is not None:
+        return 'problemchars'
+    return 'other'
+
+
+class KeyTypes(object):
+    """Count tag keys by category, remembering the category of up to
+    cache_size distinct keys and keeping the top most common keys of each
+    category"""
+
+    def __init__(self, top=TOP_KEYS, cache_size=CACHE_SIZE):
+        self.top = top
+        self.slots = max(1, top * EXAMPLE_SLOTS)
+        self.cache_size = cache_size
+        self.categories = {}
+        self.counts = dict.fromkeys(CATEGORIES, 0)
+        self.key_counts = dict((category, {}) for category in CATEGORIES)
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, k_value):
+        category = self.categories.get(k_value)
+        if category is None:
+            self.misses += 1
+            if len(self.categories) >= self.cache_size:
+                self.categories.clear()
+            category = self.categories[k_value] = classify(k_value)
+        else:
+            self.hits += 1
+        self.counts[category] += 1
+
+        key_counts = self.key_counts[category]
+        count = key_counts.get(k_value)
+        if count is not None:
+            key_counts[k_value] = count + 1
+        elif len(key_counts) < self.slots:
+            key_counts[k_value] = 1
+        else:
+            # take over the slot of the least counted key, and its count
+            least = min(key_counts, key=key_counts.get)
+            key_counts[k_value] = key_counts.pop(least) + 1
+
+    def examples(self, category):
+        """Return the (k value, count) pairs of the top most common keys of
+        category, most common first"""
+        return sorted(self.key_counts[category].iteritems(),
+                      key=lambda item: (-item[1], item[0]))[:self.top]
+
+    def result(self):
+        return dict((category, {'count': self.counts[category],
+                                'examples': self.examples(category)})
+                    for category in CATEGORIES)
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.categories), 'max_size': self.cache_size}
+
+
 def key_type(element, keys):
+    """Count the "k" value of a <tag> element in keys, a KeyTypes"""
     if element.tag == "tag":
-        k_value = element.attrib['k']
-        if lower.search(k_value) is not None:
-            keys['lower']['count'] += 1
-            keys['lower']['text_values'].add(k_value)
-        elif lower_colon.search(k_value) is not None:
-            keys['lower_colon']['count'] += 1
-            keys['lower_colon']['text_values'].add(k_value)
-        elif problemchars.search(k_value) is not None:
-            keys['problemchars']['count'] += 1
-            keys['problemchars']['text_values'].add(k_value)
-        else:
-            keys['other']['count'] += 1
-            keys['other']['text_values'].add(k_value)
+        keys.add(element.attrib['k'])
     return keys
 
 
-def process_map(filename):
-    keys = {"lower": {'count': 0, 'text_values': set()},
-            "lower_colon": {'count': 0, 'text_values': set()},
-            "problemchars": {'count': 0, 'text_values': set()},
-            "other": {'count': 0, 'text_values': set()}}
-    for _, element in ET.iterparse(filename):
-        keys = key_type(element, keys)
+class KeyTypeCollector(object):
+    """osm_stream collector counting the key type of every <tag>"""
 
-    return keys
+    def __init__(self, top=TOP_KEYS, cache_size=CACHE_SIZE):
+        self.keys = KeyTypes(top, cache_size)
+
+    def element(self, elem):
+        add = self.keys.add
+        for tag in elem.iter('tag'):
+            add(tag.attrib['k'])
+
+    def result(self):
+        return self.keys.result()
+
+
+def process_map(filename, top=TOP_KEYS):
+    return osm_stream.run(filename, [KeyTypeCollector(top)])[0]
 
 
 if __name__ == "__main__":
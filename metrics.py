@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file holds the instrumentation data.process_map and
+create_and_fill_db.fillTables report their progress through, so that a long
+run over a full extract shows where its time goes while it runs.
+
+A Metrics object handed to them (metrics=Metrics()) keeps:
+  - the cumulative seconds and number of calls of each stage: parse, clean
+    (the audit.py cleaners), shape, validate, and one write stage per output
+    (write CsvOutput, write SQLiteOutput, ...), and for fillTables csv read
+    and db insert
+  - the elements shaped, and elements per second
+  - the bytes of input read against the size of the input, and from the
+    rate so far an estimate of the time left
+  - the rows written to each table
+  - the resident set size of the process, sampled at every report, and its
+    peak
+Every PROGRESS_SECONDS it prints a progress line such as
+
+    [  42s] 1,204,224 elements (28,671/s)  301.0 of 912.4 MB (33%)
+    ETA 0:01:24  RSS 61 MB  parse 21% clean 6% shape 14% validate 31% ...
+
+to stderr and rewrites the JSON metrics file (METRICS_PATH by default), which
+a monitoring script can read at any time; it is replaced atomically, like
+the checkpoints of checkpoint.py. close() writes the final numbers.
+
+Without a Metrics object the pipeline runs exactly the code it ran before,
+so the instrumentation costs nothing when it is not used.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import checkpoint
+
+METRICS_PATH = 'metrics.json'
+PROGRESS_SECONDS = 10
+# Elements counted between two looks at the clock
+CHECK_EVERY = 1000
+
+# The tables in the order of checkpoint.RowCounter's counts
+TABLES = ('nodes', 'nodes_tags', 'ways', 'ways_nodes', 'ways_tags')
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Return the resident set size of this process in bytes, or its peak
+    where /proc is not available"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return peak_rss()
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60,
+                                     seconds % 60)
+
+
+class Metrics(object):
+    """Stage timings, counts and progress of one run, reported every
+    interval seconds to stream and to the JSON file path (None for no
+    file)"""
+
+    def __init__(self, path=METRICS_PATH, interval=PROGRESS_SECONDS,
+                 stream=sys.stderr):
+        self.path = path
+        self.interval = interval
+        self.stream = stream
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        # rows of the shaped elements, and rows added by table name
+        self.counter = checkpoint.RowCounter()
+        self.table_rows = defaultdict(int)
+        self.elements = 0
+        self.total_bytes = None
+        self.rss = 0
+        self.peak_rss = 0
+        self.started = time.time()
+        self._bytes = 0
+        self._offset = 0
+        self._file = None
+        self._start_bytes = None
+        self._next_check = CHECK_EVERY
+        self._next_report = self.started + interval
+
+    def add(self, stage, seconds, calls=1):
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+
+    def timed(self, stage, func):
+        """Return func wrapped to add the time of every call to stage"""
+        seconds = self.seconds
+        calls = self.calls
+        clock = time.time
+
+        def timed_func(*args):
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                seconds[stage] += clock() - start
+                calls[stage] += 1
+        return timed_func
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the body of a with statement as one call of stage"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def add_rows(self, table, rows):
+        self.table_rows[table] += rows
+
+    def rows(self):
+        """Return the rows written so far by table"""
+        rows = dict(self.table_rows)
+        for table, count in zip(TABLES, self.counter.rows):
+            rows[table] = rows.get(table, 0) + count
+        return rows
+
+    def tick(self, elements=1):
+        """Count shaped elements, reporting if the interval is up"""
+        self.elements += elements
+        if self.elements >= self._next_check:
+            self._next_check = self.elements + CHECK_EVERY
+            self.poll()
+
+    def poll(self):
+        """Report if the interval is up"""
+        if time.time() >= self._next_report:
+            self.report()
+
+    def watch(self, f, offset=None):
+        """Count offset plus the position of the open file f as the bytes
+        of input read, by default continuing from the bytes counted so
+        far; for a compressed file the position in the compressed file
+        underneath is counted, as its size is the total"""
+        self._offset = self.bytes_read() if offset is None else offset
+        self._file = getattr(f, 'raw', f)
+        if self._start_bytes is None:
+            self._start_bytes = self.bytes_read()
+
+    def unwatch(self):
+        """Keep the bytes read so far once the watched file is done"""
+        self._bytes = self.bytes_read()
+        self._file = None
+
+    def set_bytes_read(self, bytes_read):
+        self._file = None
+        self._bytes = bytes_read
+        if self._start_bytes is None:
+            self._start_bytes = bytes_read
+
+    def bytes_read(self):
+        if self._file is None:
+            return self._bytes
+        try:
+            return self._offset + self._file.tell()
+        except (ValueError, IOError):
+            # closed already
+            return self._bytes
+
+    def snapshot(self, finished=False):
+        """Return the metrics as a dictionary, as written to the JSON
+        file"""
+        now = time.time()
+        elapsed = now - self.started
+        bytes_read = self.bytes_read()
+        eta = None
+        done = None
+        if self.total_bytes:
+            done = min(1.0, float(bytes_read) / self.total_bytes)
+            rate = (bytes_read - (self._start_bytes or 0)) / elapsed \
+                if elapsed > 0 else 0
+            if finished:
+                eta = 0.0
+            elif rate > 0:
+                eta = max(0.0, (self.total_bytes - bytes_read) / rate)
+        return {
+            'finished': finished,
+            'elapsed_seconds': elapsed,
+            'elements': self.elements,
+            'elements_per_second': self.elements / elapsed
+            if elapsed > 0 else None,
+            'bytes_read': bytes_read,
+            'total_bytes': self.total_bytes,
+            'fraction_done': done,
+            'eta_seconds': eta,
+            'stages': dict((stage, {'seconds': self.seconds[stage],
+                                    'calls': self.calls[stage]})
+                           for stage in self.seconds),
+            'rows': self.rows(),
+            'rss_bytes': self.rss,
+            'peak_rss_bytes': self.peak_rss,
+        }
+
+    def progress_line(self, snapshot):
+        parts = ['[{:>5.0f}s]'.format(snapshot['elapsed_seconds'])]
+        if snapshot['elements']:
+            parts.append('{:,} elements ({:,.0f}/s)'.format(
+                snapshot['elements'], snapshot['elements_per_second']))
+        rows = sum(snapshot['rows'].values())
+        if rows:
+            parts.append('{:,} rows'.format(rows))
+        if snapshot['total_bytes']:
+            parts.append('{:.1f} of {:.1f} MB ({:.0%})'.format(
+                snapshot['bytes_read'] / 1048576.0,
+                snapshot['total_bytes'] / 1048576.0,
+                snapshot['fraction_done']))
+        if snapshot['eta_seconds'] is not None and not snapshot['finished']:
+            parts.append('ETA ' + format_duration(snapshot['eta_seconds']))
+        parts.append('RSS {:.0f} MB'.format(snapshot['rss_bytes'] / 1048576.0))
+        total = sum(self.seconds.values())
+        if total > 0:
+            parts.append(' '.join(
+                '{} {:.0%}'.format(stage, seconds / total)
+                for stage, seconds in sorted(self.seconds.items(),
+                                             key=lambda item: -item[1])))
+        return '  '.join(parts)
+
+    def write(self, snapshot):
+        """Replace the JSON metrics file atomically"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def report(self, finished=False):
+        self.rss = current_rss()
+        self.peak_rss = max(self.peak_rss, self.rss, peak_rss())
+        snapshot = self.snapshot(finished)
+        if self.stream is not None:
+            self.stream.write(self.progress_line(snapshot) + '\n')
+            self.stream.flush()
+        if self.path is not None:
+            self.write(snapshot)
+        self._next_report = time.time() + self.interval
+        return snapshot
+
+    def close(self):
+        """Report the final numbers"""
+        return self.report(finished=True)
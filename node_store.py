@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file holds the node location store data.py uses to work out the
+geometry of every way: its bounding box, centroid and length.
+
+A way only lists the ids of its nodes, so its geometry needs the coordinates
+of each of them. Looking them up through SQL joins is slow, and a Python dict
+of every node of a full extract does not fit in memory. NodeStore instead
+keeps the coordinates in a memory mapped file, as fixed point integers:
+  - each node takes 8 bytes, two unsigned 32 bit integers holding
+    (lat + 90) * 10^7 + 1 and (lon + 180) * 10^7 + 1, so that 0 means there
+    is no such node and the 7 decimals of an OSM coordinate are kept exactly
+  - in sparse mode (the default) the ids are split into pages of PAGE_NODES
+    ids and a page is only added to the file once a node in it is stored,
+    so the file grows with the id ranges an extract actually uses; it also
+    takes negative ids
+  - in dense mode node id n is at byte 8 * n, so a lookup is a single read
+    at a computed offset, but the mapping spans every id up to the largest
+    (about 96 GB for current OSM ids) and in an extract, whose ids are
+    scattered, most nodes dirty a disk page of their own; it only suits
+    files holding nearly every id, such as the planet file. Ids are checked
+    against max_id (DENSE_MAX_ID by default) before the mapping is grown, so
+    a stray huge id is an error instead of a file of hundreds of gigabytes
+Either way a lookup takes constant time, and the coordinates live in the page
+cache instead of on the Python heap.
+
+The store is filled while the file is shaped (it is an output for
+data.shape_map) or from nodes.csv, and a second pass then streams the
+ways_nodes rows of each way, in order, through iter_way_geometry() to
+produce the records.WayGeometry rows of the ways_geometry table. Nodes a way
+uses that are not in the extract are skipped and counted in missing_nodes.
+"""
+
+import csv
+import math
+import mmap
+import os
+import struct
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+import compression
+import records
+
+SCALE = 10000000
+LAT_OFFSET = 90 * SCALE + 1
+LON_OFFSET = 180 * SCALE + 1
+
+ENTRY = struct.Struct('<II')
+PAGE_BITS = 16
+PAGE_NODES = 1 << PAGE_BITS
+PAGE_MASK = PAGE_NODES - 1
+PAGE_BYTES = PAGE_NODES * ENTRY.size
+
+EARTH_RADIUS = 6371008.8
+
+# Largest node id a dense NodeStore takes by default: room for the ids of
+# the planet file (about 1.3 * 10^10 in 2024), a mapping of up to 128 GB
+DENSE_MAX_ID = 1 << 34
+
+# Ids per statement when reading ways_nodes from the database
+QUERY_BATCH = 500
+
+
+def to_fixed(value):
+    """Return a coordinate, given as a string or a number, in units of
+    10^-7 degrees"""
+    return int(round(float(value) * SCALE))
+
+
+class NodeStore(object):
+    """Memory mapped id -> (lat, lon) store, backed by the file path or by a
+    temporary file which is removed on close; in dense mode it takes the ids
+    from 0 to max_id"""
+
+    def __init__(self, path=None, sparse=True, max_id=DENSE_MAX_ID):
+        self._remove = path is None
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix='node_store_', dir='.')
+            os.close(handle)
+        self.path = path
+        self.sparse = sparse
+        self.max_id = max_id
+        self._pages = {}
+        self._used = 0
+        self._size = PAGE_BYTES
+        self._file = open(path, 'w+b')
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+
+    def _grow(self, size):
+        if size > self._size:
+            size = max(size, 2 * self._size)
+            self._size = -(-size // PAGE_BYTES) * PAGE_BYTES
+            self._map.resize(self._size)
+
+    def _offset(self, node_id, create=False):
+        """Return the offset of node_id in the file, or None when it cannot
+        be stored there yet and create is False"""
+        if self.sparse:
+            page = node_id >> PAGE_BITS
+            base = self._pages.get(page)
+            if base is None:
+                if not create:
+                    return None
+                base = self._used
+                self._grow(base + PAGE_BYTES)
+                self._used += PAGE_BYTES
+                self._pages[page] = base
+            return base + (node_id & PAGE_MASK) * ENTRY.size
+
+        if not 0 <= node_id <= self.max_id:
+            if not create:
+                return None
+            if node_id < 0:
+                raise ValueError("Negative node ids need a sparse NodeStore")
+            raise ValueError("Node id {} is above the largest id of the "
+                             "dense NodeStore, {}".format(node_id,
+                                                          self.max_id))
+        offset = node_id * ENTRY.size
+        if offset >= self._size:
+            if not create:
+                return None
+            self._grow(offset + ENTRY.size)
+        return offset
+
+    def set(self, node_id, lat, lon):
+        ENTRY.pack_into(self._map, self._offset(node_id, create=True),
+                        to_fixed(lat) + LAT_OFFSET,
+                        to_fixed(lon) + LON_OFFSET)
+
+    def get_fixed(self, node_id):
+        """Return (lat, lon) of node_id in units of 10^-7 degrees, or None
+        if it is not in the store"""
+        offset = self._offset(node_id)
+        if offset is None:
+            return None
+        lat, lon = ENTRY.unpack_from(self._map, offset)
+        if not lat:
+            return None
+        return lat - LAT_OFFSET, lon - LON_OFFSET
+
+    def get(self, node_id):
+        """Return (lat, lon) of node_id in degrees, or None"""
+        point = self.get_fixed(node_id)
+        if point is not None:
+            return float(point[0]) / SCALE, float(point[1]) / SCALE
+
+    def write(self, shaped):
+        if shaped.tag == 'node':
+            node = shaped.node
+            self.set(int(node.id), node.lat, node.lon)
+
+    def fill_from_csv(self, path):
+        """Store every node of a nodes.csv file, which may be compressed"""
+        with compression.open_input(path) as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            id_index, lat_index, lon_index = [
+                header.index(column) for column in ('id', 'lat', 'lon')]
+            for row in reader:
+                self.set(int(row[id_index]), row[lat_index], row[lon_index])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+        if self._remove:
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DatabaseNodes(object):
+    """get_fixed() for the nodes table of an open database, to work out the
+    geometry of a few ways without building a NodeStore"""
+
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+
+    def get_fixed(self, node_id):
+        row = self.db_conn.execute('SELECT lat, lon FROM nodes WHERE id = ?;',
+                                   (node_id,)).fetchone()
+        if row is None or row[0] is None or row[1] is None:
+            return None
+        return to_fixed(row[0]), to_fixed(row[1])
+
+
+def distance(a, b):
+    """Return the great circle distance in meters between two fixed point
+    (lat, lon) points"""
+    lat1 = math.radians(float(a[0]) / SCALE)
+    lat2 = math.radians(float(b[0]) / SCALE)
+    half_dlat = (lat2 - lat1) / 2
+    half_dlon = math.radians(float(b[1] - a[1]) / SCALE) / 2
+    h = math.sin(half_dlat) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin(half_dlon) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _degrees(value):
+    return round(float(value) / SCALE, 7)
+
+
+def way_geometry(nodes, way_id, node_ids):
+    """Return the records.WayGeometry of a way from the ids of its nodes in
+    order, looking them up in nodes (a NodeStore or DatabaseNodes)"""
+    points = []
+    for node_id in node_ids:
+        point = nodes.get_fixed(node_id)
+        if point is not None:
+            points.append(point)
+    missing = len(node_ids) - len(points)
+    if not points:
+        return records.WayGeometry(way_id, None, None, None, None, None,
+                                   None, 0.0, missing)
+
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    # a closed way repeats its first node at the end; count it once
+    vertices = len(points) - 1 if len(points) > 1 and \
+        points[0] == points[-1] else len(points)
+    length = sum(distance(a, b) for a, b in zip(points, points[1:]))
+    return records.WayGeometry(
+        way_id, _degrees(min(lats)), _degrees(min(lons)),
+        _degrees(max(lats)), _degrees(max(lons)),
+        _degrees(sum(lats[:vertices]) / float(vertices)),
+        _degrees(sum(lons[:vertices]) / float(vertices)),
+        round(length, 2), missing)
+
+
+def iter_way_geometry(nodes, way_node_rows):
+    """Yield the records.WayGeometry of each way in way_node_rows, an
+    iterable of (way id, node id) pairs grouped by way in position order"""
+    for way_id, rows in groupby(way_node_rows, itemgetter(0)):
+        yield way_geometry(nodes, way_id, [node_id for _, node_id in rows])
+
+
+def way_nodes_from_csv(path):
+    """Yield (way id, node id) for each row of a ways_nodes.csv file, which
+    may be compressed"""
+    with compression.open_input(path) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        id_index, node_index = [header.index(column)
+                                for column in ('id', 'node_id')]
+        for row in reader:
+            yield int(row[id_index]), int(row[node_index])
+
+
+def way_nodes_from_db(db_conn, way_ids=None):
+    """Yield (way id, node id) for each row of the ways_nodes table, or only
+    for the ways way_ids, in way and position order"""
+    if way_ids is None:
+        for row in db_conn.execute('SELECT id, node_id FROM ways_nodes '
+                                   'ORDER BY id, position;'):
+            yield row
+        return
+
+    way_ids = sorted(way_ids)
+    for start in range(0, len(way_ids), QUERY_BATCH):
+        batch = way_ids[start:start + QUERY_BATCH]
+        for row in db_conn.execute(
+                'SELECT id, node_id FROM ways_nodes WHERE id IN ({}) '
+                'ORDER BY id, position;'.format(', '.join('?' * len(batch))),
+                batch):
+            yield row
+
+
+def update_way_geometry(db_conn, way_ids):
+    """Recompute the ways_geometry rows of the ways way_ids, which may have
+    been created, modified or deleted or use a node that was"""
+    way_ids = list(way_ids)
+    db_conn.executemany('DELETE FROM ways_geometry WHERE id = ?;',
+                        [(way_id,) for way_id in way_ids])
+    db_conn.executemany(
+        'INSERT INTO ways_geometry VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);',
+        iter_way_geometry(DatabaseNodes(db_conn),
+                          list(way_nodes_from_db(db_conn, way_ids))))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file holds the XML parsing backends that get_element (in data.py and
+elsewhere) can use to step through the top level elements of an OSM file.
+
+- "etree" is the original xml.etree.cElementTree iterparse loop. It builds
+  every element of the file and only clears the root after each top level
+  element.
+- "lxml" uses lxml's iterparse, which filters out the events of the child
+  elements in C and clears each top level element, and the siblings before
+  it, once it has been used. It needs the lxml package.
+
+Both yield elements with the tag, attrib, iteration over children,
+getchildren() and iter() that shape_element and the collectors in
+osm_stream.py rely on, and the values in them are the same.
+
+The backend is picked with the backend argument of get_element, or else the
+OSM_PARSER environment variable, or else DEFAULT_BACKEND: lxml when it is
+installed and etree otherwise. Files ending in .pbf are not XML at all and are
+always read with osm_pbf.py, into the Element objects defined here. Files
+ending in .gz, .bz2 or .xz are decompressed as they are parsed (see
+compression.py).
+
+element_spans() finds the byte range of each top level element with regular
+expressions on the raw text, without parsing it; OSM files are a flat list of
+<node>, <way> and <relation> elements, so that is all sampling_osm.py needs to
+copy elements from.
+"""
+
+import os
+import re
+import xml.etree.cElementTree as ET
+
+import compression
+import osm_pbf
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# The attributes of a start tag; a quoted value may hold a raw ">"
+ATTRIBUTES = r'''((?:[^>"']|"[^"]*"|'[^']*')*?)'''
+TOP_LEVEL = re.compile(r'<(node|way|relation)(?=[\s/>])' + ATTRIBUTES +
+                       r'(/?)>')
+ATTRIBUTE = re.compile(r'([^\s=]+)\s*=\s*(["\'])(.*?)\2', re.DOTALL)
+DOUBLE_QUOTED = re.compile(r'([^\s=]+)="([^"]*)"')
+SINGLE_QUOTED = re.compile(r"([^\s=]+)='([^']*)'")
+
+CHUNK_SIZE = 1 << 20
+
+# The elements directly under <osm>
+TOP_LEVEL_TAGS = ('bounds', 'node', 'way', 'relation')
+
+
+class Element(object):
+    """Minimal stand-in for an ElementTree element"""
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib, children=()):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def getchildren(self):
+        return list(self.children)
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self.children:
+            for item in child.iter(tag):
+                yield item
+
+    def clear(self):
+        self.attrib = {}
+        self.children = ()
+
+
+def _attribute_pairs(text):
+    """Return the (name, raw value) pairs of the bytes of a start tag"""
+    # Fast path for the usual case of every value quoted the same way with
+    # no space around the "="; the quote count tells if anything was missed
+    if "'" not in text:
+        pairs = DOUBLE_QUOTED.findall(text)
+        if text.count('"') == 2 * len(pairs):
+            return pairs
+    elif '"' not in text:
+        pairs = SINGLE_QUOTED.findall(text)
+        if text.count("'") == 2 * len(pairs):
+            return pairs
+    return [(name, value) for name, _, value in ATTRIBUTE.findall(text)]
+
+
+def parse_attributes(text, wanted=None):
+    """Return the raw attribute values in the bytes of a start tag, only
+    those named in wanted if it is given; references in the values are not
+    expanded"""
+    attrib = dict(_attribute_pairs(text))
+    if wanted is not None:
+        attrib = dict((name, attrib[name]) for name in wanted
+                      if name in attrib)
+    return attrib
+
+
+def element_spans(osm_file):
+    """Yield (match, text, end, offset) for each top level node, way and
+    relation of the open file osm_file: match is the TOP_LEVEL match of its
+    start tag in text, end the index in text just past the element, and
+    offset the position of text in the file"""
+
+    text = ''
+    pos = 0
+    offset = 0
+    eof = False
+    while True:
+        match = TOP_LEVEL.search(text, pos)
+        end = None
+        if match:
+            if match.group(3):
+                end = match.end()
+            else:
+                close = text.find('</' + match.group(1) + '>', match.end())
+                if close != -1:
+                    end = close + len(match.group(1)) + 3
+
+        if end is None:
+            if eof:
+                return
+            # keep only what may still be part of an unfinished element
+            keep = match.start() if match else max(pos, len(text) - 512)
+            chunk = osm_file.read(CHUNK_SIZE)
+            eof = not chunk
+            text = text[keep:] + chunk
+            offset += keep
+            pos = 0
+            continue
+
+        pos = end
+        yield match, text, end, offset
+
+
+def etree_elements(osm_file, tags=('node', 'way', 'relation')):
+    """Yield element if it is the right type of tag"""
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            yield elem
+            root.clear()
+
+
+def lxml_elements(osm_file, tags=('node', 'way', 'relation')):
+    """Yield element if it is the right type of tag. lxml reports the end of
+    every top level element, wanted or not, while the events of their
+    children are filtered out in C, and each element is freed together with
+    its earlier siblings once the caller is done with it"""
+
+    context = lxml_etree.iterparse(osm_file, events=('end',),
+                                   tag=set(TOP_LEVEL_TAGS) | set(tags))
+    for _, elem in context:
+        if elem.tag in tags:
+            yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def pbf_elements(filename, tags=('node', 'way', 'relation'), workers=None):
+    """Yield the elements of a .osm.pbf file whose tag is in tags, decoded
+    in workers processes (osm_pbf.WORKERS by default)"""
+
+    for tag, attrib, children in osm_pbf.iter_elements(filename, tags,
+                                                       workers):
+        yield Element(tag, attrib, [Element(child_tag, child_attrib)
+                                    for child_tag, child_attrib in children])
+
+
+def compressed_elements(filename, tags, backend):
+    """Yield the elements of a compressed XML file, parsing its
+    decompressed bytes with backend"""
+
+    with compression.open_input(filename) as f:
+        for element in BACKENDS[backend](f, tags):
+            yield element
+
+
+BACKENDS = {
+    'etree': etree_elements,
+}
+if lxml_etree is not None:
+    BACKENDS['lxml'] = lxml_elements
+    DEFAULT_BACKEND = 'lxml'
+else:
+    DEFAULT_BACKEND = 'etree'
+
+
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend=None,
+                workers=None):
+    """Yield the top level elements of osm_file whose tag is in tags, using
+    the chosen parsing backend; workers is the number of processes decoding
+    a .osm.pbf file"""
+
+    if osm_pbf.is_pbf(osm_file):
+        return pbf_elements(osm_file, tags, workers)
+    if backend is None:
+        backend = os.environ.get('OSM_PARSER', DEFAULT_BACKEND)
+    if compression.is_compressed(osm_file):
+        return compressed_elements(osm_file, tags, backend)
+    return BACKENDS[backend](osm_file, tags)
+
+
+def to_etree(element):
+    """Return element as an ElementTree element, e.g. to serialize it"""
+    if not isinstance(element, Element):
+        return element
+    tree_element = ET.Element(element.tag, element.attrib)
+    for child in element:
+        tree_element.append(to_etree(child))
+    return tree_element
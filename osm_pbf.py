@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file reads OpenStreetMap .osm.pbf files and turns them into the same
+stream of elements the XML parsers produce; osm_parsers.get_element wraps them
+in its Element objects, so that every stage of the pipeline (data.py,
+audit.py, users.py, ...) accepts a .osm.pbf file wherever it accepts an .osm
+file.
+
+A PBF file is a sequence of blobs, each a length prefixed BlobHeader followed
+by a Blob holding a (usually zlib compressed) protocol buffer message. The
+first blob is an OSMHeader, the rest are OSMData PrimitiveBlocks holding
+nodes (plain or in the packed "dense" encoding), ways and relations with
+their tags and metadata. The messages are decoded here with a small protocol
+buffer wire format reader, so no extra packages are needed.
+
+Every data blob decompresses and decodes on its own, so iter_elements reads
+the blobs in the main process and decodes them in a pool of worker
+processes, handing the elements back in file order. Only a few blobs per
+worker are read ahead of the caller, so memory stays bounded however slowly
+the elements are used.
+
+Attribute values are rebuilt as the strings an XML extract holds: ids,
+versions, uids and changesets as integers, timestamps as
+"2015-05-26T20:42:02Z" and coordinates with seven decimals. Ids can be
+negative, as in files written by editors for data not yet uploaded: node ids
+are zigzag encoded (sint64) and way and relation ids two's complement (int64).
+"""
+
+import multiprocessing
+import struct
+import time
+import zlib
+from collections import deque
+
+PBF_EXTENSION = '.pbf'
+
+# Worker processes decoding blobs
+WORKERS = multiprocessing.cpu_count()
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+
+def is_pbf(filename):
+    return isinstance(filename, basestring) and \
+        filename.endswith(PBF_EXTENSION)
+
+
+# ================================================== #
+#               Protocol Buffer Decoding             #
+# ================================================== #
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed(value):
+    """Two's complement of a 64 bit varint (int32/int64 fields)"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def fields(data):
+    """Yield (field number, value) for each field of a message, where the
+    value is an int for varints and a str for length delimited fields"""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type {}".format(wire_type))
+        yield key >> 3, value
+
+
+def packed(data):
+    """Return the list of varints in a packed repeated field"""
+    values = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def packed_sint(data):
+    return [zigzag(value) for value in packed(data)]
+
+
+def delta_decode(values):
+    total = 0
+    decoded = []
+    for value in values:
+        total += value
+        decoded.append(total)
+    return decoded
+
+
+# ================================================== #
+#               OSM Messages                         #
+# ================================================== #
+def _text(value):
+    """Decode a string table entry like ElementTree would: a str when it is
+    ASCII, otherwise a unicode string"""
+    try:
+        value.decode('ascii')
+        return value
+    except UnicodeDecodeError:
+        return value.decode('utf-8')
+
+
+class Block(object):
+    """The shared state of one PrimitiveBlock used to decode its elements"""
+
+    def __init__(self):
+        self.strings = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.date_granularity = 1000
+
+    def coordinate(self, offset, value):
+        nano = offset + self.granularity * value
+        units = (abs(nano) + 50) // 100
+        sign = '-' if nano < 0 and units else ''
+        return '{}{}.{:07d}'.format(sign, units // 10000000,
+                                    units % 10000000)
+
+    def timestamp(self, value):
+        seconds = value * self.date_granularity // 1000
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+    def tags(self, keys, vals):
+        strings = self.strings
+        return [('tag', {'k': strings[k], 'v': strings[v]})
+                for k, v in zip(keys, vals)]
+
+    def info(self, attrib, data):
+        for number, value in fields(data):
+            if number == 1:
+                attrib['version'] = str(signed(value))
+            elif number == 2:
+                attrib['timestamp'] = self.timestamp(signed(value))
+            elif number == 3:
+                attrib['changeset'] = str(signed(value))
+            elif number == 4:
+                attrib['uid'] = str(signed(value))
+            elif number == 5:
+                attrib['user'] = self.strings[value]
+
+
+def decode_node(block, data):
+    attrib = {}
+    keys = vals = ()
+    lat = lon = 0
+    for number, value in fields(data):
+        if number == 1:
+            attrib['id'] = str(zigzag(value))
+        elif number == 2:
+            keys = packed(value)
+        elif number == 3:
+            vals = packed(value)
+        elif number == 4:
+            block.info(attrib, value)
+        elif number == 8:
+            lat = zigzag(value)
+        elif number == 9:
+            lon = zigzag(value)
+    attrib['lat'] = block.coordinate(block.lat_offset, lat)
+    attrib['lon'] = block.coordinate(block.lon_offset, lon)
+    return ('node', attrib, block.tags(keys, vals))
+
+
+def decode_dense_nodes(block, data):
+    ids = lats = lons = keys_vals = ()
+    info = {}
+    for number, value in fields(data):
+        if number == 1:
+            ids = delta_decode(packed_sint(value))
+        elif number == 5:
+            for info_number, info_value in fields(value):
+                info[info_number] = info_value
+        elif number == 8:
+            lats = delta_decode(packed_sint(value))
+        elif number == 9:
+            lons = delta_decode(packed_sint(value))
+        elif number == 10:
+            keys_vals = packed(value)
+
+    versions = packed(info[1]) if 1 in info else None
+    timestamps = delta_decode(packed_sint(info[2])) if 2 in info else None
+    changesets = delta_decode(packed_sint(info[3])) if 3 in info else None
+    uids = delta_decode(packed_sint(info[4])) if 4 in info else None
+    user_sids = delta_decode(packed_sint(info[5])) if 5 in info else None
+
+    strings = block.strings
+    elements = []
+    kv = 0
+    for i, node_id in enumerate(ids):
+        attrib = {'id': str(node_id)}
+        if versions is not None:
+            attrib['version'] = str(versions[i])
+        if timestamps is not None:
+            attrib['timestamp'] = block.timestamp(timestamps[i])
+        if uids is not None:
+            attrib['uid'] = str(uids[i])
+        if user_sids is not None:
+            attrib['user'] = strings[user_sids[i]]
+        if changesets is not None:
+            attrib['changeset'] = str(changesets[i])
+        attrib['lat'] = block.coordinate(block.lat_offset, lats[i])
+        attrib['lon'] = block.coordinate(block.lon_offset, lons[i])
+
+        # keys_vals holds k, v string ids per node, each node ending with 0
+        tags = []
+        while kv < len(keys_vals) and keys_vals[kv] != 0:
+            tags.append(('tag', {'k': strings[keys_vals[kv]],
+                                 'v': strings[keys_vals[kv + 1]]}))
+            kv += 2
+        kv += 1
+        elements.append(('node', attrib, tags))
+    return elements
+
+
+def decode_way(block, data):
+    attrib = {}
+    keys = vals = refs = ()
+    for number, value in fields(data):
+        if number == 1:
+            attrib['id'] = str(signed(value))
+        elif number == 2:
+            keys = packed(value)
+        elif number == 3:
+            vals = packed(value)
+        elif number == 4:
+            block.info(attrib, value)
+        elif number == 8:
+            refs = delta_decode(packed_sint(value))
+    children = [('nd', {'ref': str(ref)}) for ref in refs]
+    children.extend(block.tags(keys, vals))
+    return ('way', attrib, children)
+
+
+def decode_relation(block, data):
+    attrib = {}
+    keys = vals = roles = memids = types = ()
+    for number, value in fields(data):
+        if number == 1:
+            attrib['id'] = str(signed(value))
+        elif number == 2:
+            keys = packed(value)
+        elif number == 3:
+            vals = packed(value)
+        elif number == 4:
+            block.info(attrib, value)
+        elif number == 8:
+            roles = packed(value)
+        elif number == 9:
+            memids = delta_decode(packed_sint(value))
+        elif number == 10:
+            types = packed(value)
+    children = [('member', {'type': MEMBER_TYPES[member_type],
+                            'ref': str(ref),
+                            'role': block.strings[role]})
+                for member_type, ref, role in zip(types, memids, roles)]
+    children.extend(block.tags(keys, vals))
+    return ('relation', attrib, children)
+
+
+def decode_primitive_block(data):
+    block = Block()
+    groups = []
+    for number, value in fields(data):
+        if number == 1:
+            block.strings = [_text(s) for n, s in fields(value) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number == 17:
+            block.granularity = value
+        elif number == 18:
+            block.date_granularity = value
+        elif number == 19:
+            block.lat_offset = signed(value)
+        elif number == 20:
+            block.lon_offset = signed(value)
+
+    elements = []
+    for group in groups:
+        for number, value in fields(group):
+            if number == 1:
+                elements.append(decode_node(block, value))
+            elif number == 2:
+                elements.extend(decode_dense_nodes(block, value))
+            elif number == 3:
+                elements.append(decode_way(block, value))
+            elif number == 4:
+                elements.append(decode_relation(block, value))
+    return elements
+
+
+def decode_header_block(data):
+    """Return a bounds element for the bounding box in the OSMHeader, if
+    it has one"""
+    block = Block()
+    for number, value in fields(data):
+        if number == 1:
+            box = dict((n, zigzag(v)) for n, v in fields(value))
+            return [('bounds', {
+                'minlon': block.coordinate(box.get(1, 0), 0),
+                'maxlon': block.coordinate(box.get(2, 0), 0),
+                'maxlat': block.coordinate(box.get(3, 0), 0),
+                'minlat': block.coordinate(box.get(4, 0), 0)}, [])]
+    return []
+
+
+def blob_data(blob):
+    """Return the uncompressed message in a Blob"""
+    for number, value in fields(blob):
+        if number == 1:
+            return value
+        elif number == 3:
+            return zlib.decompress(value)
+        elif number in (4, 5, 6, 7):
+            raise ValueError("Only raw and zlib compressed blobs are "
+                             "supported")
+    return ''
+
+
+def decode_blob(task):
+    """Return the elements of one blob as (tag, attrib, children) tuples,
+    children being (tag, attrib) tuples; plain tuples are cheap to send back
+    from a worker process"""
+    blob_type, blob = task
+    data = blob_data(blob)
+    if blob_type == 'OSMHeader':
+        return decode_header_block(data)
+    elif blob_type == 'OSMData':
+        return decode_primitive_block(data)
+    return []
+
+
+def read_blobs(filename):
+    """Yield (type, Blob message) for each blob in filename"""
+    with open(filename, 'rb') as f:
+        while True:
+            prefix = f.read(4)
+            if len(prefix) < 4:
+                return
+            header_size, = struct.unpack('>I', prefix)
+            blob_type = None
+            blob_size = 0
+            for number, value in fields(f.read(header_size)):
+                if number == 1:
+                    blob_type = value
+                elif number == 3:
+                    blob_size = value
+            yield blob_type, f.read(blob_size)
+
+
+def iter_elements(filename, tags=('node', 'way', 'relation'),
+                  workers=None):
+    """Yield (tag, attrib, children) for each element of a .osm.pbf file
+    whose tag is in tags, decoding the blobs in a pool of worker processes"""
+
+    if workers is None:
+        workers = WORKERS
+    if workers <= 1:
+        for task in read_blobs(filename):
+            for element in decode_blob(task):
+                if element[0] in tags:
+                    yield element
+        return
+
+    pool = multiprocessing.Pool(workers)
+    in_flight = deque()
+    try:
+        for task in read_blobs(filename):
+            in_flight.append(pool.apply_async(decode_blob, (task,)))
+            if len(in_flight) > 2 * workers:
+                for element in in_flight.popleft().get():
+                    if element[0] in tags:
+                        yield element
+        while in_flight:
+            for element in in_flight.popleft().get():
+                if element[0] in tags:
+                    yield element
+        pool.close()
+    finally:
+        # as in compression.parallel_bz2_chunks, let the tasks in flight
+        # finish before terminating the pool
+        for result in in_flight:
+            result.wait()
+        pool.terminate()
+        pool.join()
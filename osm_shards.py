@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file splits an OSM XML file into shards which can be parsed on their own,
+for example by separate worker processes in data.py.
+
+An OSM file is a flat list of top level <node>, <way> and <relation> elements
+wrapped in a single <osm> root, so a shard boundary can be placed in front of
+any top level element start tag. find_shard_offsets() returns the byte offsets
+of those boundaries and ShardFile wraps a byte range of the original file
+between a copy of the file prolog (everything up to and including the <osm>
+start tag) and a closing </osm> tag, so that the range reads like a complete
+OSM document to iterparse.
+"""
+
+import os
+import re
+
+TOP_LEVEL_START = re.compile(r'<(?:node|way|relation)[\s/>]')
+OSM_START = re.compile(r'<osm[\s>][^>]*>')
+OSM_END = '</osm>'
+
+CHUNK_SIZE = 1 << 16
+
+
+def find_element_start(osm_file, offset, limit):
+    """Return the offset of the first top level element start at or after
+    offset, or limit if there is none before it"""
+    osm_file.seek(offset)
+    position = offset
+    carry = ''
+    while position < limit:
+        chunk = osm_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buf = carry + chunk
+        match = TOP_LEVEL_START.search(buf)
+        if match:
+            return min(position - len(carry) + match.start(), limit)
+        # keep enough of the tail to match a start tag split across chunks
+        carry = buf[-10:]
+        position += len(chunk)
+    return limit
+
+
+def read_prolog(osm_file):
+    """Return the bytes of the file up to and including the <osm> start tag"""
+    osm_file.seek(0)
+    head = ''
+    while True:
+        chunk = osm_file.read(CHUNK_SIZE)
+        head += chunk
+        match = OSM_START.search(head)
+        if match:
+            return head[:match.end()]
+        if not chunk:
+            raise ValueError("No <osm> root element found")
+
+
+def find_body_end(osm_file, size):
+    """Return the offset of the closing </osm> tag"""
+    tail_start = max(0, size - CHUNK_SIZE)
+    osm_file.seek(tail_start)
+    index = osm_file.read().rfind(OSM_END)
+    if index == -1:
+        raise ValueError("No closing </osm> tag found")
+    return tail_start + index
+
+
+def find_shard_offsets(filename, shards, start=None):
+    """Split filename, or the part of it from the element starting at offset
+    start on, into at most shards byte ranges that each start at a top level
+    element, returning (prolog, [(start, end), ...])"""
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as osm_file:
+        prolog = read_prolog(osm_file)
+        body_end = find_body_end(osm_file, size)
+        if start is None:
+            start = len(prolog)
+        body_start = find_element_start(osm_file, start, body_end)
+
+        step = max(1, (body_end - body_start) // shards)
+        starts = [body_start]
+        for i in range(1, shards):
+            start = find_element_start(osm_file, body_start + i * step,
+                                       body_end)
+            if start > starts[-1] and start < body_end:
+                starts.append(start)
+
+    return prolog, zip(starts, starts[1:] + [body_end])
+
+
+class ShardFile(object):
+    """Read-only file object presenting a byte range of an OSM file as a
+    complete OSM document"""
+
+    def __init__(self, filename, start, end, prolog):
+        self._file = open(filename, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+        self._prolog = prolog
+        self._epilog = OSM_END + '\n'
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._prolog) + self._remaining + len(self._epilog)
+
+        out = ''
+        if self._prolog:
+            out, self._prolog = self._prolog[:size], self._prolog[size:]
+        if len(out) < size and self._remaining:
+            body = self._file.read(min(size - len(out), self._remaining))
+            self._remaining -= len(body)
+            out += body
+        if len(out) < size and not self._remaining and self._epilog:
+            take = size - len(out)
+            out, self._epilog = out + self._epilog[:take], self._epilog[take:]
+        return out
+
+    def tell(self):
+        """Return the position in the whole OSM file read up to"""
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file holds the single pass engine the exploration scripts share. Rather
+than every script running its own iterparse loop over the whole OSM file, run()
+parses the file once and hands each complete top level element (node, way,
+relation, bounds, ...) to a list of collectors.
+
+A collector is any object with two methods:
+  - element(elem), called with every top level element once its children have
+    been parsed, and finally with the (by then empty) root element
+  - result(), which returns whatever the collector has gathered
+Examples are users.UserCollector, count_tags.TagCounter,
+key_types.KeyTypeCollector and audit.StreetAuditCollector; profile_osm.py runs
+all of them together. A new collector only needs those two methods and can be
+added to the list without another pass over the file.
+
+A .osm.pbf file is read with osm_pbf.py instead, which produces the same
+elements, followed by an empty "osm" root element. A .osm.gz, .osm.bz2 or
+.osm.xz file is decompressed as it is parsed (see compression.py).
+"""
+
+import xml.etree.cElementTree as ET
+
+import compression
+import osm_parsers
+import osm_pbf
+
+
+def run(filename, collectors):
+    """Parse filename once, feeding every collector, and return the list of
+    their results"""
+
+    if osm_pbf.is_pbf(filename):
+        elements = osm_parsers.pbf_elements(
+            filename, tags=('bounds', 'node', 'way', 'relation'))
+        for elem in elements:
+            for collector in collectors:
+                collector.element(elem)
+        root = osm_parsers.Element('osm', {})
+        for collector in collectors:
+            collector.element(root)
+        return [collector.result() for collector in collectors]
+
+    with compression.open_input(filename) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                for collector in collectors:
+                    collector.element(elem)
+                root.clear()
+
+    for collector in collectors:
+        collector.element(root)
+    return [collector.result() for collector in collectors]
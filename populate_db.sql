@@ -1,4 +1,19 @@
-# This file contains drop and create statements for all tables in our database
+-- This file contains drop and create statements for all tables in our database
+
+-- The views and tables of populate_db_compact.sql, if the database held the
+-- compact version; DROP VIEW IF EXISTS of a table is let through by
+-- sql_files.createTablesFromFile, as there is no view of that name
+
+DROP VIEW IF EXISTS nodes;
+DROP VIEW IF EXISTS nodes_tags;
+DROP VIEW IF EXISTS ways;
+DROP VIEW IF EXISTS ways_tags;
+DROP TABLE IF EXISTS nodes_compact;
+DROP TABLE IF EXISTS nodes_tags_compact;
+DROP TABLE IF EXISTS ways_compact;
+DROP TABLE IF EXISTS ways_tags_compact;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS tag_keys;
 
 DROP TABLE IF EXISTS nodes;
 
@@ -52,4 +67,19 @@ CREATE TABLE ways_nodes (
     position INTEGER NOT NULL,
     FOREIGN KEY (id) REFERENCES ways(id),
     FOREIGN KEY (node_id) REFERENCES nodes(id)
-);
\ No newline at end of file
+);
+
+DROP TABLE IF EXISTS ways_geometry;
+
+CREATE TABLE ways_geometry (
+    id INTEGER PRIMARY KEY NOT NULL,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    centroid_lat REAL,
+    centroid_lon REAL,
+    length REAL,
+    missing_nodes INTEGER,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
@@ -0,0 +1,229 @@
+-- This file contains drop and create statements for the compact version of
+-- our database (see compact.py). The user names and the tag keys and types,
+-- repeated in millions of rows, are each stored once in a dictionary table
+-- and referenced by integer id; timestamps are seconds since 1970, versions
+-- are integers and coordinates are fixed point integers of 10^-7 degrees.
+-- The views nodes, nodes_tags, ways and ways_tags show the tables with the
+-- columns of populate_db.sql, so the queries in explore.sql run unchanged,
+-- and their INSTEAD OF triggers let rows be inserted and deleted through
+-- them, as create_and_fill_db.fillTables and apply_osc.py do.
+
+-- The views of an earlier compact load, or the tables of populate_db.sql;
+-- sql_files.createTablesFromFile lets through the DROP VIEW IF EXISTS of a
+-- table and the DROP TABLE IF EXISTS of a view, as there is none to drop
+
+DROP VIEW IF EXISTS nodes;
+DROP VIEW IF EXISTS nodes_tags;
+DROP VIEW IF EXISTS ways;
+DROP VIEW IF EXISTS ways_tags;
+DROP TABLE IF EXISTS nodes;
+DROP TABLE IF EXISTS nodes_tags;
+DROP TABLE IF EXISTS ways;
+DROP TABLE IF EXISTS ways_tags;
+
+DROP TABLE IF EXISTS users;
+
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY NOT NULL,
+    uid INTEGER,
+    user TEXT,
+    UNIQUE (uid, user)
+);
+
+DROP TABLE IF EXISTS tag_keys;
+
+CREATE TABLE tag_keys (
+    id INTEGER PRIMARY KEY NOT NULL,
+    key TEXT NOT NULL,
+    type TEXT,
+    UNIQUE (key, type)
+);
+
+DROP TABLE IF EXISTS nodes_compact;
+
+CREATE TABLE nodes_compact (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat INTEGER,
+    lon INTEGER,
+    user_id INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+DROP TABLE IF EXISTS nodes_tags_compact;
+
+CREATE TABLE nodes_tags_compact (
+    id INTEGER,
+    key_id INTEGER,
+    value TEXT,
+    FOREIGN KEY (id) REFERENCES nodes_compact(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id)
+);
+
+DROP TABLE IF EXISTS ways_compact;
+
+CREATE TABLE ways_compact (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user_id INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp INTEGER,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+DROP TABLE IF EXISTS ways_tags_compact;
+
+CREATE TABLE ways_tags_compact (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways_compact(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id)
+);
+
+DROP TABLE IF EXISTS ways_nodes;
+
+CREATE TABLE ways_nodes (
+    id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways_compact(id),
+    FOREIGN KEY (node_id) REFERENCES nodes_compact(id)
+);
+
+DROP TABLE IF EXISTS ways_geometry;
+
+CREATE TABLE ways_geometry (
+    id INTEGER PRIMARY KEY NOT NULL,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    centroid_lat REAL,
+    centroid_lon REAL,
+    length REAL,
+    missing_nodes INTEGER,
+    FOREIGN KEY (id) REFERENCES ways_compact(id)
+);
+
+-- The tables with the columns of populate_db.sql
+
+CREATE VIEW nodes AS
+SELECT n.id AS id,
+       n.lat / 10000000.0 AS lat,
+       n.lon / 10000000.0 AS lon,
+       u.user AS user,
+       u.uid AS uid,
+       n.version AS version,
+       n.changeset AS changeset,
+       strftime('%Y-%m-%dT%H:%M:%SZ', n.timestamp, 'unixepoch') AS timestamp
+FROM nodes_compact n LEFT JOIN users u ON u.id = n.user_id;
+
+CREATE VIEW nodes_tags AS
+SELECT t.id AS id, k.key AS key, t.value AS value, k.type AS type
+FROM nodes_tags_compact t JOIN tag_keys k ON k.id = t.key_id;
+
+CREATE VIEW ways AS
+SELECT w.id AS id,
+       u.user AS user,
+       u.uid AS uid,
+       CAST(w.version AS TEXT) AS version,
+       w.changeset AS changeset,
+       strftime('%Y-%m-%dT%H:%M:%SZ', w.timestamp, 'unixepoch') AS timestamp
+FROM ways_compact w LEFT JOIN users u ON u.id = w.user_id;
+
+CREATE VIEW ways_tags AS
+SELECT t.id AS id, k.key AS key, t.value AS value, k.type AS type
+FROM ways_tags_compact t JOIN tag_keys k ON k.id = t.key_id;
+
+-- Inserting into and deleting from the views; an INSERT OR IGNORE on a view
+-- ignores conflicts in the statements of its trigger as well
+
+CREATE TRIGGER nodes_insert INSTEAD OF INSERT ON nodes
+BEGIN
+    INSERT INTO users (uid, user)
+    SELECT CAST(NEW.uid AS INTEGER), NEW.user
+    WHERE NOT EXISTS (SELECT 1 FROM users
+                      WHERE uid IS CAST(NEW.uid AS INTEGER)
+                      AND user IS NEW.user);
+    INSERT INTO nodes_compact (id, lat, lon, user_id, version, changeset,
+                               timestamp)
+    VALUES (NEW.id,
+            CAST(round(NEW.lat * 10000000) AS INTEGER),
+            CAST(round(NEW.lon * 10000000) AS INTEGER),
+            (SELECT id FROM users WHERE uid IS CAST(NEW.uid AS INTEGER)
+             AND user IS NEW.user),
+            CAST(NEW.version AS INTEGER),
+            NEW.changeset,
+            CAST(strftime('%s', NEW.timestamp) AS INTEGER));
+END;
+
+CREATE TRIGGER nodes_delete INSTEAD OF DELETE ON nodes
+BEGIN
+    DELETE FROM nodes_compact WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER ways_insert INSTEAD OF INSERT ON ways
+BEGIN
+    INSERT INTO users (uid, user)
+    SELECT CAST(NEW.uid AS INTEGER), NEW.user
+    WHERE NOT EXISTS (SELECT 1 FROM users
+                      WHERE uid IS CAST(NEW.uid AS INTEGER)
+                      AND user IS NEW.user);
+    INSERT INTO ways_compact (id, user_id, version, changeset, timestamp)
+    VALUES (NEW.id,
+            (SELECT id FROM users WHERE uid IS CAST(NEW.uid AS INTEGER)
+             AND user IS NEW.user),
+            CAST(NEW.version AS INTEGER),
+            NEW.changeset,
+            CAST(strftime('%s', NEW.timestamp) AS INTEGER));
+END;
+
+CREATE TRIGGER ways_delete INSTEAD OF DELETE ON ways
+BEGIN
+    DELETE FROM ways_compact WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER nodes_tags_insert INSTEAD OF INSERT ON nodes_tags
+BEGIN
+    INSERT INTO tag_keys (key, type)
+    SELECT NEW.key, NEW.type
+    WHERE NOT EXISTS (SELECT 1 FROM tag_keys
+                      WHERE key IS NEW.key AND type IS NEW.type);
+    INSERT INTO nodes_tags_compact (id, key_id, value)
+    VALUES (NEW.id,
+            (SELECT id FROM tag_keys WHERE key IS NEW.key
+             AND type IS NEW.type),
+            NEW.value);
+END;
+
+CREATE TRIGGER nodes_tags_delete INSTEAD OF DELETE ON nodes_tags
+BEGIN
+    DELETE FROM nodes_tags_compact
+    WHERE id = OLD.id AND key_id = (SELECT id FROM tag_keys
+                                    WHERE key IS OLD.key
+                                    AND type IS OLD.type);
+END;
+
+CREATE TRIGGER ways_tags_insert INSTEAD OF INSERT ON ways_tags
+BEGIN
+    INSERT INTO tag_keys (key, type)
+    SELECT NEW.key, NEW.type
+    WHERE NOT EXISTS (SELECT 1 FROM tag_keys
+                      WHERE key IS NEW.key AND type IS NEW.type);
+    INSERT INTO ways_tags_compact (id, key_id, value)
+    VALUES (NEW.id,
+            (SELECT id FROM tag_keys WHERE key IS NEW.key
+             AND type IS NEW.type),
+            NEW.value);
+END;
+
+CREATE TRIGGER ways_tags_delete INSTEAD OF DELETE ON ways_tags
+BEGIN
+    DELETE FROM ways_tags_compact
+    WHERE id = OLD.id AND key_id = (SELECT id FROM tag_keys
+                                    WHERE key IS OLD.key
+                                    AND type IS OLD.type);
+END;
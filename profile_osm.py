@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file profiles an OSM file in a single pass. It runs the collectors behind
+users.py, count_tags.py, key_types.py and audit.py together through
+osm_stream.run, so the file is parsed once instead of four times, and returns
+the same results each of those scripts returns on its own.
+"""
+
+import pprint
+
+import audit
+import count_tags
+import key_types
+import osm_stream
+import users
+
+OSM_PATH = "london_sample.osm"
+
+
+def profile(filename, extra_collectors=()):
+    """Return a dictionary with the users, tags, key types and street audit
+    of filename, followed by the results of any extra collectors"""
+
+    collectors = [users.UserCollector(),
+                  count_tags.TagCounter(),
+                  key_types.KeyTypeCollector(),
+                  audit.StreetAuditCollector()] + list(extra_collectors)
+    results = osm_stream.run(filename, collectors)
+    user_set, tag_dict, keys, street_audit = results[:4]
+    return {'users': user_set,
+            'tags': tag_dict,
+            'key_types': keys,
+            'street_types': dict(street_audit[0]),
+            'fixes': street_audit[1],
+            'extra': results[4:]}
+
+
+if __name__ == '__main__':
+    results = profile(OSM_PATH)
+    print 'There are ' + str(len(results['users'])) + ' unique users.'
+    pprint.pprint(results['tags'])
+    pprint.pprint(results['key_types'])
+    pprint.pprint(results['street_types'])
+    pprint.pprint(results['fixes'])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file defines the compact records data.py shapes every node and way into.
+
+Building a dictionary for every node, every tag and every nd reference of a
+way is what used to dominate the time (and memory) spent shaping elements.
+Instead:
+
+- Node, Way and Tag are namedtuples whose fields are in the column order of
+  the csv files and the sql tables, so writers can use them as rows as-is
+- a way keeps the refs of its nd children in a typed array, and the position
+  of each ref is simply its index in that array; way_node_rows() produces the
+  (id, node_id, position) rows on the fly
+- ShapedNode and ShapedWay hold the pieces of one element in __slots__
+- WayGeometry is a row of the ways_geometry table node_store.py derives from
+  the node coordinates of each way
+
+as_dict() turns a shaped element back into the dictionary format described in
+data.py, which is what the schema in schema.py validates.
+"""
+
+from array import array
+from collections import namedtuple
+from itertools import count, izip, repeat
+
+Node = namedtuple('Node', ['id', 'lat', 'lon', 'user', 'uid', 'version',
+                           'changeset', 'timestamp'])
+Way = namedtuple('Way', ['id', 'user', 'uid', 'version', 'changeset',
+                         'timestamp'])
+Tag = namedtuple('Tag', ['id', 'key', 'value', 'type'])
+WayGeometry = namedtuple('WayGeometry', ['id', 'min_lat', 'min_lon',
+                                         'max_lat', 'max_lon', 'centroid_lat',
+                                         'centroid_lon', 'length',
+                                         'missing_nodes'])
+
+# 64 bit signed integers; Python 2's array module has no 'q' type code, but
+# 'l' is 64 bits wide on the 64 bit platforms we run on
+try:
+    array('q')
+    REF_TYPECODE = 'q'
+except ValueError:
+    REF_TYPECODE = 'l'
+
+
+def new_refs():
+    return array(REF_TYPECODE)
+
+
+def _row_dict(row):
+    return dict(zip(row._fields, row))
+
+
+class ShapedNode(object):
+    """A node row and the tag rows of its children"""
+
+    __slots__ = ('node', 'tags')
+    tag = 'node'
+
+    def __init__(self, node, tags):
+        self.node = node
+        self.tags = tags
+
+    def as_dict(self):
+        return {'node': _row_dict(self.node),
+                'node_tags': [_row_dict(tag) for tag in self.tags]}
+
+
+class ShapedWay(object):
+    """A way row, the tag rows of its children and the refs of its nd
+    children in file order"""
+
+    __slots__ = ('way', 'tags', 'node_refs')
+    tag = 'way'
+
+    def __init__(self, way, tags, node_refs):
+        self.way = way
+        self.tags = tags
+        self.node_refs = node_refs
+
+    def way_node_rows(self):
+        """Return an iterator over the (id, node_id, position) rows"""
+        return izip(repeat(self.way.id), self.node_refs, count())
+
+    def as_dict(self):
+        return {'way': _row_dict(self.way),
+                'way_nodes': [{'id': way_id, 'node_id': node_id,
+                               'position': position}
+                              for way_id, node_id, position
+                              in self.way_node_rows()],
+                'way_tags': [_row_dict(tag) for tag in self.tags]}
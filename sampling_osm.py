@@ -7,43 +7,259 @@ when initially building the Python functions to audit the data, as you can run
 and check those functions on a smaller sample of the data before running it on
 the whole dataset.
 
-To get a smaller sample, increase the value of k. To get a larger sample,
-decrease the value of k. k specifies every k-th top level element to extract.
+sample() keeps a seeded random selection of the top level elements, either a
+fraction of them or as many as fit in a target size in bytes:
+- with stratify (the default) the same fraction of the nodes, of the ways and
+  of the relations is kept, so the sample has the mix of element types of the
+  full file
+- with closure every node referenced by a sampled way is added as well, so
+  that the ways_nodes rows of the sample all join to a node
 
-NOTE: This code was taken directly from Udacity's Wrangle OpenStreetMap Data
-Project details.
+Nothing is parsed or re-serialized. A first pass scans the file for the byte
+range of every element (with element_spans in osm_parsers.py) and a second one
+copies the chosen byte ranges into the sample, in file order, exactly as they
+appear in the original. A .osm.pbf file has no such byte ranges, so its
+sampled elements are written out with ElementTree instead.
+
+A compressed .osm.gz, .osm.bz2 or .osm.xz file is sampled the same way: the
+byte ranges are positions in its decompressed bytes, which the passes read
+front to back (see compression.py). A sample_file with one of those
+extensions is written compressed.
+
+Run it from the command line, e.g.
+
+    python sampling_osm.py london_data.osm london_sample.osm --fraction 0.05 \\
+        --seed 1 --closure
+
+NOTE: The original version of this file, which kept every k-th element, was
+taken directly from Udacity's Wrangle OpenStreetMap Data Project details.
 """
 
-import xml.etree.ElementTree as ET
+import argparse
+import random
+import re
+import xml.etree.cElementTree as ET
+
+import compression
+import osm_parsers
+import osm_pbf
+import osm_shards
+import records
 
 OSM_FILE = "london_data.osm"
 SAMPLE_FILE = "london_sample.osm"
 
-k = 20
+# Share of the elements kept when neither a fraction nor a size is given
+DEFAULT_FRACTION = 0.05
+
+ELEMENT_TYPES = ('node', 'way', 'relation')
+ND_REF = re.compile(r'<nd\s[^>]*?ref\s*=\s*["\'](-?\d+)')
+
+PBF_PROLOG = '<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">'
+
+
+class ElementIndex(object):
+    """The id and position of every top level element of an OSM file, by
+    element type; positions are byte ranges of an XML file, or the running
+    number of the element in a .osm.pbf file"""
+
+    def __init__(self):
+        self.ids = dict((tag, records.new_refs()) for tag in ELEMENT_TYPES)
+        self.starts = dict((tag, records.new_refs()) for tag in ELEMENT_TYPES)
+        self.ends = dict((tag, records.new_refs()) for tag in ELEMENT_TYPES)
+        self.header_end = 0
+
+    def add(self, tag, element_id, start, end):
+        self.ids[tag].append(element_id)
+        self.starts[tag].append(start)
+        self.ends[tag].append(end)
+
+    def count(self, tag):
+        return len(self.ids[tag])
+
+    def size(self):
+        """Return the number of bytes taken up by the elements"""
+        return sum(sum(self.ends[tag]) - sum(self.starts[tag])
+                   for tag in ELEMENT_TYPES)
+
+
+def index_xml(osm_file):
+    """Return the ElementIndex of an XML file; header_end is where its first
+    element starts, so that everything before it (the xml declaration, the
+    <osm> start tag and <bounds>) can be copied into the sample"""
+    index = ElementIndex()
+    index.header_end = None
+    with compression.open_input(osm_file) as f:
+        for match, _, end, offset in osm_parsers.element_spans(f):
+            start = offset + match.start()
+            if index.header_end is None:
+                index.header_end = start
+            attrib = osm_parsers.parse_attributes(match.group(2), ('id',))
+            index.add(match.group(1), int(attrib['id']), start, offset + end)
+        if index.header_end is None:
+            index.header_end = len(osm_shards.read_prolog(f))
+    return index
+
+
+def index_pbf(osm_file):
+    index = ElementIndex()
+    for number, (tag, attrib, _) in enumerate(
+            osm_pbf.iter_elements(osm_file, ELEMENT_TYPES)):
+        index.add(tag, int(attrib['id']), number, number + 1)
+    return index
+
+
+def choose(index, fraction, rng, stratify=True):
+    """Return {tag: set of positions in index} of a random fraction of the
+    elements"""
+    chosen = dict((tag, set()) for tag in ELEMENT_TYPES)
+    if stratify:
+        for tag in ELEMENT_TYPES:
+            count = index.count(tag)
+            chosen[tag].update(rng.sample(xrange(count),
+                                          int(round(fraction * count))))
+        return chosen
+
+    bounds = []
+    total = 0
+    for tag in ELEMENT_TYPES:
+        total += index.count(tag)
+        bounds.append((total, tag))
+    for number in rng.sample(xrange(total), int(round(fraction * total))):
+        first = 0
+        for limit, tag in bounds:
+            if number < limit:
+                chosen[tag].add(number - first)
+                break
+            first = limit
+    return chosen
+
+
+def way_refs_xml(osm_file, index, ways):
+    """Return the set of node ids referenced by the chosen ways"""
+    refs = set()
+    with compression.open_input(osm_file) as f:
+        for position in sorted(ways):
+            start = index.starts['way'][position]
+            f.seek(start)
+            text = f.read(index.ends['way'][position] - start)
+            refs.update(int(ref) for ref in ND_REF.findall(text))
+    return refs
+
+
+def way_refs_pbf(osm_file, index, ways):
+    wanted = set(index.ids['way'][position] for position in ways)
+    refs = set()
+    for _, attrib, children in osm_pbf.iter_elements(osm_file, ('way',)):
+        if int(attrib['id']) in wanted:
+            refs.update(int(child_attrib['ref'])
+                        for child_tag, child_attrib in children
+                        if child_tag == 'nd')
+    return refs
+
+
+def add_way_nodes(index, chosen, refs):
+    """Add the nodes with an id in refs to the chosen nodes"""
+    nodes = chosen['node']
+    for position, node_id in enumerate(index.ids['node']):
+        if node_id in refs:
+            nodes.add(position)
+
+
+def write_xml(osm_file, sample_file, index, chosen):
+    """Copy the header and the byte ranges of the chosen elements of
+    osm_file into sample_file"""
+    spans = sorted((index.starts[tag][position], index.ends[tag][position])
+                   for tag in ELEMENT_TYPES for position in chosen[tag])
+    with compression.open_input(osm_file) as f, \
+            compression.open_output(sample_file) as output:
+        output.write(f.read(index.header_end).rstrip())
+        position = index.header_end
+        for start, end in spans:
+            if start != position:
+                f.seek(start)
+            output.write('\n  ')
+            output.write(f.read(end - start))
+            position = end
+        output.write('\n' + osm_shards.OSM_END + '\n')
+
+
+def write_pbf(osm_file, sample_file, index, chosen):
+    numbers = set()
+    for tag in ELEMENT_TYPES:
+        numbers.update(index.starts[tag][position]
+                       for position in chosen[tag])
+    elements = osm_parsers.pbf_elements(osm_file, ELEMENT_TYPES)
+    with compression.open_output(sample_file) as output:
+        output.write(PBF_PROLOG)
+        for number, element in enumerate(elements):
+            if number in numbers:
+                output.write('\n  ')
+                output.write(ET.tostring(osm_parsers.to_etree(element),
+                                         encoding='utf-8'))
+        output.write('\n' + osm_shards.OSM_END + '\n')
+
+
+def sample(osm_file, sample_file, fraction=None, size=None, seed=None,
+           stratify=True, closure=False):
+    """Write a random sample of the elements of osm_file to sample_file and
+    return the number of elements of each type in it.
+
+    fraction is the share of the elements to keep; size instead asks for a
+    sample of about that many bytes of elements (before closure adds nodes),
+    which needs an XML osm_file. The same seed gives the same sample."""
+
+    pbf = osm_pbf.is_pbf(osm_file)
+    if pbf and size is not None:
+        raise ValueError("A target size needs an XML .osm file")
+
+    index = index_pbf(osm_file) if pbf else index_xml(osm_file)
+    if size is not None:
+        fraction = float(size) / max(1, index.size())
+    elif fraction is None:
+        fraction = DEFAULT_FRACTION
+    fraction = min(1.0, max(0.0, fraction))
 
+    chosen = choose(index, fraction, random.Random(seed), stratify)
+    if closure and chosen['way']:
+        if pbf:
+            refs = way_refs_pbf(osm_file, index, chosen['way'])
+        else:
+            refs = way_refs_xml(osm_file, index, chosen['way'])
+        add_way_nodes(index, chosen, refs)
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag
+    if pbf:
+        write_pbf(osm_file, sample_file, index, chosen)
+    else:
+        write_xml(osm_file, sample_file, index, chosen)
+    return dict((tag, len(chosen[tag])) for tag in ELEMENT_TYPES)
 
-    Reference:
-    http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-
-    generated-via-xml-etree-elementtree-in-python
-    """
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a random sample of an OSM file")
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE)
+    parser.add_argument('sample_file', nargs='?', default=SAMPLE_FILE)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--fraction', type=float,
+                       help="share of the elements to keep (default {})"
+                       .format(DEFAULT_FRACTION))
+    group.add_argument('--size', type=int,
+                       help="target size of the sample in bytes")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--no-stratify', dest='stratify',
+                        action='store_false',
+                        help="sample all elements together instead of each "
+                        "element type on its own")
+    parser.add_argument('--closure', action='store_true',
+                        help="also keep every node used by a sampled way")
+    args = parser.parse_args(argv)
 
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write('<osm>\n  ')
+    counts = sample(args.osm_file, args.sample_file, args.fraction,
+                    args.size, args.seed, args.stratify, args.closure)
+    for tag in ELEMENT_TYPES:
+        print tag, counts[tag]
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
 
-    output.write('</osm>')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file builds the R*Tree spatial index of the database and answers
+bounding box queries with it.
+
+The nodes table keeps lat and lon as plain REAL columns, and ways have no
+geometry of their own at all, so without help a question like "what is in
+this part of London" reads every node and joins through ways_nodes. The
+function createSpatialIndex() executes spatial_db.sql, which fills two SQLite
+R*Tree virtual tables once the tables have been filled:
+  - nodes_rtree, with every node as a point
+  - ways_rtree, with the bounding box of every way, taken from the nodes it
+    lists in ways_nodes
+update_spatial_index() keeps both up to date as apply_osc.py changes nodes
+and ways.
+
+query_bbox() returns the nodes inside a bounding box, the ways whose bounding
+box overlaps it, and the tags of both, as the namedtuples of records.py. The
+R*Tree stores its coordinates as 32 bit floats, rounded outwards, so the nodes
+are checked against their exact coordinates as well; the ways are matched on
+their (very slightly enlarged) bounding boxes.
+"""
+
+import sqlite3
+import time
+from itertools import islice
+
+import records
+import sql_files
+
+SPATIAL_DB_PATH = 'spatial_db.sql'
+
+OVERLAPS = ('r.min_lat <= :max_lat AND r.max_lat >= :min_lat AND '
+            'r.min_lon <= :max_lon AND r.max_lon >= :min_lon')
+NODES_INSIDE = ('FROM nodes_rtree r JOIN nodes n ON n.id = r.id '
+                'WHERE ' + OVERLAPS + ' AND '
+                'n.lat BETWEEN :min_lat AND :max_lat AND '
+                'n.lon BETWEEN :min_lon AND :max_lon')
+WAYS_OVERLAPPING = ('FROM ways_rtree r JOIN ways w ON w.id = r.id '
+                    'WHERE ' + OVERLAPS)
+
+NODES_QUERY = 'SELECT n.* ' + NODES_INSIDE + ';'
+NODES_TAGS_QUERY = ('SELECT t.* ' + NODES_INSIDE.replace(
+    'WHERE', 'JOIN nodes_tags t ON t.id = n.id WHERE', 1) + ';')
+WAYS_QUERY = 'SELECT w.* ' + WAYS_OVERLAPPING + ';'
+WAYS_TAGS_QUERY = ('SELECT t.* ' + WAYS_OVERLAPPING.replace(
+    'WHERE', 'JOIN ways_tags t ON t.id = w.id WHERE', 1) + ';')
+
+# Ids per statement when updating the index; sqlite allows 999 parameters
+UPDATE_BATCH = 500
+
+
+def createSpatialIndex(dbname, filename=SPATIAL_DB_PATH):
+    sql_files.createTablesFromFile(filename, dbname)
+
+
+def has_spatial_index(db_conn):
+    return db_conn.execute(
+        "SELECT count(*) FROM sqlite_master "
+        "WHERE name IN ('nodes_rtree', 'ways_rtree');").fetchone()[0] == 2
+
+
+def _batches(ids):
+    ids = iter(ids)
+    while True:
+        batch = list(islice(ids, UPDATE_BATCH))
+        if not batch:
+            return
+        yield batch
+
+
+def _in(ids):
+    return '({})'.format(', '.join('?' * len(ids)))
+
+
+def update_spatial_index(db_conn, node_ids, way_ids):
+    """Bring the R*Tree entries of the nodes node_ids and the ways way_ids
+    up to date; they may have been created, modified or deleted, and way_ids
+    has to include every way using one of the nodes"""
+
+    for batch in _batches(node_ids):
+        db_conn.execute('DELETE FROM nodes_rtree WHERE id IN {};'.format(
+            _in(batch)), batch)
+        db_conn.execute(
+            'INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon) '
+            'SELECT id, lat, lat, lon, lon FROM nodes WHERE id IN {} '
+            'AND lat IS NOT NULL AND lon IS NOT NULL;'.format(_in(batch)),
+            batch)
+
+    for batch in _batches(way_ids):
+        db_conn.execute('DELETE FROM ways_rtree WHERE id IN {};'.format(
+            _in(batch)), batch)
+        db_conn.execute(
+            'INSERT INTO ways_rtree (id, min_lat, max_lat, min_lon, max_lon) '
+            'SELECT ways_nodes.id, min(nodes.lat), max(nodes.lat), '
+            'min(nodes.lon), max(nodes.lon) '
+            'FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id '
+            'WHERE ways_nodes.id IN {} '
+            'GROUP BY ways_nodes.id;'.format(_in(batch)), batch)
+
+
+def query_bbox(db_conn, min_lat, min_lon, max_lat, max_lon, tags=True):
+    """Return a dictionary with the nodes inside the bounding box, the ways
+    overlapping it and, with tags=True, the tags of both"""
+
+    bbox = {'min_lat': min_lat, 'min_lon': min_lon,
+            'max_lat': max_lat, 'max_lon': max_lon}
+    result = {
+        'nodes': [records.Node._make(row)
+                  for row in db_conn.execute(NODES_QUERY, bbox)],
+        'ways': [records.Way._make(row)
+                 for row in db_conn.execute(WAYS_QUERY, bbox)],
+    }
+    if tags:
+        result['nodes_tags'] = [records.Tag._make(row) for row
+                                in db_conn.execute(NODES_TAGS_QUERY, bbox)]
+        result['ways_tags'] = [records.Tag._make(row) for row
+                               in db_conn.execute(WAYS_TAGS_QUERY, bbox)]
+    return result
+
+
+if __name__ == '__main__':
+    sqlite_db_file = 'london_osm.db'
+
+    createSpatialIndex(sqlite_db_file)
+
+    # Around Trafalgar Square
+    db_conn = sqlite3.connect(sqlite_db_file)
+    start = time.time()
+    found = query_bbox(db_conn, 51.5055, -0.1310, 51.5090, -0.1250)
+    print "{} nodes and {} ways in {:.1f} ms".format(
+        len(found['nodes']), len(found['ways']),
+        (time.time() - start) * 1000)
+    db_conn.close()
@@ -0,0 +1,31 @@
+-- This file contains the R*Tree spatial index over our database. Like the
+-- indexes in index_db.sql it is built only after the tables have been filled.
+-- nodes_rtree holds each node as a point and ways_rtree the bounding box of
+-- each way, worked out from the nodes it lists in ways_nodes.
+
+DROP TABLE IF EXISTS nodes_rtree;
+
+CREATE VIRTUAL TABLE nodes_rtree USING rtree (
+    id,
+    min_lat, max_lat,
+    min_lon, max_lon
+);
+
+INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon)
+SELECT id, lat, lat, lon, lon
+FROM nodes
+WHERE lat IS NOT NULL AND lon IS NOT NULL;
+
+DROP TABLE IF EXISTS ways_rtree;
+
+CREATE VIRTUAL TABLE ways_rtree USING rtree (
+    id,
+    min_lat, max_lat,
+    min_lon, max_lon
+);
+
+INSERT INTO ways_rtree (id, min_lat, max_lat, min_lon, max_lon)
+SELECT ways_nodes.id, min(nodes.lat), max(nodes.lat), min(nodes.lon),
+       max(nodes.lon)
+FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id
+GROUP BY ways_nodes.id;
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file reads the .sql files of the project (populate_db.sql,
+index_db.sql, spatial_db.sql, explore.sql, ...) and runs them against a
+database. It is shared by create_and_fill_db.py, index_db.py, spatial.py and
+the others, and imports none of them, so none of them have to import each
+other for it.
+
+The function createTablesFromFile() takes in the following variables:
+  - filename, this pertains to the sql file you wish to read in and execute its
+    queries
+  - dbname, which is the name of the database being altered or created, if no
+    such database exists then the function will create a new one
+With these variables, createTablesFromFile reads and executes the queries from
+the sql file, in our case populate_db.sql which drops and creates tables, into
+the database we specied, in our case london_osm.db. A statement that fails
+raises its sqlite3.Error, so that nothing is loaded into a database whose
+tables were not all created; the one error let through is SQLite refusing a
+DROP TABLE IF EXISTS of a view, or a DROP VIEW IF EXISTS of a table (see
+is_wrong_kind_drop()), which lets populate_db.sql and populate_db_compact.sql
+each drop the tables or views of the other by the same names.
+
+read_statements() returns the statements of a file of queries, such as
+explore.sql, to run one at a time. Both split the files with
+split_statements(), so a ; inside a quoted string or a trigger body does not
+end a statement.
+"""
+
+import re
+import sqlite3
+
+DROP_IF_EXISTS = re.compile(r'^\s*DROP\s+(?:TABLE|VIEW)\s+IF\s+EXISTS\b',
+                            re.IGNORECASE)
+
+
+def is_blank(statement):
+    """Return whether statement holds nothing but whitespace, -- comments
+    and semicolons"""
+    lines = [line for line in statement.splitlines()
+             if not line.strip().startswith('--')]
+    return not ''.join(lines).strip(' \t\r\n;')
+
+
+def split_statements(sql_file):
+    """Return the statements of a sql file; a ; inside a statement, such as
+    in the body of a trigger or in a quoted string, does not end it"""
+    statements = []
+    statement = ''
+    for part in sql_file.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if not is_blank(statement):
+                statements.append(statement)
+            statement = ''
+    if not is_blank(statement):
+        statements.append(statement)
+    return statements
+
+
+def is_wrong_kind_drop(command, error):
+    """Return whether error is SQLite refusing to DROP TABLE IF EXISTS a
+    view, or DROP VIEW IF EXISTS a table, in which case there is no table
+    (or view) of that name to drop"""
+    lines = [line for line in command.splitlines()
+             if not line.strip().startswith('--')]
+    return isinstance(error, sqlite3.OperationalError) and \
+        str(error).startswith('use DROP ') and \
+        DROP_IF_EXISTS.match('\n'.join(lines)) is not None
+
+
+def createTablesFromFile(filename, dbname):
+    with open(filename, 'r') as open_file:
+        sql_file = open_file.read()
+
+    sql_commands = split_statements(sql_file)
+    db_conn = sqlite3.connect(dbname)
+    try:
+        cursor = db_conn.cursor()
+        for command in sql_commands:
+            try:
+                cursor.execute(command)
+            except sqlite3.Error, error:
+                if not is_wrong_kind_drop(command, error):
+                    raise
+            db_conn.commit()
+    finally:
+        db_conn.close()
+
+
+def read_statements(filename):
+    with open(filename, 'r') as open_file:
+        sql_file = open_file.read()
+    return [command.strip().rstrip(';').strip()
+            for command in split_statements(sql_file)]
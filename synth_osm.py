@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file writes synthetic OSM XML files, for benchmarking the pipeline
+(see benchmark.py) without london_data.osm, which is too large to keep in
+the repository.
+
+generate() takes the shape of the file as arguments:
+  - nodes, ways and relations, how many of each to write
+  - seed, the seed of the random generator; the same arguments always give
+    the same file, byte for byte
+  - users, the number of distinct users; a few of them make most of the
+    edits, as in the real data
+  - tagged_nodes, the share of nodes carrying tags (every way has some)
+  - tags_per_element, the (least, most) tags of a tagged element, drawn
+    from NODE_TAGS and WAY_TAGS by their weights
+  - street_fraction and fixme_date_fraction, the share of tagged elements
+    with an addr:street tag (with the abbreviated street types audit.py
+    fixes) and with a fixme:date tag (some of them in the future)
+  - way_length, the (least, most) nodes of a way, and closed_ways, the share
+    of ways ending on their first node
+The nodes of a way are mostly consecutive ids, like the nodes drawn one
+after the other along a real road.
+
+Run it from the command line, e.g.
+
+    python synth_osm.py synthetic.osm --nodes 1000000 --ways 150000 --seed 1
+"""
+
+import argparse
+import calendar
+import random
+import time
+from xml.sax.saxutils import escape
+
+SYNTH_FILE = "synthetic.osm"
+
+# min_lat, min_lon, max_lat, max_lon of Greater London
+LONDON_BBOX = (51.28, -0.51, 51.69, 0.33)
+
+# (weight, key, values) of the tags besides addr:street and fixme:date, with
+# keys of each kind key_types.py tells apart
+NODE_TAGS = [
+    (30, 'amenity', ['cafe', 'pub', 'restaurant', 'bench', 'post_box',
+                     'telephone', 'bicycle_parking']),
+    (25, 'name', ['The Crown', 'Costa', 'Pret A Manger', u'Café Nero',
+                  'The Red Lion', 'Tesco Express']),
+    (15, 'addr:housenumber', [str(number) for number in range(1, 200)]),
+    (10, 'addr:postcode', ['SW1A 1AA', 'EC1A 1BB', 'W1A 0AX', 'NW1 4RY',
+                           'SE1 9SG']),
+    (10, 'shop', ['convenience', 'supermarket', 'bakery', 'clothes']),
+    (8, 'source', ['survey', 'Bing', 'local knowledge']),
+    (5, 'fhrs:id', [str(number) for number in range(100000, 100200)]),
+    (3, 'name:en', ['The Crown', 'Red Lion']),
+    (2, 'FIXME', ['check position', 'opening hours?']),
+    (2, 'naptan:CommonName', ['Trafalgar Square', 'Charing Cross']),
+    (1, 'note 2', ['surveyed']),
+    (1, 'created_by', ['JOSM', 'Potlatch 0.10f']),
+]
+WAY_TAGS = [
+    (40, 'highway', ['residential', 'service', 'footway', 'primary',
+                     'secondary', 'tertiary', 'unclassified']),
+    (30, 'building', ['yes', 'house', 'residential', 'retail']),
+    (25, 'name', ['Oxford Street', 'Baker Street', 'Mill Lane',
+                  'Church Road', u'Rue de Café']),
+    (10, 'source', ['Bing', 'survey', 'OS OpenData StreetView']),
+    (8, 'maxspeed', ['20 mph', '30 mph', '40 mph']),
+    (6, 'oneway', ['yes', 'no']),
+    (5, 'landuse', ['grass', 'residential', 'retail']),
+    (4, 'building:levels', ['1', '2', '3', '4']),
+    (2, 'tiger:cfcc', ['A41']),
+    (1, 'Lighting', ['yes']),
+]
+
+STREET_NAMES = ['High', 'Church', 'Station', 'Park', 'Victoria', 'Green',
+                'Manor', 'Kings', 'Queens', 'Mill', u'Sainte-Hélène',
+                "St John's"]
+# Street types audit.py expects, maps and leaves alone
+STREET_TYPES = ['Street', 'Road', 'Lane', 'Avenue', 'St', 'St.', 'Rd', 'Rd.',
+                'Ave', 'Ave.', 'Mews', 'Grove', 'Gardens', 'Close']
+
+USER_NAMES = ['mapper', 'Ed & Co', u'Jürgen', 'survey_bot', u'Zoë']
+
+RELATION_TYPES = ['multipolygon', 'route', 'restriction', 'boundary']
+
+# Timestamps are drawn between these two
+FIRST_EDIT = calendar.timegm((2007, 1, 1, 0, 0, 0))
+LAST_EDIT = calendar.timegm((2017, 1, 1, 0, 0, 0))
+# fixme:date values are drawn up to this day, past the present
+LAST_FIXME_DATE = calendar.timegm((2030, 12, 31, 0, 0, 0))
+
+ATTRIBUTE_ENTITIES = {'"': '&quot;', '\n': '&#10;', '\t': '&#9;'}
+
+
+def quote(value):
+    """Return value as a double quoted, escaped, UTF-8 XML attribute"""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return '"' + escape(str(value), ATTRIBUTE_ENTITIES) + '"'
+
+
+def weighted_chooser(rng, table):
+    """Return a function drawing a (key, values) pair from a (weight, key,
+    values) table by weight"""
+    total = float(sum(weight for weight, _, _ in table))
+    cumulative = []
+    running = 0
+    for weight, key, values in table:
+        running += weight
+        cumulative.append((running / total, key, values))
+
+    def choose():
+        point = rng.random()
+        for bound, key, values in cumulative:
+            if point < bound:
+                return key, values
+        return cumulative[-1][1:]
+    return choose
+
+
+class Generator(object):
+    """Draw the attributes and tags of synthetic elements from one seeded
+    random generator"""
+
+    def __init__(self, seed, users, street_fraction, fixme_date_fraction,
+                 tags_per_element, bbox):
+        self.rng = random.Random(seed)
+        self.users = [u'{}_{}'.format(USER_NAMES[i % len(USER_NAMES)], i)
+                      for i in range(users)]
+        self.street_fraction = street_fraction
+        self.fixme_date_fraction = fixme_date_fraction
+        self.tags_per_element = tags_per_element
+        self.bbox = bbox
+        self.changeset = 1000
+        self.node_tag = weighted_chooser(self.rng, NODE_TAGS)
+        self.way_tag = weighted_chooser(self.rng, WAY_TAGS)
+
+    def attributes(self, element_id):
+        rng = self.rng
+        # log-uniform index: a few users make most of the edits
+        uid = int(len(self.users) ** rng.random()) - 1
+        if rng.random() < 0.3:
+            self.changeset += 1
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+            rng.randint(FIRST_EDIT, LAST_EDIT)))
+        return ('id={} version={} timestamp={} uid={} user={} '
+                'changeset={}'.format(
+                    quote(element_id), quote(rng.randint(1, 12)),
+                    quote(timestamp), quote(uid + 1),
+                    quote(self.users[uid]), quote(self.changeset)))
+
+    def location(self):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        return ' lat="{:.7f}" lon="{:.7f}"'.format(
+            self.rng.uniform(min_lat, max_lat),
+            self.rng.uniform(min_lon, max_lon))
+
+    def street(self):
+        rng = self.rng
+        return u'{} {}'.format(rng.choice(STREET_NAMES),
+                               rng.choice(STREET_TYPES))
+
+    def fixme_date(self):
+        return time.strftime('%Y-%m-%d', time.gmtime(
+            self.rng.randint(FIRST_EDIT, LAST_FIXME_DATE)))
+
+    def tags(self, choose):
+        """Return the <tag> lines of an element, drawing its other tags with
+        choose"""
+        rng = self.rng
+        tags = {}
+        for _ in range(rng.randint(*self.tags_per_element)):
+            key, values = choose()
+            tags[key] = rng.choice(values)
+        if rng.random() < self.street_fraction:
+            tags['addr:street'] = self.street()
+        if rng.random() < self.fixme_date_fraction:
+            tags['fixme:date'] = self.fixme_date()
+        return ['    <tag k={} v={}/>\n'.format(quote(key), quote(value))
+                for key, value in sorted(tags.items())]
+
+
+def generate(path=SYNTH_FILE, nodes=100000, ways=15000, relations=500,
+             seed=0, users=500, tagged_nodes=0.15, tags_per_element=(1, 4),
+             street_fraction=0.3, fixme_date_fraction=0.01,
+             way_length=(2, 30), closed_ways=0.2, bbox=LONDON_BBOX):
+    """Write a synthetic OSM file to path and return the number of nodes,
+    ways, relations and tags written"""
+
+    generator = Generator(seed, users, street_fraction, fixme_date_fraction,
+                          tags_per_element, bbox)
+    rng = generator.rng
+    counts = {'node': nodes, 'way': ways, 'relation': relations, 'tag': 0}
+    first_way = nodes + 1
+    first_relation = first_way + ways
+
+    with open(path, 'wb') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<osm version="0.6" generator="synth_osm.py">\n'
+                ' <bounds minlat="{}" minlon="{}" maxlat="{}" maxlon="{}"/>\n'
+                .format(*bbox))
+
+        for node_id in xrange(1, nodes + 1):
+            attributes = generator.attributes(node_id) + generator.location()
+            if rng.random() < tagged_nodes:
+                tags = generator.tags(generator.node_tag)
+                counts['tag'] += len(tags)
+                f.write(' <node {}>\n{} </node>\n'.format(attributes,
+                                                          ''.join(tags)))
+            else:
+                f.write(' <node {}/>\n'.format(attributes))
+
+        for way_id in xrange(first_way, first_relation):
+            length = rng.randint(*way_length)
+            closed = length > 2 and rng.random() < closed_ways
+            if closed:
+                length -= 1
+            ref = rng.randint(1, nodes)
+            refs = []
+            for _ in range(length):
+                refs.append(ref)
+                ref = ref + 1 if rng.random() < 0.9 else \
+                    rng.randint(1, nodes)
+                if ref > nodes:
+                    ref = 1
+            if closed:
+                refs.append(refs[0])
+            tags = generator.tags(generator.way_tag)
+            counts['tag'] += len(tags)
+            f.write(' <way {}>\n{}{} </way>\n'.format(
+                generator.attributes(way_id),
+                ''.join('    <nd ref="{}"/>\n'.format(ref) for ref in refs),
+                ''.join(tags)))
+
+        for relation_id in xrange(first_relation, first_relation + relations):
+            members = []
+            for _ in range(rng.randint(1, 10)):
+                if ways and rng.random() < 0.8:
+                    members.append('    <member type="way" ref="{}" '
+                                   'role="outer"/>\n'.format(
+                                       rng.randint(first_way,
+                                                   first_relation - 1)))
+                elif nodes:
+                    members.append('    <member type="node" ref="{}" '
+                                   'role=""/>\n'.format(
+                                       rng.randint(1, nodes)))
+            f.write(' <relation {}>\n{}    <tag k="type" v={}/>\n'
+                    ' </relation>\n'.format(
+                        generator.attributes(relation_id), ''.join(members),
+                        quote(rng.choice(RELATION_TYPES))))
+            counts['tag'] += 1
+
+        f.write('</osm>\n')
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic OSM XML file")
+    parser.add_argument('osm_file', nargs='?', default=SYNTH_FILE)
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--ways', type=int, default=15000)
+    parser.add_argument('--relations', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--tagged-nodes', type=float, default=0.15)
+    parser.add_argument('--street-fraction', type=float, default=0.3)
+    parser.add_argument('--fixme-date-fraction', type=float, default=0.01)
+    parser.add_argument('--min-way-length', type=int, default=2)
+    parser.add_argument('--max-way-length', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    counts = generate(args.osm_file, args.nodes, args.ways, args.relations,
+                      args.seed, args.users, args.tagged_nodes,
+                      street_fraction=args.street_fraction,
+                      fixme_date_fraction=args.fixme_date_fraction,
+                      way_length=(args.min_way_length, args.max_way_length))
+    for tag in ('node', 'way', 'relation', 'tag'):
+        print tag, counts[tag]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that apply_osc.apply_changes brings a database up to date with an
+OsmChange file: the tables, the R*Tree spatial index and ways_geometry end up
+as if the changed extract had been loaded from scratch, whatever the batch
+size. Run with
+
+    python -m unittest test_apply_osc
+"""
+
+import gzip
+import re
+import sqlite3
+import unittest
+
+import apply_osc
+import data
+from test_data import EXTRACT, ProcessMapTest
+
+NODE_1 = '''<node id="1" lat="51.5010" lon="-0.1250" version="4" \
+changeset="200" user="alice" uid="10" timestamp="2018-01-01T00:00:00Z">
+  <tag k="name" v="Elizabeth Tower"/>
+  <tag k="addr:street" v="Bridge Rd"/>
+ </node>'''
+
+NODE_5 = '''<node id="5" lat="51.5020" lon="-0.1200" version="2" \
+changeset="201" user="dave" uid="14" timestamp="2018-01-02T00:00:00Z">
+  <tag k="amenity" v="cafe"/>
+ </node>'''
+
+WAY_10 = '''<way id="10" version="3" changeset="200" user="bob" uid="11" \
+timestamp="2018-01-01T00:00:00Z">
+  <nd ref="1"/>
+  <nd ref="5"/>
+  <tag k="highway" v="secondary"/>
+ </way>'''
+
+CHANGES = '''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="test">
+ <create>
+  <node id="5" lat="51.6000" lon="-0.2000" version="1" changeset="200" \
+user="dave" uid="14" timestamp="2018-01-01T00:00:00Z"/>
+ </create>
+ <modify>
+  {node_1}
+  {way_10}
+ </modify>
+ <delete>
+  <way id="11" version="2" changeset="200" user="bob" uid="11" \
+timestamp="2018-01-01T00:00:00Z"/>
+  <node id="3" version="3" changeset="200" user="bob" uid="11" \
+timestamp="2018-01-01T00:00:00Z"/>
+ </delete>
+ <modify>
+  {node_5}
+  <relation id="20" version="2" changeset="200" user="carol" uid="13" \
+timestamp="2018-01-01T00:00:00Z"/>
+ </modify>
+</osmChange>
+'''.format(node_1=NODE_1, node_5=NODE_5, way_10=WAY_10)
+
+
+def element_xml(tag, element_id):
+    return re.search(r' <{0} id="{1}".*?(/>|</{0}>)'.format(tag, element_id),
+                     EXTRACT, re.DOTALL).group()
+
+
+# The extract with the changes made to it
+CHANGED = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+ {node_1}
+{node_2}
+{node_4}
+ {node_5}
+ {way_10}
+</osm>
+'''.format(node_1=NODE_1, node_2=element_xml('node', 2),
+           node_4=element_xml('node', 4), node_5=NODE_5, way_10=WAY_10)
+
+TABLES = ['nodes', 'nodes_tags', 'ways', 'ways_tags', 'ways_nodes',
+          'ways_geometry', 'nodes_rtree', 'ways_rtree']
+
+
+def tables(dbname):
+    db_conn = sqlite3.connect(dbname)
+    try:
+        return dict((table, sorted(db_conn.execute(
+            'SELECT * FROM {};'.format(table)))) for table in TABLES)
+    finally:
+        db_conn.close()
+
+
+class ApplyChangesTest(ProcessMapTest):
+
+    def setUp(self):
+        super(ApplyChangesTest, self).setUp()
+        data.process_map(self.path, validate=False, dbname='test.db',
+                         write_csv=False, geometry=True)
+        with open('changed.osm', 'wb') as f:
+            f.write(CHANGED)
+        data.process_map('changed.osm', validate=False, dbname='changed.db',
+                         write_csv=False, geometry=True)
+        with open('changes.osc', 'wb') as f:
+            f.write(CHANGES)
+
+    def test_same_as_loading_the_changed_extract(self):
+        counts = apply_osc.apply_changes('changes.osc', 'test.db',
+                                         validate=True)
+        self.assertEqual(counts, {('create', 'node'): 1,
+                                  ('modify', 'node'): 2,
+                                  ('modify', 'way'): 1,
+                                  ('delete', 'way'): 1,
+                                  ('delete', 'node'): 1})
+        expected = tables('changed.db')
+        self.assertEqual(len(expected['nodes']), 4)
+        self.assertEqual(tables('test.db'), expected)
+
+    def test_batch_sizes(self):
+        expected = tables('changed.db')
+        with gzip.open('changes.osc.gz', 'wb') as f:
+            f.write(CHANGES)
+        apply_osc.apply_changes('changes.osc.gz', 'test.db', batch_size=1)
+        self.assertEqual(tables('test.db'), expected)
+        # applying the same diff again changes nothing
+        apply_osc.apply_changes('changes.osc', 'test.db', batch_size=2)
+        self.assertEqual(tables('test.db'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
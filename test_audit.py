@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that audit.update_name replaces the street type at the end of a name,
+keeps returning the right names when the mapping is edited, and that its
+cache stays within its size; and that audit.clean hands each tag to the
+cleaner registered for its key, remembering the most recently used results
+of the deterministic ones. Run with
+
+    python -m unittest test_audit
+"""
+
+import unittest
+from datetime import datetime, timedelta
+
+import audit
+
+
+class UpdateNameTest(unittest.TestCase):
+
+    def test_street_type(self):
+        self.assertEqual(audit.update_name('Baker St', audit.mapping),
+                         'Baker Street')
+        self.assertEqual(audit.update_name('Abbey Rd.', audit.mapping),
+                         'Abbey Road')
+        # only the last word is a street type
+        self.assertEqual(audit.update_name('St Rd', audit.mapping),
+                         'St Road')
+        self.assertEqual(audit.update_name('Stanley Street', audit.mapping),
+                         'Stanley Street')
+        self.assertEqual(audit.update_name(u'Rue Ave', audit.mapping),
+                         u'Rue Avenue')
+        self.assertEqual(audit.update_name('', audit.mapping), '')
+
+    def test_trailing_whitespace(self):
+        self.assertEqual(audit.update_name('Baker St ', audit.mapping),
+                         'Baker Street')
+        self.assertEqual(audit.update_name('Baker St\t\n', audit.mapping),
+                         'Baker Street')
+        self.assertEqual(audit.update_name('Baker Street ', audit.mapping),
+                         'Baker Street ')
+        self.assertEqual(audit.update_name('  ', audit.mapping), '  ')
+
+    def test_edited_mapping(self):
+        mapping = {'Rd': 'Road'}
+        self.assertEqual(audit.update_name('Abbey Rd', mapping), 'Abbey Road')
+        mapping['Rd'] = 'Ride'
+        self.assertEqual(audit.update_name('Abbey Rd', mapping), 'Abbey Ride')
+        del mapping['Rd']
+        self.assertEqual(audit.update_name('Abbey Rd', mapping), 'Abbey Rd')
+        mapping['Ln'] = 'Lane'
+        self.assertEqual(audit.update_name('Love Ln', mapping), 'Love Lane')
+
+    def test_cache_size(self):
+        normalizer = audit.StreetNameNormalizer(audit.mapping, cache_size=2)
+        for name in ['A St', 'B St', 'A St', 'C St']:
+            normalizer.normalize(name)
+        # B St was the least recently used
+        self.assertEqual(list(normalizer.cache), ['A St', 'C St'])
+        self.assertEqual(normalizer.cache_info(), {
+            'hits': 1, 'misses': 3, 'size': 2, 'max_size': 2})
+
+
+class CleanTest(unittest.TestCase):
+
+    def test_cleaners(self):
+        self.assertEqual(audit.clean('addr:street', 'Baker St'),
+                         'Baker Street')
+        self.assertEqual(audit.clean('fixme:date', '2001-02-03'),
+                         '2001-02-03')
+        # keys without a cleaner are left alone
+        self.assertEqual(audit.clean('name', 'Baker St'), 'Baker St')
+        self.assertEqual(audit.clean('street', 'Baker St'), 'Baker St')
+
+    def test_fix(self):
+        today = datetime.today()
+        self.assertEqual(audit.fix('2001-02-03'), '2001-02-03')
+        tomorrow = (today + timedelta(days=1)).strftime('%Y-%m-%d')
+        self.assertEqual(audit.fix(tomorrow), today.strftime('%Y-%m-%d'))
+        self.assertRaises(ValueError, audit.fix, 'soon')
+
+    def test_memoize(self):
+        calls = []
+
+        def double(value):
+            calls.append(value)
+            return value * 2
+        memoized = audit.memoize(double, max_size=2)
+        self.assertEqual([memoized(value) for value in [1, 2, 1, 3, 1, 2]],
+                         [2, 4, 2, 6, 2, 4])
+        # 2 was the least recently used when 3 came in, 1 never was
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+    def test_register(self):
+        calls = []
+
+        @audit.cleaner('test:key', deterministic=True)
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+        try:
+            self.assertEqual(audit.clean('test:key', 'a'), 'A')
+            self.assertEqual(audit.clean('test:key', 'a'), 'A')
+            self.assertEqual(calls, ['a'])
+        finally:
+            del audit.cleaners['test:key']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that a data.process_map run interrupted after a checkpoint and then
+resumed writes the same csv files as an uninterrupted run, and that a
+checkpoint is refused for an input that has changed. Run with
+
+    python -m unittest test_checkpoint
+"""
+
+import os
+import unittest
+
+import checkpoint
+import data
+import synth_osm
+from test_data import ProcessMapTest
+
+SEGMENT_BYTES = 20000
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ResumeTest(ProcessMapTest):
+
+    def setUp(self):
+        super(ResumeTest, self).setUp()
+        synth_osm.generate(self.path, nodes=2000, ways=300, relations=10,
+                           seed=4)
+        data.process_map(self.path, validate=False)
+        self.expected = self.csv_files()
+        for path in data.CSV_PATHS:
+            os.remove(path)
+
+    def interrupted_run(self, segments, resume=False):
+        """Run process_map_resumable until segments segments have been
+        shaped, leaving a half written row of the next one behind"""
+        shape_map = data.shape_map
+        calls = []
+
+        def failing_shape_map(source, outputs, *args, **kwargs):
+            calls.append(source)
+            if len(calls) > segments:
+                for output in outputs:
+                    if isinstance(output, data.CsvOutput):
+                        output.files[0].write('999,half a row')
+                        output.files[0].flush()
+                raise Interrupted()
+            return shape_map(source, outputs, *args, **kwargs)
+        data.shape_map = failing_shape_map
+        try:
+            self.assertRaises(Interrupted, data.process_map_resumable,
+                              self.path, False, resume=resume,
+                              checkpoint_bytes=SEGMENT_BYTES)
+        finally:
+            data.shape_map = shape_map
+
+    def test_resume(self):
+        self.interrupted_run(3)
+        state = checkpoint.load_checkpoint(checkpoint.CHECKPOINT_PATH)
+        self.assertEqual(state['last_element'][0], 'node')
+        for output in state['outputs']:
+            with open(output['path'], 'rb') as f:
+                lines = f.read(output['position']).splitlines()
+            self.assertEqual(len(lines) - 1, output['rows'])
+        data.process_map_resumable(self.path, False, resume=True,
+                                   checkpoint_bytes=SEGMENT_BYTES)
+        self.assertEqual(self.csv_files(), self.expected)
+
+    def test_resume_twice(self):
+        self.interrupted_run(2)
+        self.interrupted_run(1, resume=True)
+        data.process_map_resumable(self.path, False, resume=True,
+                                   checkpoint_bytes=SEGMENT_BYTES)
+        self.assertEqual(self.csv_files(), self.expected)
+
+    def test_changed_input(self):
+        self.interrupted_run(1)
+        with open(self.path, 'ab') as f:
+            f.write('\n')
+        self.assertRaises(ValueError, data.process_map_resumable, self.path,
+                          False, resume=True, checkpoint_bytes=SEGMENT_BYTES)
+
+    def test_row_counter(self):
+        counter = checkpoint.RowCounter()
+        for element in data.get_element(self.path):
+            shaped = data.shape_record(element)
+            if shaped is not None:
+                counter.write(shaped)
+        self.assertEqual(counter.rows, [len(self.expected[path]) - 1
+                                        for path in data.CSV_PATHS])
+        self.assertEqual(counter.last_element[0], 'way')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the column files columnar.py writes while data.py shapes a file
+hold the rows of the csv files, that building them from the csv files gives
+the same files, and that they load and count the same with and without
+NumPy. Run with
+
+    python -m unittest test_columnar
+"""
+
+import calendar
+import os
+import time
+import unittest
+
+import columnar
+import data
+from test_data import ProcessMapTest
+
+TABLES = zip(('nodes', 'nodes_tags', 'ways', 'ways_nodes', 'ways_tags'),
+             data.CSV_PATHS)
+
+
+def decoded_rows(table_dir, table):
+    """Return the rows of a loaded table as the strings of its csv file"""
+    loaded = columnar.load_table(table_dir, table)
+    columns = []
+    for name, kind in dict(columnar.TABLE_COLUMNS)[table]:
+        values = loaded[name]
+        if kind == columnar.STRING:
+            values = [value.encode('utf-8')
+                      for value in loaded.decode(name, values)]
+        elif kind == columnar.TIMESTAMP:
+            if columnar.numpy is not None:
+                # datetime64[s] values, as seconds since 1970
+                values = values.view(columnar.INT64[1])
+            values = [time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(value))
+                      for value in values]
+        else:
+            values = [str(value) for value in values]
+        columns.append(values)
+    return [list(row) for row in zip(*columns)]
+
+
+class ColumnarTest(ProcessMapTest):
+
+    def setUp(self):
+        super(ColumnarTest, self).setUp()
+        data.process_map(self.path, validate=False, columnar_dir='columns')
+        self.numpy = columnar.numpy
+
+    def tearDown(self):
+        columnar.numpy = self.numpy
+        super(ColumnarTest, self).tearDown()
+
+    def test_rows(self):
+        csv_files = self.csv_files()
+        for table, path in TABLES:
+            self.assertEqual(decoded_rows('columns', table),
+                             csv_files[path][1:], table)
+
+    def test_export_csvs(self):
+        columnar.export_csvs(data.CSV_PATHS, 'exported')
+        for table, _ in TABLES:
+            for name in sorted(os.listdir(os.path.join('columns', table))):
+                with open(os.path.join('columns', table, name), 'rb') as f:
+                    expected = f.read()
+                with open(os.path.join('exported', table, name), 'rb') as f:
+                    self.assertEqual(f.read(), expected, (table, name))
+
+    def test_counts(self):
+        for numpy in [self.numpy, None]:
+            columnar.numpy = numpy
+            nodes = columnar.load_table('columns', 'nodes')
+            self.assertEqual(len(nodes), 4)
+            self.assertEqual(list(nodes['id']), [1, 2, 3, 4])
+            self.assertEqual(columnar.value_counts(nodes, 'user'),
+                             [(u'alice', 2), (u'bob', 1), (u'Zo\xeb', 1)])
+            self.assertEqual(columnar.value_counts(nodes, 'user', top=1),
+                             [(u'alice', 2)])
+            self.assertEqual(columnar.count_equal(nodes, 'user', u'alice'),
+                             2)
+            self.assertEqual(columnar.count_equal(nodes, 'user', u'carol'),
+                             0)
+
+    def test_to_epoch(self):
+        self.assertEqual(columnar.to_epoch('2015-05-26T20:42:02Z'),
+                         calendar.timegm((2015, 5, 26, 20, 42, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
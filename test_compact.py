@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the views of the compact database show the same rows as the
+tables of populate_db.sql, that a database can be loaded with either schema
+after the other, and that a statement of a .sql file that fails stops the
+load. Run with
+
+    python -m unittest test_compact
+"""
+
+import sqlite3
+import unittest
+
+import compact
+import data
+import sql_files
+from test_create_and_fill_db import CSV_TABLES, table_rows
+from test_data import ProcessMapTest
+
+COMPACT_TABLES = ['nodes_compact', 'nodes_tags_compact', 'ways_compact',
+                  'ways_tags_compact', 'users', 'tag_keys']
+
+
+def schema_objects(dbname):
+    """Return the type of each table and view of dbname by name"""
+    db_conn = sqlite3.connect(dbname)
+    try:
+        return dict((name, kind) for name, kind in db_conn.execute(
+            "SELECT name, type FROM sqlite_master "
+            "WHERE type IN ('table', 'view');"))
+    finally:
+        db_conn.close()
+
+
+class CompactTest(ProcessMapTest):
+
+    def load(self, dbname, compact_db):
+        data.process_map(self.path, validate=False, dbname=dbname,
+                         write_csv=False, compact_db=compact_db)
+
+    def assertSameRows(self, dbname, expected):
+        for _, table in CSV_TABLES:
+            self.assertEqual(table_rows(dbname, table),
+                             table_rows(expected, table), table)
+
+    def test_views_match_tables(self):
+        self.load('regular.db', False)
+        self.load('compact.db', True)
+        self.assertSameRows('compact.db', 'regular.db')
+        self.assertEqual(len(table_rows('compact.db', 'users')), 3)
+        db_conn = sqlite3.connect('compact.db')
+        try:
+            self.assertEqual(db_conn.execute(
+                'SELECT typeof(version) FROM ways;').fetchall(),
+                [(u'text',), (u'text',)])
+        finally:
+            db_conn.close()
+
+    def test_compact_then_regular(self):
+        self.load('regular.db', False)
+        self.load('test.db', True)
+        self.load('test.db', False)
+        self.assertSameRows('test.db', 'regular.db')
+        objects = schema_objects('test.db')
+        for _, table in CSV_TABLES:
+            self.assertEqual(objects[table], 'table', table)
+        for table in COMPACT_TABLES:
+            self.assertNotIn(table, objects)
+
+    def test_regular_then_compact(self):
+        self.load('compact.db', True)
+        self.load('test.db', False)
+        self.load('test.db', True)
+        self.assertSameRows('test.db', 'compact.db')
+        self.assertEqual(table_rows('test.db', 'users'),
+                         table_rows('compact.db', 'users'))
+        objects = schema_objects('test.db')
+        for table in ('nodes', 'nodes_tags', 'ways', 'ways_tags'):
+            self.assertEqual(objects[table], 'view', table)
+        for table in COMPACT_TABLES:
+            self.assertEqual(objects[table], 'table', table)
+
+    def test_reload_same_schema(self):
+        for compact_db in (False, True):
+            self.load('test.db', compact_db)
+            sql_files.createTablesFromFile(
+                compact.POPULATE_DB_COMPACT_PATH if compact_db
+                else data.POPULATE_DB_PATH, 'test.db')
+            for _, table in CSV_TABLES:
+                self.assertEqual(table_rows('test.db', table), [], table)
+
+    def test_failed_statement_stops_load(self):
+        with open(data.POPULATE_DB_PATH, 'ab') as f:
+            f.write('\nCREATE TABLE nodes (id INTEGER);\n')
+        self.assertRaises(sqlite3.OperationalError, data.process_map,
+                          self.path, validate=False, dbname='test.db',
+                          write_csv=False)
+        with open('broken.sql', 'wb') as f:
+            f.write('DROP VIEW IF EXISTS nodes;\nDROP VIEW nodes;\n')
+        self.assertRaises(sqlite3.OperationalError,
+                          sql_files.createTablesFromFile, 'broken.sql',
+                          'test.db')
+
+
+if __name__ == '__main__':
+    unittest.main()
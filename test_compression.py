@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that compression.py reads back what it writes for every extension,
+including files of several concatenated streams and .bz2 files decompressed
+by worker processes, and that process_map reads a compressed extract and
+writes compressed csv files with the same rows as the plain ones, which
+fillTables loads as they are. Run with
+
+    python -m unittest test_compression
+"""
+
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import compression
+import create_and_fill_db
+import data
+import sql_files
+from test_create_and_fill_db import CSV_TABLES, table_rows
+from test_data import ProcessMapTest, read_csv
+
+EXTENSIONS = [ext for ext in compression.EXTENSIONS
+              if ext != compression.XZ or compression.lzma is not None]
+
+LINES = ['line {} {}\n'.format(number, 'x' * (number % 50))
+         for number in range(20000)]
+
+
+class CompressedFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_round_trip(self):
+        for ext in EXTENSIONS:
+            path = self.path('test.txt' + ext)
+            with compression.open_output(path) as f:
+                for line in LINES:
+                    f.write(line)
+                self.assertEqual(f.tell(), len(''.join(LINES)))
+            with compression.open_input(path) as f:
+                self.assertEqual(list(f), LINES, ext)
+            with compression.open_input(path) as f:
+                self.assertEqual(f.read(len(LINES[0])), LINES[0])
+                f.seek(len(LINES[0]) + len(LINES[1]))
+                self.assertEqual(f.readline(), LINES[2])
+                f.seek(0)
+                self.assertEqual(f.read(), ''.join(LINES))
+
+    def test_appended_streams(self):
+        for ext in EXTENSIONS:
+            path = self.path('test.txt' + ext)
+            for append, lines in ((False, LINES[:100]), (True, LINES[100:])):
+                with compression.open_output(path, append=append) as f:
+                    f.write(''.join(lines))
+            with compression.open_input(path) as f:
+                self.assertEqual(f.read(), ''.join(LINES), ext)
+
+    def test_standard_modules(self):
+        gzip_path = self.path('test.txt.gz')
+        with gzip.open(gzip_path, 'wb') as f:
+            f.write(''.join(LINES))
+        bz2_path = self.path('test.txt.bz2')
+        with open(bz2_path, 'wb') as f:
+            f.write(bz2.compress(''.join(LINES)))
+        for path in (gzip_path, bz2_path):
+            with compression.open_input(path) as f:
+                self.assertEqual(f.read(), ''.join(LINES), path)
+        with compression.open_output(gzip_path) as f:
+            f.write('written here\n')
+        with gzip.open(gzip_path, 'rb') as f:
+            self.assertEqual(f.read(), 'written here\n')
+
+    def test_parallel_bz2(self):
+        path = self.path('test.txt.bz2')
+        text = ''.join(LINES)
+        with open(path, 'wb') as f:
+            for start in range(0, len(text), 40000):
+                f.write(bz2.compress(text[start:start + 40000]))
+        task_bytes = compression.BZ2_TASK_BYTES
+        compression.BZ2_TASK_BYTES = 1000
+        try:
+            with compression.open_input(path, workers=2) as f:
+                self.assertEqual(f.read(), text)
+        finally:
+            compression.BZ2_TASK_BYTES = task_bytes
+
+    def test_names(self):
+        self.assertEqual(compression.extension('a.osm.bz2'), '.bz2')
+        self.assertEqual(compression.extension('a.osm'), '')
+        self.assertTrue(compression.is_compressed('nodes.csv.gz'))
+        self.assertFalse(compression.is_compressed('nodes.csv'))
+        self.assertFalse(compression.is_compressed(None))
+        path = self.path('nodes.csv')
+        self.assertEqual(compression.find_file(path), path)
+        open(path + '.bz2', 'wb').close()
+        self.assertEqual(compression.find_file(path), path + '.bz2')
+        open(path, 'wb').close()
+        self.assertEqual(compression.find_file(path), path)
+
+
+class CompressedPipelineTest(ProcessMapTest):
+
+    def test_compressed_input_and_csv(self):
+        data.process_map(self.path, validate=False)
+        plain = self.csv_files()
+        with open(self.path, 'rb') as f:
+            extract = f.read()
+        with open(self.path + '.bz2', 'wb') as f:
+            f.write(bz2.compress(extract))
+        os.mkdir('compressed')
+        os.chdir('compressed')
+        data.process_map(os.path.join('..', 'test.osm.bz2'), validate=False,
+                         csv_compression='gz')
+        for path in data.CSV_PATHS:
+            self.assertFalse(os.path.exists(path), path)
+            with gzip.open(path + '.gz', 'rb') as f:
+                with open(path, 'wb') as out:
+                    out.write(f.read())
+            self.assertEqual(read_csv(path), plain[path], path)
+
+    def test_fill_compressed_csv(self):
+        data.process_map(self.path, validate=False)
+        sql_files.createTablesFromFile(data.POPULATE_DB_PATH, 'plain.db')
+        for path, table in CSV_TABLES:
+            create_and_fill_db.fillTables(path, 'plain.db', table)
+        data.process_map(self.path, validate=False, csv_compression='bz2')
+        sql_files.createTablesFromFile(data.POPULATE_DB_PATH, 'bz2.db')
+        for path, table in CSV_TABLES:
+            create_and_fill_db.fillTables(path + '.bz2', 'bz2.db', table)
+        for _, table in CSV_TABLES:
+            self.assertEqual(table_rows('bz2.db', table),
+                             table_rows('plain.db', table), table)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that process_map(..., dbname=...) fills the database with the same rows
+as create_and_fill_db.fillTables loading the csv files, in batches of any size,
+that index_db.createIndexes leaves each child row once, and that
+populate_db.sql recreates the tables. Run with
+
+    python -m unittest test_create_and_fill_db
+"""
+
+import sqlite3
+import unittest
+
+import create_and_fill_db
+import data
+import index_db
+import sql_files
+from test_data import ProcessMapTest
+
+CSV_TABLES = zip(data.CSV_PATHS, ['nodes', 'nodes_tags', 'ways', 'ways_nodes',
+                                  'ways_tags'])
+
+
+def table_rows(dbname, table):
+    db_conn = sqlite3.connect(dbname)
+    try:
+        return sorted(db_conn.execute('SELECT * FROM {}'.format(table)))
+    finally:
+        db_conn.close()
+
+
+class LoadTest(ProcessMapTest):
+
+    def fill_from_csv(self, dbname, batch_size=create_and_fill_db.BATCH_SIZE):
+        sql_files.createTablesFromFile(data.POPULATE_DB_PATH, dbname)
+        for path, table in CSV_TABLES:
+            create_and_fill_db.fillTables(path, dbname, table,
+                                          batch_size=batch_size)
+
+    def test_direct_load_matches_csv_load(self):
+        data.process_map(self.path, validate=False, dbname='direct.db',
+                         build_indexes=False)
+        self.fill_from_csv('csv.db')
+        for _, table in CSV_TABLES:
+            self.assertEqual(table_rows('direct.db', table),
+                             table_rows('csv.db', table), table)
+
+    def test_children_inserted_once(self):
+        data.process_map(self.path, validate=False, dbname='test.db',
+                         write_csv=False, build_indexes=False)
+        self.assertEqual(len(table_rows('test.db', 'nodes')), 4)
+        self.assertEqual(len(table_rows('test.db', 'nodes_tags')), 6)
+        self.assertEqual(len(table_rows('test.db', 'ways_tags')), 4)
+        self.assertEqual(table_rows('test.db', 'ways_nodes'), [
+            (10, 1, 0), (10, 2, 1), (10, 4, 2),
+            (11, 2, 0), (11, 2, 2), (11, 3, 1)])
+        self.assertEqual(table_rows('test.db', 'nodes')[2][3], u'Zoë')
+
+    def test_batch_sizes(self):
+        data.process_map(self.path, validate=False)
+        self.fill_from_csv('one.db', batch_size=1)
+        self.fill_from_csv('many.db')
+        for _, table in CSV_TABLES:
+            self.assertEqual(table_rows('one.db', table),
+                             table_rows('many.db', table), table)
+
+    def test_repeated_rows_removed(self):
+        data.process_map(self.path, validate=False)
+        self.fill_from_csv('test.db')
+        for path, table in CSV_TABLES:
+            create_and_fill_db.fillTables(path, 'test.db', table)
+        # the primary keys drop repeated nodes and ways while loading, the
+        # child rows are only dropped once the indexes are built
+        self.assertEqual(len(table_rows('test.db', 'nodes')), 4)
+        self.assertEqual(len(table_rows('test.db', 'nodes_tags')), 12)
+        db_conn = sqlite3.connect('test.db')
+        db_conn.execute("INSERT INTO nodes_tags VALUES "
+                        "(1, 'name', 'Elizabeth Tower', 'regular');")
+        db_conn.commit()
+        db_conn.close()
+        index_db.createIndexes('test.db')
+        # the first row with a key is kept
+        self.assertIn((1, u'name', u'Big Ben', u'regular'),
+                      table_rows('test.db', 'nodes_tags'))
+        for _, table in CSV_TABLES:
+            self.assertEqual(table_rows('test.db', table),
+                             sorted(set(table_rows('test.db', table))), table)
+        self.assertEqual(len(table_rows('test.db', 'nodes_tags')), 6)
+        self.assertEqual(len(table_rows('test.db', 'ways_nodes')), 6)
+        db_conn = sqlite3.connect('test.db')
+        try:
+            self.assertRaises(
+                sqlite3.IntegrityError, db_conn.execute,
+                'INSERT INTO ways_nodes VALUES (10, 3, 0);')
+        finally:
+            db_conn.close()
+
+    def test_tables_recreated(self):
+        data.process_map(self.path, validate=False, dbname='test.db',
+                         write_csv=False, build_indexes=False)
+        sql_files.createTablesFromFile(data.POPULATE_DB_PATH, 'test.db')
+        for _, table in CSV_TABLES:
+            self.assertEqual(table_rows('test.db', table), [], table)
+
+
+if __name__ == '__main__':
+    unittest.main()
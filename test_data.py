@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks the csv files data.py writes: the rows of a small extract, that
+UnicodeWriter writes the same lines as csv.writer in batches of any size, and
+that the sharded multi-process mode writes the same files as a single process.
+EXTRACT and the ProcessMapTest set up are shared by the tests of the other
+stages of the pipeline. Run with
+
+    python -m unittest test_data
+"""
+
+import csv
+import glob
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import data
+import osm_parsers
+import osm_shards
+import synth_osm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+EXTRACT = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+ <bounds minlat="51.49" minlon="-0.15" maxlat="51.51" maxlon="-0.11"/>
+ <node id="1" lat="51.5007" lon="-0.1246" version="3" changeset="100" \
+user="alice" uid="10" timestamp="2015-05-26T20:42:02Z">
+  <tag k="name" v="Big Ben"/>
+  <tag k="addr:street" v="Bridge St"/>
+  <tag k="addr:postcode" v="SW1A 0AA"/>
+ </node>
+ <node id="2" lat="51.5014" lon="-0.1419" version="1" changeset="101" \
+user="bob" uid="11" timestamp="2016-01-02T03:04:05Z"/>
+ <node id="3" lat="51.5033" lon="-0.1196" version="2" changeset="102" \
+user="Zoë" uid="12" timestamp="2016-02-03T04:05:06Z">
+  <tag k="tourism" v="attraction"/>
+  <tag k="name" v="London Eye – Millennium Wheel"/>
+  <tag k="fixme:date" v="2001-02-03"/>
+ </node>
+ <node id="4" lat="51.4995" lon="-0.1248" version="1" changeset="100" \
+user="alice" uid="10" timestamp="2015-05-26T20:43:00Z"/>
+ <way id="10" version="2" changeset="103" user="bob" uid="11" \
+timestamp="2014-07-08T09:10:11Z">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <nd ref="4"/>
+  <tag k="highway" v="primary"/>
+  <tag k="name" v="Whitehall Rd"/>
+  <tag k="addr:street:name" v="Whitehall"/>
+ </way>
+ <way id="11" version="1" changeset="104" user="Zoë" uid="12" \
+timestamp="2016-02-03T04:06:00Z">
+  <nd ref="2"/>
+  <nd ref="3"/>
+  <nd ref="2"/>
+  <tag k="building" v="yes"/>
+ </way>
+ <relation id="20" version="1" changeset="105" user="carol" uid="13" \
+timestamp="2017-03-04T05:06:07Z">
+  <member type="way" ref="10" role="outer"/>
+  <tag k="type" v="multipolygon"/>
+ </relation>
+</osm>
+'''
+
+
+def read_csv(path):
+    with open(path, 'rb') as f:
+        return list(csv.reader(f))
+
+
+class ProcessMapTest(unittest.TestCase):
+    """Runs each test in a scratch directory holding EXTRACT as test.osm,
+    since process_map writes its csv files to the working directory, and
+    copies of the .sql files it reads from there"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        for path in glob.glob(os.path.join(HERE, '*.sql')):
+            shutil.copy(path, self.directory)
+        os.chdir(self.directory)
+        self.path = os.path.join(self.directory, 'test.osm')
+        with open(self.path, 'wb') as f:
+            f.write(EXTRACT)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def csv_files(self, directory=None):
+        return dict((path, read_csv(os.path.join(directory or '.', path)))
+                    for path in data.CSV_PATHS)
+
+
+class CsvTest(ProcessMapTest):
+
+    def test_rows(self):
+        data.process_map(self.path, validate=True)
+        tables = self.csv_files()
+        self.assertEqual(tables[data.NODES_PATH][0], data.NODE_FIELDS)
+        self.assertEqual([row[0] for row in tables[data.NODES_PATH][1:]],
+                         ['1', '2', '3', '4'])
+        self.assertEqual(tables[data.NODES_PATH][3][3], 'Zoë')
+        self.assertIn(['1', 'street', 'Bridge Street', 'addr'],
+                      tables[data.NODE_TAGS_PATH])
+        self.assertIn(['3', 'name', 'London Eye – Millennium Wheel',
+                       'regular'], tables[data.NODE_TAGS_PATH])
+        self.assertIn(['10', 'street:name', 'Whitehall', 'addr'],
+                      tables[data.WAY_TAGS_PATH])
+        self.assertEqual(tables[data.WAY_NODES_PATH][1:], [
+            ['10', '1', '0'], ['10', '2', '1'], ['10', '4', '2'],
+            ['11', '2', '0'], ['11', '3', '1'], ['11', '2', '2']])
+        # relations are not written
+        self.assertEqual(len(tables[data.WAYS_PATH]), 3)
+
+
+ROWS = [
+    ('1', 'name', u'Big Ben', 'regular'),
+    ('3', 'name', u'London Eye \u2013 Millennium Wheel', 'regular'),
+    (4, 51.4995, None, 'Zo\xc3\xab'),
+    ('5', 'note', u'"quoted", with a comma', 'regular'),
+    ('6', 'note', u'two\nlines', u'Zo\xeb'),
+    ('7', u'caf\xe9', u'caf\xe9', u'caf\xe9'),
+    ('8', 'amenity', u'cafe', 'regular'),
+]
+
+
+class UnicodeWriterTest(unittest.TestCase):
+
+    def expected(self, rows):
+        f = StringIO.StringIO()
+        csv.writer(f).writerows(data.encode_row(row) for row in rows)
+        return f.getvalue()
+
+    def test_batches(self):
+        rows = ROWS * 3
+        expected = self.expected([data.NODE_TAGS_FIELDS] + rows)
+        for batch_size in (1, 2, 5, len(rows), data.WRITE_BATCH_SIZE):
+            f = StringIO.StringIO()
+            writer = data.UnicodeWriter(f, data.NODE_TAGS_FIELDS,
+                                        batch_size=batch_size)
+            writer.writeheader()
+            for row in rows[:4]:
+                writer.writerow(row)
+            writer.writerows(rows[4:])
+            writer.flush()
+            self.assertEqual(f.getvalue(), expected, batch_size)
+            writer.flush()
+            self.assertEqual(f.getvalue(), expected, batch_size)
+
+    def test_written_when_batch_full(self):
+        f = StringIO.StringIO()
+        writer = data.UnicodeWriter(f, data.NODE_TAGS_FIELDS, batch_size=3)
+        writer.writerows(ROWS[:2])
+        self.assertEqual(f.getvalue(), '')
+        writer.writerow(ROWS[2])
+        self.assertEqual(f.getvalue(), self.expected(ROWS[:3]))
+        writer.writerow(ROWS[3])
+        writer.flush()
+        self.assertEqual(f.getvalue(), self.expected(ROWS[:4]))
+
+    def test_unicode_rows(self):
+        # rows csv cannot write as they are, one after the other and at
+        # either end of a batch
+        rows = [row for row in ROWS if any(isinstance(value, unicode) and
+                                           ord(max(value)) > 127
+                                           for value in row)]
+        self.assertEqual(len(rows), 3)
+        for batch in (rows, rows[::-1], rows + ROWS[:1], ROWS[:1] + rows):
+            f = StringIO.StringIO()
+            writer = data.UnicodeWriter(f, data.NODE_TAGS_FIELDS)
+            writer.writerows(batch)
+            writer.flush()
+            self.assertEqual(f.getvalue(), self.expected(batch))
+            self.assertEqual(list(csv.reader(StringIO.StringIO(
+                f.getvalue()))), [data.encode_row(row) for row in batch])
+
+
+class ParallelTest(ProcessMapTest):
+
+    def test_same_csv_files(self):
+        synth_osm.generate(self.path, nodes=3000, ways=400, relations=20,
+                           seed=1)
+        data.process_map(self.path, validate=False)
+        single = self.csv_files()
+        data.process_map(self.path, validate=False, workers=2)
+        self.assertEqual(self.csv_files(), single)
+        self.assertEqual(len(single[data.NODES_PATH]), 3001)
+
+    def test_shards_cover_the_file(self):
+        synth_osm.generate(self.path, nodes=300, ways=40, relations=5,
+                           seed=2)
+        whole = [element.get('id') for element
+                 in osm_parsers.get_element(self.path, backend='etree')]
+        prolog, ranges = osm_shards.find_shard_offsets(self.path, 7)
+        self.assertEqual(len(ranges), 7)
+        self.assertEqual([end for _, end in ranges[:-1]],
+                         [start for start, _ in ranges[1:]])
+        ids = []
+        for start, end in ranges:
+            with osm_shards.ShardFile(self.path, start, end, prolog) as shard:
+                ids.extend(element.get('id') for element
+                           in osm_parsers.get_element(shard,
+                                                      backend='etree'))
+        self.assertEqual(ids, whole)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that explore.run_queries returns the same rows as running the queries
+of explore.sql one by one, that a rerun against an unchanged database comes
+from the cache while any write to it misses, and that the cache stays within
+its size. Run with
+
+    python -m unittest test_explore
+"""
+
+import os
+import sqlite3
+import unittest
+
+import data
+import explore
+import sql_files
+from test_data import HERE, ProcessMapTest
+
+EXPLORE_SQL = os.path.join(HERE, 'explore.sql')
+
+
+class RunQueriesTest(ProcessMapTest):
+
+    def setUp(self):
+        super(RunQueriesTest, self).setUp()
+        data.process_map(self.path, validate=False, dbname='test.db',
+                         write_csv=False)
+        self.statements = sql_files.read_statements(EXPLORE_SQL)
+
+    def run_queries(self, statements=None, **kwargs):
+        return explore.run_queries(statements or self.statements, 'test.db',
+                                   workers=4, cache_path='cache.db', **kwargs)
+
+    def test_same_rows_as_one_by_one(self):
+        db_conn = sqlite3.connect('test.db')
+        expected = [db_conn.execute(statement).fetchall()
+                    for statement in self.statements]
+        db_conn.close()
+        results = self.run_queries()
+        self.assertEqual([result.statement for result in results],
+                         self.statements)
+        self.assertEqual([result.rows for result in results], expected)
+        self.assertEqual(results[0].rows, [(4,)])
+        self.assertFalse(any(result.cached for result in results))
+
+    def test_cache(self):
+        first = self.run_queries()
+        second = self.run_queries()
+        self.assertTrue(all(result.cached for result in second))
+        self.assertEqual([result.rows for result in second],
+                         [result.rows for result in first])
+        # the same query written differently is found as well
+        respaced = self.run_queries(['SELECT   count(*)\n\nFROM nodes ;'])
+        self.assertTrue(respaced[0].cached)
+
+        db_conn = sqlite3.connect('test.db')
+        db_conn.execute('DELETE FROM nodes WHERE id = 4;')
+        db_conn.commit()
+        db_conn.close()
+        third = self.run_queries()
+        self.assertFalse(any(result.cached for result in third))
+        self.assertEqual(third[0].rows, [(3,)])
+
+    def test_not_cached(self):
+        statements = ['SELECT random();', 'SELECT * FROM no_such_table;',
+                      "DELETE FROM nodes;"]
+        self.run_queries(statements)
+        results = self.run_queries(statements)
+        self.assertFalse(any(result.cached for result in results))
+        self.assertEqual([result.error is None for result in results],
+                         [True, False, False])
+        # the connections are read-only
+        self.assertEqual(self.run_queries(['SELECT count(*) FROM nodes;'])[0]
+                         .rows, [(4,)])
+
+    def test_eviction(self):
+        cache = explore.ResultCache('cache.db', max_bytes=200)
+        for i in range(3):
+            cache.put(str(i), [('x' * 50,)], 0.0)
+        cache.get('0')
+        cache.put('3', [('x' * 50,)], 0.0)
+        self.assertIsNotNone(cache.get('0'))
+        self.assertIsNone(cache.get('1'))
+        self.assertIsNotNone(cache.get('3'))
+        cache.close()
+
+    def test_normalize_sql(self):
+        self.assertEqual(explore.normalize_sql(
+            "SELECT  *\nFROM nodes_tags WHERE value = 'a  b' ;"),
+            "SELECT * FROM nodes_tags WHERE value = 'a  b'")
+
+
+if __name__ == '__main__':
+    unittest.main()
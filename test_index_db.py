@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that sql_files.py splits sql files into whole statements, and that
+index_db.adviseIndexes suggests indexes for the statements scanning a table in
+full, leaving the database untouched unless asked to create them. Run with
+
+    python -m unittest test_index_db
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+from StringIO import StringIO
+
+import data
+import index_db
+import sql_files
+from test_data import HERE, ProcessMapTest
+
+WORKLOAD = '''-- a made up workload
+SELECT value, count(*) FROM nodes_tags
+WHERE value = 'cafe;bar'
+GROUP BY value;
+
+SELECT * FROM nodes WHERE id = 1;
+
+SELECT n.id, t.value FROM nodes n JOIN ways_nodes w ON w.node_id = n.id
+JOIN ways_tags t ON t.id = w.id WHERE t.key = 'name';
+'''
+
+
+def schema(dbname):
+    db_conn = sqlite3.connect(dbname)
+    try:
+        return sorted(db_conn.execute('SELECT type, name FROM sqlite_master;'))
+    finally:
+        db_conn.close()
+
+
+class SqlFilesTest(unittest.TestCase):
+
+    def test_split_statements(self):
+        self.assertEqual(sql_files.split_statements(
+            "SELECT 'a;b';\n"
+            "CREATE TRIGGER t AFTER INSERT ON x BEGIN\n"
+            "    DELETE FROM y; DELETE FROM z;\n"
+            "END;\n"
+            "-- only a comment\n;\n"), [
+                "SELECT 'a;b';",
+                "\nCREATE TRIGGER t AFTER INSERT ON x BEGIN\n"
+                "    DELETE FROM y; DELETE FROM z;\nEND;"])
+
+    def test_read_statements(self):
+        statements = sql_files.read_statements(os.path.join(HERE,
+                                                            'explore.sql'))
+        self.assertEqual(statements[:2], ['SELECT count(*)\nFROM nodes',
+                                          'SELECT count(*) \nFROM nodes_tags'])
+        self.assertEqual(statements[-1], "SELECT key, value\nFROM ways_tags\n"
+                                         "WHERE key = 'FIXME'")
+
+
+class AdviseIndexesTest(ProcessMapTest):
+
+    def setUp(self):
+        super(AdviseIndexesTest, self).setUp()
+        data.process_map(self.path, validate=False, dbname='test.db',
+                         write_csv=False, build_indexes=False)
+        with open('workload.sql', 'w') as f:
+            f.write(WORKLOAD)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        super(AdviseIndexesTest, self).tearDown()
+
+    def test_report_leaves_database_unchanged(self):
+        before = schema('test.db')
+        suggestions = index_db.adviseIndexes('workload.sql', 'test.db')
+        self.assertIn(('nodes_tags', ['value']), suggestions)
+        self.assertNotIn(('nodes', ['id']), suggestions)
+        self.assertEqual(schema('test.db'), before)
+
+    def test_create(self):
+        suggestions = index_db.adviseIndexes('workload.sql', 'test.db',
+                                             create=True)
+        created = set(name for kind, name in schema('test.db')
+                      if kind == 'index')
+        for table, columns in suggestions:
+            self.assertIn(index_db.index_name(table, columns), created)
+        db_conn = sqlite3.connect('test.db')
+        try:
+            statement = sql_files.read_statements('workload.sql')[0]
+            self.assertEqual(index_db.full_scans(db_conn.cursor(), statement),
+                             [])
+        finally:
+            db_conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that key_types.py counts the tags of each category as classifying
+every tag would, whatever the size of its cache of categories, and that it
+keeps the most common keys of each category in bounded space. Run with
+
+    python -m unittest test_key_types
+"""
+
+import collections
+import unittest
+import xml.etree.cElementTree as ET
+
+import key_types
+import synth_osm
+from test_data import ProcessMapTest
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_categories(self):
+        self.assertEqual(key_types.classify('highway'), 'lower')
+        self.assertEqual(key_types.classify('addr_street'), 'lower')
+        self.assertEqual(key_types.classify('addr:street'), 'lower_colon')
+        self.assertEqual(key_types.classify('note 2'), 'problemchars')
+        self.assertEqual(key_types.classify('a.b'), 'problemchars')
+        self.assertEqual(key_types.classify('FIXME'), 'other')
+        self.assertEqual(key_types.classify('addr:street:name'), 'other')
+
+    def test_cache(self):
+        keys = key_types.KeyTypes(cache_size=2)
+        for k_value in ['name', 'name', 'FIXME', 'name', 'source', 'name']:
+            keys.add(k_value)
+        # the cache is cleared when it fills up
+        self.assertEqual(keys.cache_info(), {'hits': 2, 'misses': 4,
+                                             'size': 2, 'max_size': 2})
+        self.assertEqual(keys.counts, {'lower': 5, 'lower_colon': 0,
+                                       'problemchars': 0, 'other': 1})
+
+
+class ExamplesTest(unittest.TestCase):
+
+    def test_exact_below_slots(self):
+        keys = key_types.KeyTypes(top=2)
+        added = ['name'] * 5 + ['shop'] * 3 + ['amenity'] * 3 + ['source']
+        for k_value in added:
+            keys.add(k_value)
+        self.assertEqual(keys.examples('lower'), [('name', 5),
+                                                  ('amenity', 3)])
+        self.assertEqual(keys.key_counts['lower'],
+                         dict(collections.Counter(added)))
+
+    def test_bounded(self):
+        keys = key_types.KeyTypes(top=1)
+        for number in range(1000):
+            keys.add('key_' + 'x' * (number % 50) + chr(97 + number % 26))
+            if number % 2 == 0:
+                keys.add('name')
+        self.assertEqual(len(keys.key_counts['lower']),
+                         key_types.EXAMPLE_SLOTS)
+        # a key making more than 1 / slots of the tags keeps its slot, its
+        # count overestimated by at most the least count
+        (k_value, count), = keys.examples('lower')
+        self.assertEqual(k_value, 'name')
+        self.assertTrue(500 <= count <= 500 + 1500 / 10, count)
+        self.assertEqual(keys.counts['lower'], 1500)
+
+
+class KeyTypesMapTest(ProcessMapTest):
+
+    def test_extract(self):
+        result = key_types.process_map(self.path)
+        self.assertEqual(result['lower'], {'count': 7, 'examples': [
+            ('name', 3), ('building', 1), ('highway', 1), ('tourism', 1),
+            ('type', 1)]})
+        self.assertEqual(result['lower_colon']['count'], 3)
+        self.assertEqual(result['problemchars'],
+                         {'count': 0, 'examples': []})
+        self.assertEqual(result['other'], {
+            'count': 1, 'examples': [('addr:street:name', 1)]})
+
+    def test_counts_match_classify(self):
+        synth_osm.generate(self.path, nodes=2000, ways=300, relations=20,
+                           seed=4)
+        expected = collections.Counter(
+            key_types.classify(elem.get('k')) for _, elem
+            in ET.iterparse(self.path) if elem.tag == 'tag')
+        for cache_size in (1, key_types.CACHE_SIZE):
+            keys = key_types.KeyTypeCollector(cache_size=cache_size)
+            for _, elem in ET.iterparse(self.path):
+                if elem.tag in ('node', 'way', 'relation'):
+                    keys.element(elem)
+            result = keys.result()
+            for category in key_types.CATEGORIES:
+                self.assertEqual(result[category]['count'],
+                                 expected[category], category)
+        self.assertTrue(expected['problemchars'])
+        self.assertTrue(expected['other'])
+
+
+if __name__ == '__main__':
+    unittest.main()
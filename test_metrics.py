@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that a metrics.Metrics handed to process_map and fillTables counts
+the elements, rows and bytes of the run, times each stage, writes its JSON
+file and progress lines, and leaves the csv files as they are without it.
+Run with
+
+    python -m unittest test_metrics
+"""
+
+import json
+import StringIO
+import unittest
+
+import create_and_fill_db
+import data
+import metrics
+import sql_files
+from test_data import ProcessMapTest
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_stages(self):
+        run = metrics.Metrics(path=None, stream=None)
+        run.add('parse', 1.5)
+        run.add('parse', 0.5, calls=3)
+        with run.stage('shape'):
+            pass
+        timed = run.timed('clean', lambda value: value.upper())
+        self.assertEqual(timed('street'), 'STREET')
+        self.assertEqual(run.seconds['parse'], 2.0)
+        self.assertEqual(run.calls['parse'], 4)
+        self.assertEqual(run.calls['shape'], 1)
+        self.assertEqual(run.calls['clean'], 1)
+
+    def test_rows_and_eta(self):
+        run = metrics.Metrics(path=None, stream=None)
+        run.add_rows('nodes', 3)
+        run.counter.rows[0] += 2
+        run.add_rows('users', 1)
+        self.assertEqual(run.rows()['nodes'], 5)
+        self.assertEqual(run.rows()['users'], 1)
+        run.total_bytes = 1000
+        run.set_bytes_read(250)
+        snapshot = run.snapshot()
+        self.assertEqual(snapshot['fraction_done'], 0.25)
+        self.assertEqual(run.close()['eta_seconds'], 0.0)
+
+    def test_progress_line(self):
+        stream = StringIO.StringIO()
+        run = metrics.Metrics(path=None, stream=stream)
+        run.tick(1234)
+        run.add('parse', 3.0)
+        run.add('shape', 1.0)
+        run.total_bytes = 2 * 1048576
+        # the rate is measured from the first bytes counted
+        run.set_bytes_read(0)
+        run.set_bytes_read(1048576)
+        run.report()
+        line = stream.getvalue()
+        self.assertTrue(line.endswith('\n'))
+        self.assertIn('1,234 elements', line)
+        self.assertIn('1.0 of 2.0 MB (50%)', line)
+        self.assertIn('parse 75% shape 25%', line)
+        self.assertIn('ETA', line)
+
+    def test_format_duration(self):
+        self.assertEqual(metrics.format_duration(0), '0:00:00')
+        self.assertEqual(metrics.format_duration(3725.9), '1:02:05')
+
+
+class PipelineMetricsTest(ProcessMapTest):
+
+    def test_process_map(self):
+        data.process_map(self.path, validate=False)
+        plain = self.csv_files()
+        run = metrics.Metrics(path='metrics.json', stream=None)
+        data.process_map(self.path, validate=True, metrics=run)
+        self.assertEqual(self.csv_files(), plain)
+        with open('metrics.json', 'rb') as f:
+            written = json.load(f)
+        self.assertTrue(written['finished'])
+        self.assertEqual(written['elements'], 6)
+        self.assertEqual(written['rows'], {'nodes': 4, 'nodes_tags': 6,
+                                           'ways': 2, 'ways_nodes': 6,
+                                           'ways_tags': 4})
+        self.assertEqual(written['bytes_read'], written['total_bytes'])
+        self.assertEqual(written['fraction_done'], 1.0)
+        for stage in ('parse', 'clean', 'shape', 'validate'):
+            self.assertIn(stage, written['stages'])
+        self.assertEqual(written['stages']['shape']['calls'], 6)
+        self.assertTrue(written['peak_rss_bytes'] > 0)
+
+    def test_fill_tables(self):
+        data.process_map(self.path, validate=False)
+        sql_files.createTablesFromFile(data.POPULATE_DB_PATH, 'test.db')
+        run = metrics.Metrics(path=None, stream=None)
+        create_and_fill_db.fillTables(data.NODES_PATH, 'test.db', 'nodes',
+                                      batch_size=3, metrics=run)
+        self.assertEqual(run.rows(), {'nodes': 4, 'nodes_tags': 0,
+                                      'ways': 0, 'ways_nodes': 0,
+                                      'ways_tags': 0})
+        self.assertEqual(run.calls['db insert'], 2)
+        self.assertTrue(run.bytes_read() > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
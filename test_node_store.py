@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that node_store.NodeStore gives back the exact coordinates of every
+node, in sparse and dense mode, that dense mode refuses ids outside its range
+before growing the mapping, and that way_geometry works out the bounding box,
+centroid and length of a way. Run with
+
+    python -m unittest test_node_store
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import node_store
+
+
+class NodeStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'nodes.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, store, ids):
+        for node_id in ids:
+            store.set(node_id, '51.5007292', '-0.1246254')
+        for node_id in ids:
+            self.assertEqual(store.get_fixed(node_id),
+                             (515007292, -1246254))
+            self.assertEqual(store.get(node_id), (51.5007292, -0.1246254))
+        self.assertIsNone(store.get(3))
+        self.assertIsNone(store.get(10 ** 9))
+
+    def test_sparse(self):
+        with node_store.NodeStore(self.path) as store:
+            self.check_store(store, [1, 2, 70000, 5 * 10 ** 9, -1, -70000])
+            store.set(-90, -90, 180)
+            self.assertEqual(store.get(-90), (-90.0, 180.0))
+            # five pages of ids are used, the file does not grow with the
+            # ids themselves
+            self.assertLessEqual(os.path.getsize(self.path),
+                                 8 * node_store.PAGE_BYTES)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_dense(self):
+        with node_store.NodeStore(self.path, sparse=False) as store:
+            self.check_store(store, [0, 1, 2, 100000])
+            self.assertIsNone(store.get(-1))
+
+    def test_dense_id_range(self):
+        with node_store.NodeStore(self.path, sparse=False,
+                                  max_id=1000) as store:
+            store.set(1000, 1, 1)
+            self.assertRaises(ValueError, store.set, 1001, 1, 1)
+            self.assertRaises(ValueError, store.set, -1, 1, 1)
+            self.assertIsNone(store.get(10 ** 12))
+            self.assertEqual(os.path.getsize(self.path),
+                             node_store.PAGE_BYTES)
+        with node_store.NodeStore(self.path, sparse=False) as store:
+            self.assertRaises(ValueError, store.set,
+                              node_store.DENSE_MAX_ID + 1, 1, 1)
+
+    def test_temporary_file(self):
+        store = node_store.NodeStore()
+        path = store.path
+        store.set(1, 1, 1)
+        store.close()
+        self.assertFalse(os.path.exists(path))
+
+
+class WayGeometryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = node_store.NodeStore()
+        for node_id, lat, lon in [(1, '51.0', '0.0'), (2, '52.0', '0.0'),
+                                  (3, '52.0', '1.0'), (4, '51.0', '1.0')]:
+            self.store.set(node_id, lat, lon)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_open_way(self):
+        geometry = node_store.way_geometry(self.store, 10, [1, 2, 99])
+        self.assertEqual(geometry[:7], (10, 51.0, 0.0, 52.0, 0.0, 51.5, 0.0))
+        # one degree of latitude
+        self.assertAlmostEqual(geometry.length, 111195.08, places=1)
+        self.assertEqual(geometry.missing_nodes, 1)
+
+    def test_closed_way(self):
+        geometry = node_store.way_geometry(self.store, 11, [1, 2, 3, 4, 1])
+        self.assertEqual((geometry.centroid_lat, geometry.centroid_lon),
+                         (51.5, 0.5))
+        self.assertEqual(geometry.missing_nodes, 0)
+
+    def test_no_nodes(self):
+        self.assertEqual(node_store.way_geometry(self.store, 12, [98, 99]),
+                         (12, None, None, None, None, None, None, 0.0, 2))
+
+    def test_iter_way_geometry(self):
+        rows = [(10, 1), (10, 2), (11, 3), (11, 4)]
+        self.assertEqual([geometry.id for geometry
+                          in node_store.iter_way_geometry(self.store, rows)],
+                         [10, 11])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that every parsing backend of osm_parsers.py reads the same elements
+as cElementTree, including attribute values holding a raw ">", references
+such as &gt; and quotes of either kind. Run with
+
+    python -m unittest test_osm_parsers
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import osm_parsers
+
+OSM = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <bounds minlat="51.2" minlon="-0.5" maxlat="51.7" maxlon="0.3"/>
+ <node id="1" lat="51.5" lon="-0.1" user="a>b" uid="1" version="1"/>
+ <node id="2" lat="51.6" lon="-0.2" user='c "d" &gt; e' uid="2" version="1">
+  <tag k="note" v="x > y and it's &amp; &gt; &apos;"/>
+  <tag k='name' v='O&apos;Neil > "x"'/>
+ </node>
+ <way id="3" user="f/>g" uid="3" version="1">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <tag k="highway" v="a>b/>"/>
+ </way>
+ <relation id="4" user="h" uid="4" version="1">
+  <member type="node" ref="1" role="a>b"/>
+ </relation>
+ <relation id="5" user="i" uid="5" version="1">
+  <member type="way" ref="3" role=""/>
+ </relation>
+ <node id="6" lat="51.7" lon="-0.3" user="j" uid="6" version="1"/>
+</osm>
+'''
+
+
+def dump(element):
+    return (element.tag, sorted(element.attrib.items()),
+            [(child.tag, sorted(child.attrib.items())) for child in element])
+
+
+class BackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.osm')
+        with open(self.path, 'wb') as f:
+            f.write(OSM)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def elements(self, backend, tags=('node', 'way', 'relation')):
+        return [dump(element) for element
+                in osm_parsers.get_element(self.path, tags, backend)]
+
+    def test_values(self):
+        elements = self.elements('etree')
+        self.assertEqual([attrib[0] for _, attrib, _ in elements],
+                         [('id', '1'), ('id', '2'), ('id', '3'), ('id', '4'),
+                          ('id', '5'), ('id', '6')])
+        self.assertIn(('user', 'a>b'), elements[0][1])
+        self.assertIn(('user', 'c "d" > e'), elements[1][1])
+        self.assertEqual(elements[1][2], [
+            ('tag', [('k', 'note'), ('v', "x > y and it's & > '")]),
+            ('tag', [('k', 'name'), ('v', 'O\'Neil > "x"')])])
+        self.assertEqual(elements[2][2][2],
+                         ('tag', [('k', 'highway'), ('v', 'a>b/>')]))
+
+    def test_backends_agree(self):
+        for tags in [('node', 'way', 'relation'), ('node', 'way'),
+                     ('relation',)]:
+            expected = self.elements('etree', tags)
+            for backend in osm_parsers.BACKENDS:
+                self.assertEqual(self.elements(backend, tags), expected,
+                                 (backend, tags))
+
+    def test_element_spans(self):
+        with open(self.path, 'rb') as f:
+            spans = [text[match.start():end] for match, text, end, _
+                     in osm_parsers.element_spans(f)]
+        self.assertEqual(len(spans), 6)
+        self.assertTrue(spans[0].endswith('version="1"/>'))
+        self.assertTrue(spans[1].startswith('<node id="2"'))
+        self.assertTrue(spans[1].endswith('</node>'))
+
+    def test_default_backend(self):
+        if osm_parsers.lxml_etree is None:
+            self.assertEqual(osm_parsers.DEFAULT_BACKEND, 'etree')
+        else:
+            self.assertEqual(osm_parsers.DEFAULT_BACKEND, 'lxml')
+        self.assertEqual(self.elements(None), self.elements('etree'))
+
+    def test_parse_attributes(self):
+        with open(self.path, 'rb') as f:
+            attributes = [osm_parsers.parse_attributes(match.group(2))
+                          for match, _, _, _ in osm_parsers.element_spans(f)]
+        self.assertEqual(attributes[1], {'id': '2', 'lat': '51.6',
+                                         'lon': '-0.2', 'uid': '2',
+                                         'user': 'c "d" &gt; e',
+                                         'version': '1'})
+        self.assertEqual(attributes[2]['user'], 'f/>g')
+        self.assertEqual(osm_parsers.parse_attributes(
+            ' id="1" lat="51.5" user="a>b"', ('id', 'uid')), {'id': '1'})
+
+    @unittest.skipIf(osm_parsers.lxml_etree is None, 'lxml not installed')
+    def test_lxml_frees_skipped_elements(self):
+        root = None
+        for element in osm_parsers.lxml_elements(self.path, ('node', 'way')):
+            if root is None:
+                root = element.getparent()
+        # only the last element is left; the relations were freed as well
+        self.assertEqual(len(root), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
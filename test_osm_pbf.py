@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that osm_pbf.py decodes a small .osm.pbf file, written here with a
+minimal protocol buffer encoder, into the elements an XML extract would give,
+including negative ids, dense nodes and zlib compressed blobs, with or without
+worker processes. Run with
+
+    python -m unittest test_osm_pbf
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import osm_parsers
+import osm_pbf
+
+
+def varint(value):
+    if value < 0:
+        value += 1 << 64
+    data = ''
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data += chr(byte | 0x80)
+        else:
+            return data + chr(byte)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def number_field(number, value):
+    return varint(number << 3) + varint(value)
+
+
+def bytes_field(number, data):
+    return varint(number << 3 | 2) + varint(len(data)) + data
+
+
+def packed(values):
+    return ''.join(varint(value) for value in values)
+
+
+def deltas(values):
+    return [zigzag(value - previous)
+            for previous, value in zip([0] + values, values)]
+
+
+STRINGS = ['', 'alice', 'highway', 'primary', 'name', 'Zo\xc3\xab', 'outer',
+           'type', 'multipolygon']
+
+
+def info(version, uid, user_sid):
+    return (number_field(1, version) + number_field(2, 1432672922) +
+            number_field(3, 100) + number_field(4, uid) +
+            number_field(5, user_sid))
+
+
+def primitive_block():
+    dense = (bytes_field(1, packed(deltas([-1, -2, 3]))) +
+             bytes_field(5, bytes_field(1, packed([1, 2, 1])) +
+                         bytes_field(2, packed(deltas([1432672922] * 3))) +
+                         bytes_field(3, packed(deltas([100] * 3))) +
+                         bytes_field(4, packed(deltas([10, 10, 11]))) +
+                         bytes_field(5, packed(deltas([1, 1, 5])))) +
+             bytes_field(8, packed(deltas([515007000, 515014000,
+                                           -1000]))) +
+             bytes_field(9, packed(deltas([-1246000, -1419000, 0]))) +
+             bytes_field(10, packed([4, 5, 0, 0, 2, 3, 0])))
+    node = (number_field(1, zigzag(-4)) + bytes_field(4, info(1, 10, 1)) +
+            number_field(8, zigzag(514995000)) +
+            number_field(9, zigzag(-1248000)))
+    way = (number_field(1, -10) + bytes_field(2, packed([2])) +
+           bytes_field(3, packed([3])) + bytes_field(4, info(2, 11, 1)) +
+           bytes_field(8, packed(deltas([-1, -2, 3]))))
+    relation = (number_field(1, -20) + bytes_field(2, packed([7])) +
+                bytes_field(3, packed([8])) +
+                bytes_field(8, packed([6, 0])) +
+                bytes_field(9, packed(deltas([-10, 3]))) +
+                bytes_field(10, packed([1, 0])))
+    return (bytes_field(1, ''.join(bytes_field(1, s) for s in STRINGS)) +
+            bytes_field(2, bytes_field(2, dense) + bytes_field(1, node)) +
+            bytes_field(2, bytes_field(3, way)) +
+            bytes_field(2, bytes_field(4, relation)))
+
+
+def blob(blob_type, data, compress):
+    if compress:
+        message = (number_field(2, len(data)) +
+                   bytes_field(3, zlib.compress(data)))
+    else:
+        message = bytes_field(1, data)
+    header = bytes_field(1, blob_type) + number_field(3, len(message))
+    return struct.pack('>I', len(header)) + header + message
+
+
+def pbf_file(compress):
+    bbox = (number_field(1, zigzag(-150000000)) +
+            number_field(2, zigzag(-110000000)) +
+            number_field(3, zigzag(51510000000)) +
+            number_field(4, zigzag(51490000000)))
+    return (blob('OSMHeader', bytes_field(1, bbox), compress) +
+            blob('OSMData', primitive_block(), compress))
+
+
+def dump(element):
+    return (element[0], element[1],
+            [(tag, sorted(attrib.items())) for tag, attrib in element[2]])
+
+
+class PbfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.osm.pbf')
+        with open(self.path, 'wb') as f:
+            f.write(pbf_file(compress=True))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def elements(self, workers=1, tags=('bounds', 'node', 'way',
+                                        'relation')):
+        return [dump(element) for element
+                in osm_pbf.iter_elements(self.path, tags, workers)]
+
+    def test_elements(self):
+        elements = self.elements()
+        self.assertEqual(elements[0], ('bounds', {
+            'minlon': '-0.1500000', 'maxlon': '-0.1100000',
+            'maxlat': '51.5100000', 'minlat': '51.4900000'}, []))
+        self.assertEqual(elements[1], ('node', {
+            'id': '-1', 'version': '1', 'timestamp': '2015-05-26T20:42:02Z',
+            'changeset': '100', 'uid': '10', 'user': 'alice',
+            'lat': '51.5007000', 'lon': '-0.1246000'},
+            [('tag', [('k', 'name'), ('v', u'Zo\xeb')])]))
+        self.assertEqual(elements[2][1]['id'], '-2')
+        self.assertEqual(elements[2][2], [])
+        self.assertEqual(elements[3][1]['id'], '3')
+        self.assertEqual(elements[3][1]['user'], u'Zo\xeb')
+        self.assertEqual(elements[3][1]['lat'], '-0.0001000')
+        self.assertEqual(elements[3][2],
+                         [('tag', [('k', 'highway'), ('v', 'primary')])])
+        self.assertEqual(elements[4][1]['id'], '-4')
+        self.assertEqual(elements[4][1]['lon'], '-0.1248000')
+
+    def test_negative_way_and_relation_ids(self):
+        way, relation = self.elements(tags=('way', 'relation'))
+        self.assertEqual(way[1]['id'], '-10')
+        self.assertEqual(way[1]['version'], '2')
+        self.assertEqual(way[2], [
+            ('nd', [('ref', '-1')]), ('nd', [('ref', '-2')]),
+            ('nd', [('ref', '3')]),
+            ('tag', [('k', 'highway'), ('v', 'primary')])])
+        self.assertEqual(relation[1], {'id': '-20'})
+        self.assertEqual(relation[2], [
+            ('member', [('ref', '-10'), ('role', 'outer'), ('type', 'way')]),
+            ('member', [('ref', '3'), ('role', ''), ('type', 'node')]),
+            ('tag', [('k', 'type'), ('v', 'multipolygon')])])
+
+    def test_raw_blobs_and_workers(self):
+        expected = self.elements()
+        self.assertEqual(self.elements(workers=2), expected)
+        with open(self.path, 'wb') as f:
+            f.write(pbf_file(compress=False))
+        self.assertEqual(self.elements(), expected)
+
+    def test_get_element(self):
+        ids = [element.get('id') for element
+               in osm_parsers.get_element(self.path, ('node', 'way'),
+                                          workers=1)]
+        self.assertEqual(ids, ['-1', '-2', '3', '-4', '-10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that osm_stream.run hands every top level element to each collector,
+and that profile_osm.py gets the same results in one pass as the scripts
+running their own passes. Run with
+
+    python -m unittest test_osm_stream
+"""
+
+import unittest
+import xml.etree.cElementTree as ET
+
+import audit
+import count_tags
+import key_types
+import osm_stream
+import profile_osm
+import users
+from test_data import ProcessMapTest
+
+
+class Recorder(object):
+    """Collector remembering the tag and id of every element it is given"""
+
+    def __init__(self):
+        self.seen = []
+
+    def element(self, elem):
+        self.seen.append((elem.tag, elem.get('id'), len(elem)))
+
+    def result(self):
+        return self.seen
+
+
+class StreamTest(ProcessMapTest):
+
+    def test_elements_then_root(self):
+        seen = osm_stream.run(self.path, [Recorder()])[0]
+        self.assertEqual(seen, [
+            ('bounds', None, 0), ('node', '1', 3), ('node', '2', 0),
+            ('node', '3', 3), ('node', '4', 0), ('way', '10', 6),
+            ('way', '11', 4), ('relation', '20', 2), ('osm', None, 0)])
+
+    def test_tag_counts(self):
+        expected = {}
+        for _, elem in ET.iterparse(self.path):
+            expected[elem.tag] = expected.get(elem.tag, 0) + 1
+        self.assertEqual(count_tags.count_tags(self.path), expected)
+
+    def test_profile_matches_scripts(self):
+        results = profile_osm.profile(self.path)
+        self.assertEqual(results['users'].count(),
+                         users.process_map(self.path).count())
+        self.assertEqual(results['tags'], count_tags.count_tags(self.path))
+        self.assertEqual(results['key_types'],
+                         key_types.process_map(self.path))
+        street_types, fixes = audit.audit(self.path)
+        self.assertEqual(results['street_types'], dict(street_types))
+        self.assertEqual(results['fixes'], fixes)
+        self.assertEqual(results['street_types'], {'St': set(['Bridge St'])})
+        self.assertEqual(results['fixes'], set(['2001-02-03']))
+
+    def test_extra_collectors(self):
+        results = profile_osm.profile(self.path, [Recorder()])
+        self.assertEqual(len(results['extra'][0]), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
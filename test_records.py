@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the records data.shape_record builds hold the rows of the
+element, and that as_dict() turns them back into the dictionaries schema.py
+describes. Run with
+
+    python -m unittest test_records
+"""
+
+import unittest
+import xml.etree.cElementTree as ET
+
+import data
+import records
+
+WAY = '''<way id="10" version="2" changeset="103" user="bob" uid="11" \
+timestamp="2014-07-08T09:10:11Z">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <nd ref="1"/>
+  <tag k="highway" v="primary"/>
+  <tag k="addr:street" v="Whitehall Rd"/>
+</way>'''
+
+NODE = '''<node id="3" lat="51.5033" lon="-0.1196" version="2" changeset="102" \
+user="Zoë" uid="12" timestamp="2016-02-03T04:05:06Z">
+  <tag k="name" v="London Eye"/>
+</node>'''
+
+
+class RecordsTest(unittest.TestCase):
+
+    def test_way(self):
+        shaped = data.shape_record(ET.fromstring(WAY))
+        self.assertEqual(shaped.tag, 'way')
+        self.assertEqual(shaped.way, records.Way(
+            '10', 'bob', '11', '2', '103', '2014-07-08T09:10:11Z'))
+        self.assertEqual(shaped.node_refs.typecode, records.REF_TYPECODE)
+        self.assertEqual(list(shaped.way_node_rows()),
+                         [('10', 1, 0), ('10', 2, 1), ('10', 1, 2)])
+        self.assertEqual(shaped.as_dict(), {
+            'way': {'id': '10', 'user': 'bob', 'uid': '11', 'version': '2',
+                    'changeset': '103',
+                    'timestamp': '2014-07-08T09:10:11Z'},
+            'way_nodes': [{'id': '10', 'node_id': 1, 'position': 0},
+                          {'id': '10', 'node_id': 2, 'position': 1},
+                          {'id': '10', 'node_id': 1, 'position': 2}],
+            'way_tags': [{'id': '10', 'key': 'highway', 'value': 'primary',
+                          'type': 'regular'},
+                         {'id': '10', 'key': 'street',
+                          'value': 'Whitehall Road', 'type': 'addr'}]})
+
+    def test_node(self):
+        shaped = data.shape_record(ET.fromstring(NODE))
+        self.assertEqual(shaped.tag, 'node')
+        self.assertEqual(shaped.as_dict(), {
+            'node': {'id': '3', 'lat': '51.5033', 'lon': '-0.1196',
+                     'user': u'Zoë', 'uid': '12', 'version': '2',
+                     'changeset': '102',
+                     'timestamp': '2016-02-03T04:05:06Z'},
+            'node_tags': [{'id': '3', 'key': 'name', 'value': 'London Eye',
+                           'type': 'regular'}]})
+        self.assertEqual(data.shape_element(ET.fromstring(NODE)),
+                         shaped.as_dict())
+
+    def test_relation(self):
+        self.assertIsNone(data.shape_record(ET.fromstring(
+            '<relation id="20"><tag k="type" v="route"/></relation>')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that sampling_osm.py copies whole elements, also when attribute
+values hold a raw ">", that the same seed gives the same sample, that each
+element type is sampled in proportion and that closure keeps every node of
+the sampled ways. Run with
+
+    python -m unittest test_sampling_osm
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import osm_parsers
+import sampling_osm
+import synth_osm
+from test_osm_parsers import OSM, dump
+
+
+def read_elements(path):
+    return [dump(element) for element
+            in osm_parsers.get_element(path, backend='etree')]
+
+
+class SampleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.osm')
+        self.sample_path = os.path.join(self.directory, 'sample.osm')
+        with open(self.path, 'wb') as f:
+            f.write(OSM)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def elements(self, path):
+        return read_elements(path)
+
+    def test_whole_file(self):
+        counts = sampling_osm.sample(self.path, self.sample_path,
+                                     fraction=1.0, seed=1)
+        self.assertEqual(counts, {'node': 3, 'way': 1, 'relation': 2})
+        self.assertEqual(self.elements(self.sample_path),
+                         self.elements(self.path))
+
+    def test_sampled_elements_are_whole(self):
+        expected = dict((element[1][0], element)
+                        for element in self.elements(self.path))
+        for seed in range(10):
+            sampling_osm.sample(self.path, self.sample_path, fraction=0.5,
+                                seed=seed, closure=True)
+            for element in self.elements(self.sample_path):
+                self.assertEqual(element, expected[element[1][0]])
+
+
+class SyntheticSampleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.osm')
+        self.sample_path = os.path.join(self.directory, 'sample.osm')
+        synth_osm.generate(self.path, nodes=1000, ways=100, relations=10,
+                           seed=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def elements(self, path):
+        return read_elements(path)
+
+    def test_seed(self):
+        sampling_osm.sample(self.path, self.sample_path, fraction=0.1, seed=5)
+        with open(self.sample_path, 'rb') as f:
+            first = f.read()
+        sampling_osm.sample(self.path, self.sample_path, fraction=0.1, seed=5)
+        with open(self.sample_path, 'rb') as f:
+            self.assertEqual(f.read(), first)
+        sampling_osm.sample(self.path, self.sample_path, fraction=0.1, seed=6)
+        with open(self.sample_path, 'rb') as f:
+            self.assertNotEqual(f.read(), first)
+
+    def test_stratify(self):
+        counts = sampling_osm.sample(self.path, self.sample_path,
+                                     fraction=0.1, seed=1)
+        self.assertEqual(counts, {'node': 100, 'way': 10, 'relation': 1})
+        ids = [int(element[1][0][1]) for element
+               in self.elements(self.sample_path)]
+        # elements stay in file order
+        self.assertEqual(len(ids), 111)
+        self.assertEqual(ids[:100], sorted(ids[:100]))
+
+    def test_closure(self):
+        counts = sampling_osm.sample(self.path, self.sample_path,
+                                     fraction=0.1, seed=2, closure=True)
+        elements = list(osm_parsers.get_element(self.sample_path,
+                                                backend='etree'))
+        nodes = set(element.get('id') for element in elements
+                    if element.tag == 'node')
+        self.assertEqual(len(nodes), counts['node'])
+        refs = set(child.get('ref') for element in elements
+                   if element.tag == 'way' for child in element
+                   if child.tag == 'nd')
+        self.assertTrue(refs)
+        self.assertTrue(refs <= nodes)
+
+    def test_size_and_compressed_output(self):
+        self.sample_path += '.gz'
+        sampling_osm.sample(self.path, self.sample_path,
+                            size=os.path.getsize(self.path) // 4, seed=1)
+        sampled = self.elements(self.sample_path)
+        whole = self.elements(self.path)
+        self.assertTrue(len(whole) // 8 < len(sampled) < len(whole) // 2)
+        for element in sampled:
+            self.assertIn(element, whole)
+
+if __name__ == '__main__':
+    unittest.main()
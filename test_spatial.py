@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that spatial.query_bbox finds the same nodes, ways and tags as
+scanning the tables, also right at the edges of the box, and that
+update_spatial_index follows nodes that move. Run with
+
+    python -m unittest test_spatial
+"""
+
+import random
+import sqlite3
+import unittest
+
+import data
+import spatial
+import synth_osm
+from test_data import ProcessMapTest
+
+NODES_SCAN = ('SELECT * FROM nodes WHERE lat BETWEEN ? AND ? '
+              'AND lon BETWEEN ? AND ?;')
+WAYS_SCAN = ('SELECT ways.* FROM ways JOIN (SELECT ways_nodes.id AS id, '
+             'min(lat) AS min_lat, max(lat) AS max_lat, min(lon) AS min_lon, '
+             'max(lon) AS max_lon FROM ways_nodes JOIN nodes '
+             'ON nodes.id = ways_nodes.node_id GROUP BY ways_nodes.id) b '
+             'ON b.id = ways.id WHERE b.min_lat <= ? AND b.max_lat >= ? '
+             'AND b.min_lon <= ? AND b.max_lon >= ?;')
+
+
+class SpatialTest(ProcessMapTest):
+    """Loads test.osm, as left by write_input, into test.db"""
+
+    def setUp(self):
+        super(SpatialTest, self).setUp()
+        self.write_input()
+        data.process_map(self.path, validate=False, dbname='test.db',
+                         write_csv=False)
+        self.db_conn = sqlite3.connect('test.db')
+
+    def tearDown(self):
+        self.db_conn.close()
+        super(SpatialTest, self).tearDown()
+
+    def write_input(self):
+        pass
+
+
+class QueryBboxTest(SpatialTest):
+
+    def test_extract(self):
+        # nodes 1 and 4, right on the edges of the box
+        found = spatial.query_bbox(self.db_conn, 51.4995, -0.1248,
+                                   51.5007, -0.1246)
+        self.assertEqual(sorted(node.id for node in found['nodes']), [1, 4])
+        self.assertEqual([way.id for way in found['ways']], [10])
+        self.assertEqual(sorted((tag.id, tag.key) for tag
+                                in found['nodes_tags']),
+                         [(1, 'name'), (1, 'postcode'), (1, 'street')])
+        self.assertEqual(len(found['ways_tags']), 3)
+        found = spatial.query_bbox(self.db_conn, 51.4995, -0.1248,
+                                   51.50069, -0.1246, tags=False)
+        self.assertEqual([node.id for node in found['nodes']], [4])
+        self.assertNotIn('nodes_tags', found)
+
+    def test_moved_node(self):
+        with self.db_conn:
+            self.db_conn.execute('UPDATE nodes SET lat = 51.6, lon = -0.2 '
+                                 'WHERE id = 4;')
+            spatial.update_spatial_index(self.db_conn, [4], [10])
+        found = spatial.query_bbox(self.db_conn, 51.59, -0.21, 51.61, -0.19)
+        self.assertEqual([node.id for node in found['nodes']], [4])
+        self.assertEqual([way.id for way in found['ways']], [10])
+        found = spatial.query_bbox(self.db_conn, 51.4990, -0.1250,
+                                   51.5000, -0.1240)
+        self.assertEqual(found['nodes'], [])
+
+
+class SyntheticQueryBboxTest(SpatialTest):
+
+    def write_input(self):
+        synth_osm.generate(self.path, nodes=3000, ways=300, relations=0,
+                           seed=5)
+
+    def test_same_as_scanning(self):
+        rng = random.Random(1)
+        (min_lat, max_lat, min_lon, max_lon), = self.db_conn.execute(
+            'SELECT min(lat), max(lat), min(lon), max(lon) FROM nodes;')
+        for _ in range(20):
+            lats = sorted(rng.uniform(min_lat, max_lat) for _ in range(2))
+            lons = sorted(rng.uniform(min_lon, max_lon) for _ in range(2))
+            found = spatial.query_bbox(self.db_conn, lats[0], lons[0],
+                                       lats[1], lons[1])
+            self.assertEqual(sorted(found['nodes']), sorted(
+                self.db_conn.execute(NODES_SCAN, lats + lons)))
+            self.assertEqual(sorted(found['ways']), sorted(
+                self.db_conn.execute(WAYS_SCAN, [lats[1], lats[0],
+                                                 lons[1], lons[0]])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that synth_osm.generate writes the same file for the same seed, with
+the elements and tags it reports, that the file goes through the pipeline,
+and that benchmark.py combines runs and flags regressions as it should. Run
+with
+
+    python -m unittest test_synth_osm
+"""
+
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.cElementTree as ET
+
+import benchmark
+import data
+import synth_osm
+import validation
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate(self, name, **kwargs):
+        path = os.path.join(self.directory, name)
+        counts = synth_osm.generate(path, **kwargs)
+        return path, counts
+
+    def test_same_seed_same_bytes(self):
+        first, _ = self.generate('first.osm', nodes=500, ways=60,
+                                 relations=10, seed=3)
+        second, _ = self.generate('second.osm', nodes=500, ways=60,
+                                  relations=10, seed=3)
+        other, _ = self.generate('other.osm', nodes=500, ways=60,
+                                 relations=10, seed=4)
+        self.assertEqual(read_bytes(first), read_bytes(second))
+        self.assertNotEqual(read_bytes(first), read_bytes(other))
+
+    def test_counts(self):
+        path, counts = self.generate('test.osm', nodes=400, ways=50,
+                                     relations=7, seed=1)
+        found = collections.Counter(elem.tag for _, elem
+                                    in ET.iterparse(path))
+        self.assertEqual(counts, {'node': 400, 'way': 50, 'relation': 7,
+                                  'tag': found['tag']})
+        for tag in ('node', 'way', 'relation'):
+            self.assertEqual(found[tag], counts[tag], tag)
+
+    def test_ways_refer_to_nodes(self):
+        path, _ = self.generate('test.osm', nodes=300, ways=40,
+                                relations=0, seed=2, closed_ways=0.5)
+        closed = 0
+        for _, elem in ET.iterparse(path):
+            if elem.tag != 'way':
+                continue
+            refs = [int(nd.get('ref')) for nd in elem.iter('nd')]
+            self.assertTrue(2 <= len(refs) <= 30, refs)
+            self.assertTrue(all(1 <= ref <= 300 for ref in refs), refs)
+            closed += refs[0] == refs[-1]
+        self.assertTrue(closed)
+
+    def test_shaped_elements_valid(self):
+        path, _ = self.generate('test.osm', nodes=300, ways=40,
+                                relations=5, seed=5)
+        validator = validation.SchemaValidator(data.SCHEMA)
+        shaped = 0
+        for element in data.get_element(path, ('node', 'way')):
+            data.validate_element(data.shape_element(element), validator)
+            shaped += 1
+        self.assertEqual(shaped, 340)
+
+
+def stage(seconds, count=1000, peak_rss=100 * 1048576):
+    result = benchmark.stage_result(seconds, count, 'rows')
+    result['peak_rss'] = peak_rss
+    return result
+
+
+class CompareTest(unittest.TestCase):
+
+    def stages(self, **stages):
+        return dict((name, stages.get(name, stage(1.0)))
+                    for name in benchmark.STAGES)
+
+    def results(self, **stages):
+        return {'stages': self.stages(**stages)}
+
+    def test_best_of(self):
+        runs = [(self.stages(parse=stage(2.0)), [['SELECT 1', 0.5]]),
+                (self.stages(parse=stage(1.5, peak_rss=200)),
+                 [['SELECT 1', 0.25]])]
+        stages, queries = benchmark.best_of(runs)
+        self.assertEqual(stages['parse']['seconds'], 1.5)
+        self.assertEqual(stages['parse']['peak_rss'], 100 * 1048576)
+        self.assertEqual(queries, [['SELECT 1', 0.25]])
+
+    def test_regressions(self):
+        baseline = self.results(db_load=stage(0.01))
+        self.assertEqual(benchmark.compare(baseline, baseline), [])
+        slower = self.results(parse=stage(1.5), db_load=stage(1.0))
+        regressions = benchmark.compare(slower, baseline)
+        # db_load is too quick in the baseline to be compared
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('parse: '))
+        bigger = self.results(shape=stage(1.0, peak_rss=200 * 1048576))
+        regressions = benchmark.compare(bigger, baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('peak RSS', regressions[0])
+        self.assertEqual(benchmark.compare(bigger, baseline, tolerance=1.5),
+                         [])
+
+
+if __name__ == '__main__':
+    unittest.main()
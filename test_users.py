@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that users.py counts the distinct uids exactly with exact=True and
+within its error with the default HyperLogLog, in each element type and
+time window, and that the counts of separate files merge into those of the
+whole. Run with
+
+    python -m unittest test_users
+"""
+
+import unittest
+
+import profile_osm
+import users
+from test_data import ProcessMapTest
+
+
+class UidSetTest(unittest.TestCase):
+
+    def test_add(self):
+        uid_set = users.UidSet()
+        uids = [(number * 7919) % 100003 for number in range(20000)]
+        for uid in uids:
+            uid_set.add(uid)
+        self.assertEqual(uid_set.count(), len(set(uids)))
+        self.assertIn(uids[-1], uid_set)
+        self.assertNotIn(100004, uid_set)
+        self.assertEqual(list(uid_set), sorted(set(uids)))
+        self.assertEqual(uid_set.pending, set())
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_error(self):
+        for count in (100, 5000, 100000):
+            sketch = users.HyperLogLog()
+            for uid in xrange(1, count + 1):
+                sketch.add(uid)
+                sketch.add(uid)
+            self.assertTrue(abs(sketch.count() - count) <= 3 * users.ERROR *
+                            count, (count, sketch.count()))
+
+    def test_merge(self):
+        whole, first, second = [users.HyperLogLog() for _ in range(3)]
+        for uid in xrange(1, 3001):
+            whole.add(uid)
+            (first if uid % 3 else second).add(uid)
+        first.merge(second)
+        self.assertEqual(first.registers, whole.registers)
+        self.assertRaises(ValueError, first.merge,
+                          users.HyperLogLog(error=0.1))
+
+
+class DistinctUsersTest(unittest.TestCase):
+
+    def test_default_is_approximate(self):
+        self.assertIsInstance(users.DistinctUsers().total, users.HyperLogLog)
+        self.assertIsInstance(users.UserCollector().users.total,
+                              users.HyperLogLog)
+        self.assertIsInstance(users.DistinctUsers(exact=True).total,
+                              users.UidSet)
+
+    def test_settings(self):
+        self.assertRaises(ValueError, users.DistinctUsers, window='week')
+        self.assertRaises(ValueError, users.DistinctUsers().merge,
+                          users.DistinctUsers(exact=True))
+
+    def test_merge_shards(self):
+        elements = [(uid % 97, ('node', 'way')[uid % 2],
+                     '2016-0{}-01T00:00:00Z'.format(uid % 9 + 1))
+                    for uid in range(1000)]
+        for exact in (True, False):
+            whole = users.DistinctUsers(exact, by_type=True, window='month')
+            shards = [users.DistinctUsers(exact, by_type=True,
+                                          window='month') for _ in range(3)]
+            for number, (uid, tag, timestamp) in enumerate(elements):
+                whole.add(uid, tag, timestamp)
+                shards[number % 3].add(uid, tag, timestamp)
+            for shard in shards[1:]:
+                shards[0].merge(shard)
+            self.assertEqual(shards[0].count(), whole.count())
+            self.assertEqual(shards[0].counts(), whole.counts())
+            expected = len(set(uid for uid, tag, timestamp in elements
+                               if tag == 'way' and
+                               timestamp.startswith('2016-02')))
+            self.assertEqual(whole.counts()[('way', '2016-02')], expected)
+
+
+class UsersMapTest(ProcessMapTest):
+
+    def test_counts(self):
+        self.assertEqual(users.process_map(self.path, exact=True).count(), 4)
+        self.assertEqual(users.process_map(self.path).count(), 4)
+        self.assertEqual(
+            users.process_map(self.path, exact=True, by_type=True).counts(),
+            {'node': 3, 'way': 2, 'relation': 1})
+        self.assertEqual(
+            users.process_map(self.path, window='year').counts(),
+            {'2014': 1, '2015': 1, '2016': 2, '2017': 1})
+
+    def test_profile_uses_default(self):
+        profiled = profile_osm.profile(self.path)['users']
+        counted = users.process_map(self.path)
+        self.assertEqual(profiled.exact, counted.exact)
+        self.assertEqual(profiled.total.registers, counted.total.registers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks that validation.SchemaValidator accepts and rejects the same shaped
+elements as cerberus, with the same errors, and that ValidationSampler picks
+the elements it should. Run with
+
+    python -m unittest test_validation
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+import data
+import schema
+import validation
+from test_data import EXTRACT
+
+try:
+    import cerberus
+except ImportError:
+    cerberus = None
+
+
+def invalid_copies(element):
+    """Yield copies of a shaped element, each broken in one way"""
+    top = 'node' if 'node' in element else 'way'
+    children = [field for field in element if field != top]
+
+    broken = copy.deepcopy(element)
+    del broken[top]['user']
+    yield broken
+    broken = copy.deepcopy(element)
+    broken[top]['id'] = 'not a number'
+    yield broken
+    broken = copy.deepcopy(element)
+    broken[top]['uid'] = None
+    yield broken
+    broken = copy.deepcopy(element)
+    broken[top]['version'] = 1
+    yield broken
+    broken = copy.deepcopy(element)
+    broken[top]['colour'] = 'red'
+    yield broken
+    broken = copy.deepcopy(element)
+    broken[top] = ['not', 'a', 'dict']
+    yield broken
+    broken = copy.deepcopy(element)
+    broken['unknown'] = []
+    yield broken
+    for child in children:
+        broken = copy.deepcopy(element)
+        broken[child] = 'not a list'
+        yield broken
+        broken = copy.deepcopy(element)
+        broken[child].append({'id': 'x'})
+        yield broken
+        broken = copy.deepcopy(element)
+        broken[child].append(None)
+        yield broken
+
+
+class SchemaValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'test.osm')
+            with open(path, 'wb') as f:
+                f.write(EXTRACT)
+            self.elements = [data.shape_element(element) for element
+                             in data.get_element(path, ('node', 'way'))]
+        finally:
+            shutil.rmtree(directory)
+
+    def test_valid_elements(self):
+        validator = validation.SchemaValidator(schema.schema)
+        for element in self.elements:
+            self.assertTrue(validator.validate(element))
+            self.assertEqual(validator.errors, {})
+
+    def test_invalid_elements(self):
+        validator = validation.SchemaValidator(schema.schema)
+        for element in self.elements:
+            for broken in invalid_copies(element):
+                self.assertFalse(validator.validate(broken), broken)
+                self.assertTrue(validator.errors)
+
+    @unittest.skipIf(cerberus is None, 'cerberus not installed')
+    def test_same_errors_as_cerberus(self):
+        validator = validation.SchemaValidator()
+        reference = cerberus.Validator()
+        for element in self.elements:
+            for document in [element] + list(invalid_copies(element)):
+                self.assertEqual(
+                    validator.validate(document, schema.schema),
+                    reference.validate(document, schema.schema), document)
+                self.assertEqual(validator.errors, reference.errors,
+                                 document)
+
+
+class ValidationSamplerTest(unittest.TestCase):
+
+    def test_every(self):
+        sampler = validation.ValidationSampler(every=3)
+        self.assertEqual([sampler() for _ in range(9)],
+                         [False, False, True] * 3)
+
+    def test_fraction_is_seeded(self):
+        sampler = validation.ValidationSampler(fraction=0.5, seed=7)
+        other = validation.ValidationSampler(fraction=0.5, seed=7)
+        self.assertEqual([sampler() for _ in range(100)],
+                         [other() for _ in range(100)])
+        first, second = sampler.for_shard(1), other.for_shard(2)
+        self.assertNotEqual([first() for _ in range(100)],
+                            [second() for _ in range(100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
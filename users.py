@@ -3,15 +3,46 @@
 
 """
 This file's main function, process_map, finds out how many unique users
-have contributed to the map for London by returning a set of unique user IDs
-("uid").
+have contributed to the map for London by counting the distinct user IDs
+("uid") of its nodes, ways and relations.
+
+The uids are counted in one of two ways:
+  - approximately (exact=False, the default), with a HyperLogLog sketch
+    whose size depends only on the relative error asked for (error=0.01
+    takes 16 KB), however many users the file has; the count is typically
+    within error of the true number
+  - exactly (exact=True), with a UidSet: the distinct uids as a sorted array
+    of 32 bit integers, 4 bytes a user, with the uids not seen before
+    gathered in a small set and merged into the array from time to time
+The counts can be broken down by element type (by_type=True) and by the
+year, month, day or hour of the element's timestamp (window='month', ...),
+each group having its own UidSet or HyperLogLog. process_map returns a
+DistinctUsers object: count() is the number of distinct users, counts() the
+number in each group, and merge() adds in the counts of another
+DistinctUsers, so that the counts of the shards of a big file (or of several
+files) can be made separately and then combined.
 
 NOTE: The concept of this code was taken from Udacity's OpenStreetMap Case
 Study Lesson and Quizzes.
 """
 
-import xml.etree.cElementTree as ET
+import math
 import pprint
+from array import array
+from bisect import bisect_left
+
+import osm_parsers
+
+# Relative standard error of the approximate counts
+ERROR = 0.01
+
+# The length of the timestamp prefix ("2015-05-26T20:42:02Z") naming a window
+WINDOWS = {'year': 4, 'month': 7, 'day': 10, 'hour': 13}
+
+# New uids gathered before they are merged into the sorted array, at least
+PENDING_SIZE = 4096
+
+MASK_64 = (1 << 64) - 1
 
 
 def get_user(element):
@@ -19,14 +50,198 @@ def get_user(element):
         return element.attrib['user']
 
 
-def process_map(filename):
-    users = set()
-    for _, element in ET.iterparse(filename):
-        if 'uid' in element.attrib:
-            users.add(element.attrib['uid'])
-    return users
+class UidSet(object):
+    """The exact set of distinct uids"""
+
+    def __init__(self):
+        self.uids = array('I')
+        self.pending = set()
+
+    def add(self, uid):
+        if uid in self.pending:
+            return
+        uids = self.uids
+        i = bisect_left(uids, uid)
+        if i < len(uids) and uids[i] == uid:
+            return
+        self.pending.add(uid)
+        if len(self.pending) >= max(PENDING_SIZE, len(uids) // 16):
+            self.flush()
+
+    def flush(self):
+        """Merge the new uids into the sorted array"""
+        if self.pending:
+            uids = array('I', self.uids)
+            uids.extend(self.pending)
+            self.uids = array('I', sorted(uids))
+            self.pending = set()
+
+    def merge(self, other):
+        other.flush()
+        for uid in other.uids:
+            self.add(uid)
+
+    def count(self):
+        return len(self.uids) + len(self.pending)
+
+    def __contains__(self, uid):
+        if uid in self.pending:
+            return True
+        i = bisect_left(self.uids, uid)
+        return i < len(self.uids) and self.uids[i] == uid
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.uids)
+
+
+def hash64(value):
+    """Return a well mixed 64 bit hash of an integer (the splitmix64
+    finalizer)"""
+    z = (value + 0x9E3779B97F4A7C15) & MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return z ^ (z >> 31)
+
+
+class HyperLogLog(object):
+    """Approximate count of distinct uids with a relative standard error of
+    about error, in 2**precision one byte registers"""
+
+    def __init__(self, error=ERROR):
+        self.error = error
+        precision = int(math.ceil(2 * math.log(1.04 / error, 2)))
+        self.precision = min(18, max(4, precision))
+        self.m = 1 << self.precision
+        self.registers = bytearray(self.m)
+
+    def add(self, uid):
+        h = hash64(uid)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge HyperLogLogs of precision {} and '
+                             '{}'.format(self.precision, other.precision))
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank
+                                       for rank in self.registers)
+        zeros = self.registers.count(b'\x00')
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small counts
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class DistinctUsers(object):
+    """The number of distinct uids overall and, with by_type or window, in
+    each group of elements of the same type and/or time window"""
+
+    def __init__(self, exact=False, error=ERROR, by_type=False, window=None):
+        if window is not None and window not in WINDOWS:
+            raise ValueError('window must be one of {}, not {!r}'.format(
+                ', '.join(sorted(WINDOWS)), window))
+        self.exact = exact
+        self.error = error
+        self.by_type = by_type
+        self.window = window
+        self.total = self.new_counter()
+        self.groups = {}
+        self._last = None
+
+    def new_counter(self):
+        return UidSet() if self.exact else HyperLogLog(self.error)
+
+    def group(self, tag, timestamp):
+        """Return the name of the group of an element in counts()"""
+        if self.window is None:
+            return tag
+        window = timestamp[:WINDOWS[self.window]] if timestamp else None
+        if not self.by_type:
+            return window
+        return (tag, window)
+
+    def add(self, uid, tag=None, timestamp=None):
+        if not (self.by_type or self.window):
+            if uid != self._last:
+                self._last = uid
+                self.total.add(uid)
+            return
+        group = self.group(tag, timestamp)
+        if (uid, group) == self._last:
+            return
+        self._last = (uid, group)
+        self.total.add(uid)
+        counter = self.groups.get(group)
+        if counter is None:
+            counter = self.groups[group] = self.new_counter()
+        counter.add(uid)
+
+    def merge(self, other):
+        """Add the uids counted by other, made with the same settings"""
+        settings = (self.exact, self.error, self.by_type, self.window)
+        if (other.exact, other.error, other.by_type, other.window) != settings:
+            raise ValueError('cannot merge counts made with different '
+                             'settings')
+        self.total.merge(other.total)
+        for group, counter in other.groups.iteritems():
+            if group not in self.groups:
+                self.groups[group] = self.new_counter()
+            self.groups[group].merge(counter)
+        self._last = None
+
+    def count(self):
+        return self.total.count()
+
+    def counts(self):
+        """Return the number of distinct uids of each group"""
+        return dict((group, counter.count())
+                    for group, counter in self.groups.iteritems())
+
+    def __len__(self):
+        return self.count()
+
+
+class UserCollector(object):
+    """osm_stream collector counting the distinct uids"""
+
+    def __init__(self, exact=False, error=ERROR, by_type=False, window=None):
+        self.users = DistinctUsers(exact, error, by_type, window)
+
+    def element(self, elem):
+        # only the top level elements carry a uid
+        uid = elem.get('uid')
+        if uid is not None:
+            self.users.add(int(uid), elem.tag, elem.get('timestamp'))
+
+    def result(self):
+        return self.users
+
+
+def process_map(filename, exact=False, error=ERROR, by_type=False,
+                window=None):
+    """Count the distinct uids of filename; lxml, the default parsing
+    backend when it is installed, skips the events of the <tag> and <nd>
+    children in C, which otherwise take most of the time"""
+    collector = UserCollector(exact, error, by_type, window)
+    for elem in osm_parsers.get_element(filename,
+                                        ('node', 'way', 'relation')):
+        collector.element(elem)
+    return collector.result()
 
 
 if __name__ == "__main__":
-    users = process_map('london_sample.osm')
-    print 'There are ' + str(len(users)) + ' unique users.'
+    users = process_map('london_sample.osm', by_type=True)
+    print 'There are ' + str(users.count()) + ' unique users.'
+    pprint.pprint(users.counts())
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This file compiles the schema from schema.py into plain Python checks so that
+data.py can validate every element of a full extract instead of only a small
+sample.
+
+cerberus.Validator walks the nested schema dictionary rule by rule for every
+element it validates. SchemaValidator does that walk once, when it is created,
+and keeps one small function per field that checks required fields, tries the
+coercion, checks the type and recurses into dicts and lists. It has the same
+validate()/errors interface as cerberus.Validator and reports the same error
+messages (e.g. 'required field', 'must be of integer type',
+"field 'id' cannot be coerced: ..."), so data.validate_element works with
+either.
+
+Almost every element of an extract is valid, so each schema is compiled
+twice: into a predicate that only answers whether a document is valid,
+without building any error lists, and into the checks above, which are only
+run to collect the errors of a document the predicate rejected.
+
+ValidationSampler decides which elements get validated at all: every one,
+every n-th one, or a random fraction of them.
+"""
+
+import random
+from collections import Mapping, Sequence
+
+TYPES = {
+    'dict': (Mapping, ()),
+    'float': ((float, int, long), ()),
+    'integer': ((int, long), ()),
+    'list': (Sequence, (basestring,)),
+    'string': (basestring, ()),
+}
+
+
+# The concrete types of the shaped elements, which pass a type check without
+# the (slow) abstract base class isinstance checks
+EXACT_TYPES = {
+    'dict': (dict,),
+    'float': (float, int, long),
+    'integer': (int, long),
+    'list': (list, tuple),
+    'string': (str, unicode),
+}
+
+
+def _type_check(type_name):
+    """Return a function testing if a value is of the cerberus type
+    type_name"""
+    included, excluded = TYPES[type_name]
+    exact = frozenset(EXACT_TYPES[type_name])
+
+    def check(value):
+        if type(value) in exact:
+            return True
+        return isinstance(value, included) and \
+            not isinstance(value, excluded)
+    return check
+
+
+def _compile_scalar(field, rule):
+    """Return a function listing the errors of a field value for a rule
+    without nested schema"""
+    is_type = _type_check(rule['type'])
+    type_error = 'must be of {0} type'.format(rule['type'])
+    coerce = rule.get('coerce')
+
+    def check(value):
+        coerce_error = None
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except Exception, msg:
+                coerce_error = "field '{0}' cannot be coerced: {1}".format(
+                    field, msg)
+        errors = []
+        if value is None:
+            errors.append('null value not allowed')
+        elif not is_type(value):
+            errors.append(type_error)
+        if coerce_error is not None:
+            errors.append(coerce_error)
+        return errors
+    return check
+
+
+def _compile_rule(field, rule):
+    """Return a function listing the errors of a field value for rule"""
+    if rule['type'] == 'dict' and 'schema' in rule:
+        check_mapping = _compile_mapping(rule['schema'])
+
+        def check(value):
+            if value is None:
+                return ['null value not allowed']
+            if not isinstance(value, Mapping):
+                return ['must be of dict type']
+            errors = check_mapping(value)
+            return [errors] if errors else []
+        return check
+
+    if rule['type'] == 'list' and 'schema' in rule:
+        check_item = _compile_rule(field, rule['schema'])
+        is_list = _type_check('list')
+
+        def check(value):
+            if value is None:
+                return ['null value not allowed']
+            if not is_list(value):
+                return ['must be of list type']
+            errors = {}
+            for i, item in enumerate(value):
+                item_errors = check_item(item)
+                if item_errors:
+                    errors[i] = item_errors
+            return [errors] if errors else []
+        return check
+
+    return _compile_scalar(field, rule)
+
+
+def _compile_mapping(schema):
+    """Return a function mapping a document to its cerberus style errors
+    dictionary, which is empty when the document is valid"""
+    checks = dict((field, _compile_rule(field, rule))
+                  for field, rule in schema.iteritems())
+    required = [field for field, rule in schema.iteritems()
+                if rule.get('required')]
+
+    def check(document):
+        errors = {}
+        for field, value in document.iteritems():
+            field_check = checks.get(field)
+            if field_check is None:
+                errors[field] = ['unknown field']
+                continue
+            field_errors = field_check(value)
+            if field_errors:
+                errors[field] = field_errors
+        for field in required:
+            if field not in document:
+                errors[field] = ['required field']
+        return errors
+    return check
+
+
+def _compile_valid_rule(rule):
+    """Return a predicate telling if a field value has no errors for rule"""
+    if rule['type'] == 'dict' and 'schema' in rule:
+        valid_mapping = _compile_valid_mapping(rule['schema'])
+
+        def valid(value):
+            return (type(value) is dict or isinstance(value, Mapping)) and \
+                valid_mapping(value)
+        return valid
+
+    is_type = _type_check(rule['type'])
+    if rule['type'] == 'list' and 'schema' in rule:
+        valid_item = _compile_valid_rule(rule['schema'])
+
+        def valid(value):
+            if value is None or not is_type(value):
+                return False
+            for item in value:
+                if not valid_item(item):
+                    return False
+            return True
+        return valid
+
+    valid_mapping = _compile_valid_mapping({'value': rule})
+    return lambda value: valid_mapping({'value': value})
+
+
+def _compile_valid_mapping(schema):
+    """Return a predicate telling if a document has no errors for schema;
+    the scalar fields are checked in the predicate itself, without a
+    function call each"""
+    fields = frozenset(schema)
+    required = frozenset(field for field, rule in schema.iteritems()
+                         if rule.get('required'))
+    scalars = []
+    nested = []
+    for field, rule in schema.iteritems():
+        if rule['type'] in ('dict', 'list') and 'schema' in rule:
+            nested.append((field, _compile_valid_rule(rule)))
+        else:
+            scalars.append((field, rule.get('coerce'),
+                            frozenset(EXACT_TYPES[rule['type']]),
+                            _type_check(rule['type'])))
+
+    def valid(document):
+        if not (fields.issuperset(document) and
+                required.issubset(document)):
+            return False
+        for field, coerce, exact, is_type in scalars:
+            if field not in document:
+                continue
+            value = document[field]
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except Exception:
+                    return False
+            if value is None or (type(value) not in exact and
+                                 not is_type(value)):
+                return False
+        for field, field_valid in nested:
+            if field in document and not field_valid(document[field]):
+                return False
+        return True
+    return valid
+
+
+class SchemaValidator(object):
+    """Validator with the cerberus.Validator interface, specialised to one
+    schema when it is created"""
+
+    def __init__(self, schema=None):
+        self.errors = {}
+        self._compiled = {}
+        self.schema = schema
+        if schema is not None:
+            self._checker(schema)
+
+    def _checker(self, schema):
+        """Return the validity predicate and the error checks of schema"""
+        # keyed on id() since schema dictionaries are not hashable; the
+        # schema itself is kept alongside so the id cannot be reused
+        compiled = self._compiled.get(id(schema))
+        if compiled is None:
+            compiled = (schema, _compile_valid_mapping(schema),
+                        _compile_mapping(schema))
+            self._compiled[id(schema)] = compiled
+        return compiled[1:]
+
+    def validate(self, document, schema=None):
+        if schema is None:
+            schema = self.schema
+        valid, check = self._checker(schema)
+        if valid(document):
+            self.errors = {}
+            return True
+        self.errors = check(document)
+        return not self.errors
+
+
+class ValidationSampler(object):
+    """Choose which elements to validate: all of them (the default), every
+    n-th one, or a seeded random fraction of them"""
+
+    def __init__(self, every=1, fraction=None, seed=None):
+        self.every = every
+        self.fraction = fraction
+        self.seed = seed
+        self._count = 0
+        self._random = random.Random(seed)
+
+    def for_shard(self, index):
+        """Return a fresh sampler for shard index of a parallel run"""
+        seed = None if self.seed is None else (self.seed, index)
+        return ValidationSampler(self.every, self.fraction, seed)
+
+    def __call__(self):
+        """Return True if the next element should be validated"""
+        if self.fraction is not None:
+            return self._random.random() < self.fraction
+        self._count += 1
+        return self._count % self.every == 0